@@ -0,0 +1,125 @@
+# cache_codec.py
+"""
+Serialización de valores de cache (Redis).
+
+Formato en Redis:
+- JSON plano, sin prefijo: lo que se guardó siempre. Se sigue escribiendo así
+  para valores chicos con el serializador por defecto, y se puede leer siempre.
+- Enmarcado: b"\\x00" + 1 byte de formato + payload.
+  nibble alto = serializador (1 json, 2 msgpack), nibble bajo = compresión
+  (0 ninguna, 1 zlib, 2 zstd). Ningún JSON empieza con \\x00, así que ambos
+  formatos conviven en la misma base.
+
+Configuración (env):
+  CACHE_SERIALIZER   json (default) | orjson | msgpack
+  CACHE_COMPRESS     auto (zstd si está instalado, si no zlib) | zstd | zlib | none
+  CACHE_COMPRESS_MIN bytes a partir de los cuales se comprime (default 4096)
+
+orjson, msgpack y zstandard son opcionales: si no están se usa json/zlib.
+"""
+import os
+import json
+import zlib
+
+try:
+    import orjson
+except Exception:
+    orjson = None
+try:
+    import msgpack
+except Exception:
+    msgpack = None
+try:
+    import zstandard
+except Exception:
+    zstandard = None
+
+MAGIC = 0x00
+SER_JSON, SER_MSGPACK = 1, 2
+COMP_NONE, COMP_ZLIB, COMP_ZSTD = 0, 1, 2
+
+
+def _json_dumps(v):
+    # str, mismo texto que json.dumps de siempre
+    return json.dumps(v)
+
+
+def _json_loads(b):
+    return orjson.loads(b) if orjson else json.loads(b)
+
+
+_SERIALIZERS = {
+    SER_JSON: (_json_dumps, _json_loads),
+}
+# orjson escribe JSON compacto: mismo formato (plano o SER_JSON), sólo más rápido
+_ORJSON = (orjson.dumps, orjson.loads) if orjson else None
+if msgpack:
+    _SERIALIZERS[SER_MSGPACK] = (
+        lambda v: msgpack.packb(v, use_bin_type=True),
+        lambda b: msgpack.unpackb(b, raw=False),
+    )
+
+_COMPRESSORS = {
+    COMP_NONE: (lambda b: b, lambda b: b),
+    COMP_ZLIB: (lambda b: zlib.compress(b, 6), zlib.decompress),
+}
+if zstandard:
+    _zc, _zd = zstandard.ZstdCompressor(level=3), zstandard.ZstdDecompressor()
+    _COMPRESSORS[COMP_ZSTD] = (_zc.compress, _zd.decompress)
+
+_SER_NAMES = {"json": SER_JSON, "msgpack": SER_MSGPACK}
+_COMP_NAMES = {"none": COMP_NONE, "zlib": COMP_ZLIB, "zstd": COMP_ZSTD}
+
+
+class Codec:
+    def __init__(self, serializer="json", compress="auto", compress_min=4096):
+        self.fast_json = serializer == "orjson" and _ORJSON is not None
+        ser = _SER_NAMES.get(serializer, SER_JSON)
+        self.serializer = ser if ser in _SERIALIZERS else SER_JSON
+        if compress == "auto":
+            comp = COMP_ZSTD if zstandard else COMP_ZLIB
+        else:
+            comp = _COMP_NAMES.get(compress, COMP_NONE)
+        self.compress = comp if comp in _COMPRESSORS else COMP_ZLIB
+        self.compress_min = compress_min
+
+    @property
+    def name(self):
+        ser = "orjson" if self.fast_json else {v: k for k, v in _SER_NAMES.items()}[self.serializer]
+        comp = {v: k for k, v in _COMP_NAMES.items()}[self.compress]
+        return f"{ser}+{comp}@{self.compress_min}"
+
+    def dumps(self, value):
+        enc = _ORJSON[0] if self.fast_json else _SERIALIZERS[self.serializer][0]
+        raw = enc(value)
+        big = self.compress != COMP_NONE and len(raw) >= self.compress_min
+        if self.serializer == SER_JSON and not big:
+            return raw  # JSON plano sin prefijo, legible por cualquier versión
+        if isinstance(raw, str):
+            raw = raw.encode("utf-8")
+        comp = self.compress if big else COMP_NONE
+        return bytes((MAGIC, (self.serializer << 4) | comp)) + _COMPRESSORS[comp][0](raw)
+
+    @staticmethod
+    def loads(raw):
+        if raw is None:
+            return None
+        if isinstance(raw, str):
+            return json.loads(raw)
+        if raw[:1] != b"\x00":
+            return _json_loads(raw)
+        fmt = raw[1]
+        ser, comp = fmt >> 4, fmt & 0x0F
+        if ser not in _SERIALIZERS or comp not in _COMPRESSORS:
+            raise ValueError(f"formato de cache desconocido: {fmt:#04x}")
+        return _SERIALIZERS[ser][1](_COMPRESSORS[comp][1](raw[2:]))
+
+
+default_codec = Codec(
+    serializer=os.getenv("CACHE_SERIALIZER", "json"),
+    compress=os.getenv("CACHE_COMPRESS", "auto"),
+    compress_min=int(os.getenv("CACHE_COMPRESS_MIN", "4096")),
+)
+
+dumps = default_codec.dumps
+loads = Codec.loads
@@ -0,0 +1,179 @@
+# cache_l1.py
+"""
+Cache L1 en memoria (por worker) delante de Redis.
+
+- LRU acotado por cantidad de entradas y con TTL corto: un hit no toca la red
+  ni hace json.loads.
+- Cada entrada guarda una versión (time_ns de quien la escribió). Cuando un
+  worker escribe o invalida una key, publica (key, versión) por Redis pub/sub y
+  los demás descartan su copia si es más vieja.
+- Quien llena el L1 desde Redis toma `snapshot(key)` ANTES del GET y lo pasa
+  a set(): si en el medio llegó una invalidación de esa key, el valor leído
+  puede ser viejo y no se guarda.
+- Los valores se comparten entre requests: tratarlos como sólo lectura.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+
+log = logging.getLogger("salbom.cache")
+
+INVALIDATION_CHANNEL = "salbom:cache:invalidate"
+
+
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=5.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()   # key -> (expires_at, version, value)
+        self._lock = threading.Lock()
+        # Generación por key (sube con cada invalidación) y época global (sube con clear)
+        self._gen = {}
+        self._epoch = 0
+        self.hits = self.misses = self.evictions = self.invalidations = self.stale_skips = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[0] <= now:
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def snapshot(self, key):
+        with self._lock:
+            return self._epoch, self._gen.get(key, 0)
+
+    def set(self, key, value, ttl=None, version=None, snapshot=None):
+        """Con `snapshot` (de antes de leer Redis) no guarda si la key se invalidó después."""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return False
+        with self._lock:
+            if snapshot is not None and snapshot != (self._epoch, self._gen.get(key, 0)):
+                self.stale_skips += 1
+                return False
+            self._data[key] = (time.monotonic() + ttl, version or time.time_ns(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def invalidate(self, key, version=None):
+        """Descarta la key; con `version`, sólo si la copia local es anterior."""
+        with self._lock:
+            # Aunque no haya copia local: un llenado desde Redis en curso no debe guardarse
+            self._gen[key] = self._gen.get(key, 0) + 1
+            if len(self._gen) > self.maxsize * 4:
+                self._gen.clear()
+                self._epoch += 1
+            entry = self._data.get(key)
+            if entry is None:
+                return False
+            if version is not None and entry[1] >= version:
+                return False
+            del self._data[key]
+            self.invalidations += 1
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._gen.clear()
+            self._epoch += 1
+
+    def stats(self):
+        with self._lock:
+            size = len(self._data)
+        total = self.hits + self.misses
+        return {
+            "size": size, "maxsize": self.maxsize, "ttl": self.ttl,
+            "hits": self.hits, "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else None,
+            "evictions": self.evictions, "invalidations": self.invalidations,
+            "stale_skips": self.stale_skips,
+        }
+
+
+class Invalidator:
+    """Publica y escucha invalidaciones en Redis para mantener coherentes los L1 de cada worker."""
+
+    def __init__(self, redis_client, cache, channel=INVALIDATION_CHANNEL):
+        self.redis = redis_client
+        self.cache = cache
+        self.channel = channel
+        self.node = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.hooks = {}
+        self._thread = None
+
+    def on(self, key, fn):
+        """Registra `fn()` para cuando otro worker invalide `key` (ej. un tag)."""
+        self.hooks[key] = fn
+
+    def publish(self, key, version):
+        if not self.redis:
+            return
+        try:
+            self.redis.publish(self.channel, json.dumps({"k": key, "v": version, "n": self.node}))
+        except Exception as e:
+            log.warning(f"[CACHE L1] publish {key} error: {e}")
+
+    def publish_many(self, keys, version):
+        """Una sola publicación para un lote de keys (cache_set_many)."""
+        if not self.redis or not keys:
+            return
+        try:
+            self.redis.publish(self.channel, json.dumps({"ks": list(keys), "v": version, "n": self.node}))
+        except Exception as e:
+            log.warning(f"[CACHE L1] publish {len(keys)} keys error: {e}")
+
+    def handle(self, raw):
+        try:
+            msg = json.loads(raw)
+        except Exception:
+            return
+        if msg.get("n") == self.node:
+            return
+        for k in msg.get("ks") or ():
+            self.cache.invalidate(k, msg.get("v"))
+        if "k" not in msg:
+            return
+        self.cache.invalidate(msg.get("k"), msg.get("v"))
+        hook = self.hooks.get(msg.get("k"))
+        if hook:
+            try:
+                hook()
+            except Exception as e:
+                log.warning(f"[CACHE L1] hook {msg.get('k')} error: {e}")
+
+    def start(self):
+        if not self.redis or self._thread:
+            return
+        self._thread = threading.Thread(target=self._listen, daemon=True, name="cache-l1-invalidator")
+        self._thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    if message and message.get("type") == "message":
+                        self.handle(message.get("data"))
+            except Exception as e:
+                # Si se corta la suscripción pudimos perder mensajes: vaciamos el L1
+                log.warning(f"[CACHE L1] suscripción caída ({e}); reintentando.")
+                self.cache.clear()
+                time.sleep(2)
@@ -0,0 +1,192 @@
+# cache_metrics.py
+"""
+Métricas de cache por namespace (el prefijo de la key hasta el primer ":",
+ej. facturas, prod_info_v14, cliente-direcciones, marcas_filtradas_app).
+
+Por namespace: hits (L1 / Redis), misses, errores, histograma de duración del
+fallback (lo que cuesta un miss) e histograma de tamaño del valor codificado.
+Las keys SWR (cache_swr.py) suman además `stale`: hits servidos vencidos (ya
+contados en hits) cuyo refresh en segundo plano también va a fallback_ms.
+Son contadores en memoria por worker: /metrics de cada worker reporta lo suyo
+(con el pid como etiqueta).
+
+`scan_report()` recorre Redis con SCAN (nunca KEYS) y agrupa cantidad de keys,
+memoria y TTL por namespace.
+"""
+import os
+import threading
+from bisect import bisect_left
+
+# Límites superiores de los buckets (estilo Prometheus, acumulativos)
+DURATION_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+SIZE_BUCKETS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_HIT_LAYERS = ("l1", "redis")
+
+
+def namespace(key):
+    if isinstance(key, bytes):
+        key = key.decode("utf-8", "replace")
+    return key.split(":", 1)[0] or "_"
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # el último es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        cumulative, acc = [], 0
+        for c in self.counts:
+            acc += c
+            cumulative.append(acc)
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "avg": round(self.sum / self.count, 3) if self.count else None,
+            "buckets": dict(zip([*map(str, self.buckets), "+Inf"], cumulative)),
+        }
+
+
+class _Namespace:
+    __slots__ = ("hits", "misses", "stale", "errors", "fallback_ms", "size_bytes")
+
+    def __init__(self):
+        self.hits = dict.fromkeys(_HIT_LAYERS, 0)
+        self.misses = 0
+        self.stale = 0
+        self.errors = 0
+        self.fallback_ms = Histogram(DURATION_BUCKETS_MS)
+        self.size_bytes = Histogram(SIZE_BUCKETS_BYTES)
+
+
+class CacheMetrics:
+    def __init__(self, max_namespaces=200):
+        # Tope por si alguna key sin ":" tiene ids adentro: lo que exceda va a "_other"
+        self.max_namespaces = max_namespaces
+        self._ns = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        name = namespace(key)
+        ns = self._ns.get(name)
+        if ns is None:
+            with self._lock:
+                if len(self._ns) >= self.max_namespaces and name not in self._ns:
+                    name = "_other"
+                ns = self._ns.setdefault(name, _Namespace())
+        return ns
+
+    def hit(self, key, layer="redis"):
+        self._get(key).hits[layer] += 1
+
+    def miss(self, key):
+        self._get(key).misses += 1
+
+    def stale(self, key):
+        self._get(key).stale += 1
+
+    def error(self, key):
+        self._get(key).errors += 1
+
+    def fallback(self, key, seconds):
+        self._get(key).fallback_ms.observe(seconds * 1000.0)
+
+    def size(self, key, nbytes):
+        self._get(key).size_bytes.observe(nbytes)
+
+    def reset(self):
+        with self._lock:
+            self._ns.clear()
+
+    def snapshot(self):
+        out = {}
+        for name, ns in sorted(self._ns.items()):
+            hits = sum(ns.hits.values())
+            total = hits + ns.misses
+            out[name] = {
+                "hits": dict(ns.hits),
+                "misses": ns.misses,
+                "stale": ns.stale,
+                "errors": ns.errors,
+                "hit_ratio": round(hits / total, 4) if total else None,
+                "fallback_ms": ns.fallback_ms.snapshot(),
+                "size_bytes": ns.size_bytes.snapshot(),
+            }
+        return out
+
+    def prometheus(self, prefix="salbom_cache"):
+        """Formato de texto de Prometheus (text/plain; version=0.0.4)."""
+        pid = os.getpid()
+        lines = [
+            f"# TYPE {prefix}_hits_total counter",
+            f"# TYPE {prefix}_misses_total counter",
+            f"# TYPE {prefix}_stale_total counter",
+            f"# TYPE {prefix}_errors_total counter",
+            f"# TYPE {prefix}_fallback_ms histogram",
+            f"# TYPE {prefix}_value_bytes histogram",
+        ]
+        for name, snap in self.snapshot().items():
+            lbl = f'namespace="{name}",pid="{pid}"'
+            for layer, n in snap["hits"].items():
+                lines.append(f'{prefix}_hits_total{{{lbl},layer="{layer}"}} {n}')
+            lines.append(f"{prefix}_misses_total{{{lbl}}} {snap['misses']}")
+            lines.append(f"{prefix}_stale_total{{{lbl}}} {snap['stale']}")
+            lines.append(f"{prefix}_errors_total{{{lbl}}} {snap['errors']}")
+            for metric, h in ((f"{prefix}_fallback_ms", snap["fallback_ms"]),
+                              (f"{prefix}_value_bytes", snap["size_bytes"])):
+                for le, n in h["buckets"].items():
+                    lines.append(f'{metric}_bucket{{{lbl},le="{le}"}} {n}')
+                lines.append(f"{metric}_sum{{{lbl}}} {h['sum']}")
+                lines.append(f"{metric}_count{{{lbl}}} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def scan_report(redis_client, match="*", count=1000, max_keys=200000, memory=True):
+    """
+    {namespace: {keys, memory_bytes, no_ttl, avg_ttl}} recorriendo Redis con SCAN.
+    MEMORY USAGE y TTL se piden en pipeline por cada lote del SCAN.
+    Corta a los `max_keys` keys (truncated=True en la respuesta).
+    """
+    report, seen, truncated = {}, 0, False
+    cursor = 0
+    while True:
+        cursor, keys = redis_client.scan(cursor=cursor, match=match, count=count)
+        if keys:
+            pipe = redis_client.pipeline(transaction=False)
+            for k in keys:
+                pipe.ttl(k)
+                if memory:
+                    pipe.memory_usage(k, samples=0)
+            res = pipe.execute()
+            step = 2 if memory else 1
+            for i, k in enumerate(keys):
+                ttl = res[i * step]
+                mem = res[i * step + 1] if memory else None
+                row = report.setdefault(namespace(k), {"keys": 0, "memory_bytes": 0, "no_ttl": 0, "_ttl_sum": 0, "_ttl_n": 0})
+                row["keys"] += 1
+                row["memory_bytes"] += mem or 0
+                if ttl is not None and ttl >= 0:
+                    row["_ttl_sum"] += ttl
+                    row["_ttl_n"] += 1
+                elif ttl == -1:
+                    row["no_ttl"] += 1
+            seen += len(keys)
+        if cursor == 0:
+            break
+        if seen >= max_keys:
+            truncated = True
+            break
+    for row in report.values():
+        n = row.pop("_ttl_n")
+        total = row.pop("_ttl_sum")
+        row["avg_ttl"] = round(total / n) if n else None
+    ordered = dict(sorted(report.items(), key=lambda kv: -kv[1]["memory_bytes"]))
+    return {"scanned": seen, "truncated": truncated, "namespaces": ordered}
@@ -1,32 +1,166 @@
-import json, time, threading, functools, os
-import redis
+"""
+Cache stale-while-revalidate sobre Redis.
 
-REDIS_URL = os.getenv("REDIS_URL")
-r = redis.Redis.from_url(REDIS_URL) if REDIS_URL else None
+Cada entrada se guarda como {"ts": epoch, "data": ...} con TTL = hard_ttl:
+- edad < soft_ttl            -> se sirve tal cual.
+- soft_ttl <= edad < hard_ttl -> se sirve el valor viejo y se agenda un refresh.
+- sin valor (venció el hard)  -> se calcula en el request.
 
-def swr_cache(key_fn, ttl=30, bg_ttl=300):
+Los refresh corren en un pool acotado, deduplicados por key (en el proceso y
+entre workers con un lock en Redis). Si un refresh falla, la key no se vuelve
+a intentar hasta que pase `error_backoff`, y mientras tanto se sigue sirviendo
+el valor viejo.
+
+No abre su propia conexión: `init_swr()` le pasa el cliente Redis y las
+funciones de lectura/escritura de main.py (cache_get / cache_setex), así las
+entradas SWR pasan por el L1, su invalidación por pub/sub y los tags.
+Con `metrics` (el CacheMetrics de main.py) se registran además, por namespace,
+los hits stale, la duración de cada cálculo (miss o refresh) y sus errores;
+hits, misses y tamaño ya los cuentan cache_get / cache_setex.
+"""
+import time, threading, functools, os, logging
+from concurrent.futures import ThreadPoolExecutor
+
+r = None          # cliente Redis (sólo para los locks de refresh)
+_get = None       # _get(key) -> valor | None
+_set = None       # _set(key, ttl, valor, tags)
+metrics = None    # CacheMetrics compartido con main.py (opcional)
+
+SWR_MAX_WORKERS = int(os.getenv("SWR_MAX_WORKERS", "4"))
+# Tope de refresh en cola/en curso por proceso; por encima se sirve stale sin agendar
+SWR_MAX_PENDING = int(os.getenv("SWR_MAX_PENDING", "64"))
+# Cuánto puede tardar un refresh antes de que otro worker lo reintente
+SWR_REFRESH_TIMEOUT = int(os.getenv("SWR_REFRESH_TIMEOUT", "120"))
+
+log = logging.getLogger("salbom.swr")
+
+_executor = ThreadPoolExecutor(max_workers=SWR_MAX_WORKERS, thread_name_prefix="swr")
+_inflight = set()
+_backoff_until = {}
+_lock = threading.Lock()
+stats = {"fresh": 0, "stale": 0, "miss": 0, "refreshes": 0, "refresh_errors": 0, "skipped": 0}
+
+
+def init_swr(redis_client, get_fn, set_fn, cache_metrics=None):
+    """Conecta el SWR al cache de main.py; sin redis_client los handlers corren directo."""
+    global r, _get, _set, metrics
+    r, _get, _set, metrics = redis_client, get_fn, set_fn, cache_metrics
+
+
+def _compute(key, compute):
+    """Corre el handler midiendo su duración (y sus errores) en las métricas."""
+    t0 = time.monotonic()
+    try:
+        data = compute()
+    except Exception:
+        if metrics:
+            metrics.error(key)
+        raise
+    if metrics:
+        metrics.fallback(key, time.monotonic() - t0)
+    return data
+
+
+def _lock_key(key):
+    return f"swr:lock:{key}"
+
+
+def swr_set(key, data, hard_ttl, tags=()):
+    """Guarda un valor ya calculado (ej. precalculado por un job)."""
+    if not r:
+        return
+    _set(key, hard_ttl, {"ts": time.time(), "data": data}, tags)
+
+
+def swr_get(key):
+    """(data, edad_en_seg) o (None, None)."""
+    if not r:
+        return None, None
+    payload = _get(key)
+    if not payload:
+        return None, None
+    if not isinstance(payload, dict) or "ts" not in payload:
+        return None, None  # valor en formato viejo (sin envoltorio): se recalcula
+    return payload.get("data"), time.time() - payload["ts"]
+
+
+def _run_refresh(key, compute, hard_ttl, error_backoff, tags=()):
+    try:
+        swr_set(key, _compute(key, compute), hard_ttl, tags)
+        stats["refreshes"] += 1
+        try:
+            r.delete(_lock_key(key))
+        except Exception:
+            pass
+    except Exception as e:
+        stats["refresh_errors"] += 1
+        log.warning(f"[SWR] refresh {key} falló: {e}; reintento en {error_backoff}s")
+        with _lock:
+            _backoff_until[key] = time.time() + error_backoff
+        try:
+            # El lock queda puesto durante el backoff: tampoco reintentan los otros workers
+            r.expire(_lock_key(key), error_backoff)
+        except Exception:
+            pass
+    finally:
+        with _lock:
+            _inflight.discard(key)
+
+
+def schedule_refresh(key, compute, hard_ttl, error_backoff=30, tags=()):
+    """Agenda un refresh en segundo plano. False si ya hay uno, está en backoff o el pool está lleno."""
+    now = time.time()
+    with _lock:
+        if (key in _inflight or _backoff_until.get(key, 0) > now
+                or len(_inflight) >= SWR_MAX_PENDING):
+            stats["skipped"] += 1
+            return False
+        _inflight.add(key)
+    try:
+        owner = r.set(_lock_key(key), "1", nx=True, ex=SWR_REFRESH_TIMEOUT)
+    except Exception:
+        owner = True
+    if not owner:
+        with _lock:
+            _inflight.discard(key)
+        stats["skipped"] += 1
+        return False
+    _executor.submit(_run_refresh, key, compute, hard_ttl, error_backoff, tags)
+    return True
+
+
+def swr_cache(key_fn, ttl=30, bg_ttl=300, error_backoff=30, tags=()):
+    """
+    ttl: soft TTL (seg) hasta el que el valor se considera fresco.
+    bg_ttl: hard TTL (seg); pasado ese tiempo el valor desaparece de Redis.
+    tags: tags de invalidación de la entrada (ver invalidate_tags en main.py).
+    """
     def decorator(handler):
         @functools.wraps(handler)
         def wrapper(*args, **kwargs):
             if not r:
                 return handler(*args, **kwargs)
             key = key_fn(*args, **kwargs)
-            raw = r.get(key)
-            now = int(time.time())
-            if raw:
-                payload = json.loads(raw)
-                if payload.get("ts", 0) + ttl >= now:
-                    return payload["data"]
-                def _bg_refresh():
-                    try:
-                        data = handler(*args, **kwargs)
-                        r.setex(key, bg_ttl, json.dumps({"ts": int(time.time()), "data": data}))
-                    except Exception:
-                        pass
-                threading.Thread(target=_bg_refresh, daemon=True).start()
-                return payload["data"]
-            data = handler(*args, **kwargs)
-            r.setex(key, bg_ttl, json.dumps({"ts": int(time.time()), "data": data}))
+            try:
+                data, age = swr_get(key)
+            except Exception as e:
+                log.warning(f"[SWR] get {key} error: {e}")
+                return handler(*args, **kwargs)
+            if age is not None:
+                if age < ttl:
+                    stats["fresh"] += 1
+                    return data
+                stats["stale"] += 1
+                if metrics:
+                    metrics.stale(key)
+                schedule_refresh(key, lambda: handler(*args, **kwargs), bg_ttl, error_backoff, tags)
+                return data
+            stats["miss"] += 1
+            data = _compute(key, lambda: handler(*args, **kwargs))
+            try:
+                swr_set(key, data, bg_ttl, tags)
+            except Exception as e:
+                log.warning(f"[SWR] set {key} error: {e}")
             return data
         return wrapper
     return decorator
@@ -0,0 +1,447 @@
+# dal.py
+"""
+Acceso a Postgres con pool de conexiones compartido por los hilos del worker.
+
+- `get_connection()` devuelve una conexión del pool envuelta: se usa igual que
+  la de psycopg2.connect y `close()` la devuelve al pool (con rollback si quedó
+  una transacción abierta). Si alguien se olvida el close, se devuelve al
+  recolectarse.
+- `connection()` es el context manager para código nuevo: commit al salir,
+  rollback si hubo excepción.
+- `transaction()` fija una conexión al hilo: los helpers (query, execute, ...)
+  llamados adentro la comparten y todo se confirma junto al salir. Fuera de una
+  transacción cada helper toma su conexión, confirma y la devuelve, y se
+  reintenta una vez si la conexión estaba rota (OperationalError).
+- Cada conexión nace con statement_timeout; se recicla pasada su vida máxima y
+  se verifica con SELECT 1 si estuvo ociosa más de PG_IDLE_CHECK seg.
+- Si el pool está lleno se espera hasta PG_POOL_TIMEOUT seg en vez de fallar
+  de inmediato, así se respeta el límite de conexiones de Postgres.
+- `prepared(name, sql)` registra una consulta caliente con nombre; los helpers
+  la aceptan en lugar del SQL y la preparan (PREPARE) en cada conexión la
+  primera vez que la usan ahí. Las siguientes llamadas van con EXECUTE: sin
+  parseo y, pasadas unas ejecuciones, con el plan genérico cacheado.
+"""
+import os
+import re
+import json
+import time
+import base64
+from datetime import datetime
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extras
+from psycopg2 import pool as pg_pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, QueryCanceledError
+
+log = logging.getLogger("salbom.dal")
+
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "1"))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "10"))
+PG_POOL_TIMEOUT = float(os.getenv("PG_POOL_TIMEOUT", "10"))
+PG_STATEMENT_TIMEOUT_MS = int(os.getenv("PG_STATEMENT_TIMEOUT_MS", "30000"))
+PG_CONN_MAX_LIFETIME = int(os.getenv("PG_CONN_MAX_LIFETIME", "1800"))
+PG_IDLE_CHECK = float(os.getenv("PG_IDLE_CHECK", "30"))
+PG_CONNECT_TIMEOUT = int(os.getenv("PG_CONNECT_TIMEOUT", "5"))
+PG_RETRIES = int(os.getenv("PG_RETRIES", "1"))
+# Opcional: "require" para forzar TLS (por defecto libpq usa "prefer")
+PG_SSLMODE = os.getenv("PG_SSLMODE")
+
+
+class PoolTimeout(pg_pool.PoolError):
+    """No se liberó ninguna conexión dentro de PG_POOL_TIMEOUT."""
+
+
+class PooledConnection:
+    """Proxy de la conexión psycopg2: todo se delega salvo close()."""
+
+    __slots__ = ("_pool", "_conn", "_closed")
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        if name in PooledConnection.__slots__:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    @property
+    def closed(self):
+        return 1 if self._closed else self._conn.closed
+
+    @property
+    def raw(self):
+        return self._conn
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._pool.putconn(self._conn)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def __del__(self):
+        try:
+            if not self._closed:
+                self.close()
+        except Exception:
+            pass
+
+
+class Pool:
+    def __init__(self, dsn, minconn=PG_POOL_MIN, maxconn=PG_POOL_MAX, timeout=PG_POOL_TIMEOUT,
+                 statement_timeout_ms=PG_STATEMENT_TIMEOUT_MS, max_lifetime=PG_CONN_MAX_LIFETIME,
+                 idle_check=PG_IDLE_CHECK, connect_timeout=PG_CONNECT_TIMEOUT):
+        self.dsn = dsn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.idle_check = idle_check
+        kwargs = {"connect_timeout": connect_timeout}
+        if PG_SSLMODE and "sslmode=" not in dsn:
+            kwargs["sslmode"] = PG_SSLMODE
+        if statement_timeout_ms:
+            kwargs["options"] = f"-c statement_timeout={int(statement_timeout_ms)}"
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, dsn, **kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._meta = {}          # id(conn) -> [created_at, last_used, prepared_names]
+        self._lock = threading.Lock()
+        self.pid = os.getpid()
+        self.counters = {"checkouts": 0, "waits": 0, "timeouts": 0, "recycled": 0, "broken": 0}
+
+    def _discard(self, conn):
+        with self._lock:
+            self._meta.pop(id(conn), None)
+        try:
+            self._pool.putconn(conn, close=True)
+        except Exception:
+            pass
+
+    def _healthy(self, conn, now):
+        meta = self._meta.get(id(conn))
+        if conn.closed:
+            self.counters["broken"] += 1
+            return False
+        if meta is None:
+            with self._lock:
+                self._meta[id(conn)] = [now, now, set()]
+            return True
+        if self.max_lifetime and now - meta[0] > self.max_lifetime:
+            self.counters["recycled"] += 1
+            return False
+        if self.idle_check and now - meta[1] > self.idle_check:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except Exception:
+                self.counters["broken"] += 1
+                return False
+        return True
+
+    def getconn(self):
+        if not self._slots.acquire(blocking=False):
+            self.counters["waits"] += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                self.counters["timeouts"] += 1
+                raise PoolTimeout(f"sin conexiones libres en {self.timeout}s (máx {self.maxconn})")
+        try:
+            for _ in range(3):
+                conn = self._pool.getconn()
+                now = time.monotonic()
+                if self._healthy(conn, now):
+                    self._meta[id(conn)][1] = now
+                    self.counters["checkouts"] += 1
+                    return PooledConnection(self, conn)
+                self._discard(conn)
+            raise psycopg2.OperationalError("no se pudo obtener una conexión sana del pool")
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        try:
+            if conn.closed:
+                self._discard(conn)
+                return
+            try:
+                if conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except Exception:
+                self._discard(conn)
+                return
+            meta = self._meta.get(id(conn))
+            if meta:
+                meta[1] = time.monotonic()
+            self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            conn.close()
+
+    def prepared_on(self, conn):
+        """Statements ya preparados en esta conexión (se pierden al descartarla)."""
+        meta = self._meta.get(id(conn))
+        return meta[2] if meta else set()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._meta)
+        return {"open": size, "max": self.maxconn, "idle": len(self._pool._pool), **self.counters}
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+# ───────── Pool del proceso ─────────
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def dsn():
+    return os.getenv("DATABASE_URL") or os.getenv("POSTGRES_URL") or os.getenv("DATABASE_URI")
+
+
+def get_pool(dsn_=None):
+    """Pool compartido; se crea en el primer uso (y de nuevo si el proceso se forkeó)."""
+    global _pool
+    dsn_ = dsn_ or dsn()
+    if not dsn_:
+        return None
+    p = _pool
+    if p is not None and p.pid == os.getpid():
+        return p
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = Pool(dsn_)
+            log.info(f"[PG] pool creado (máx {_pool.maxconn}, statement_timeout {PG_STATEMENT_TIMEOUT_MS}ms)")
+        return _pool
+
+
+def get_connection():
+    """Conexión del pool (close() la devuelve) o None si no hay DATABASE_URL."""
+    p = get_pool()
+    return p.getconn() if p else None
+
+
+@contextmanager
+def connection():
+    p = get_pool()
+    if p is None:
+        raise RuntimeError("DATABASE_URL no configurada")
+    with p.connection() as conn:
+        yield conn
+
+
+def stats():
+    return _pool.stats() if _pool is not None else None
+
+
+# ───────── Transacción por hilo y helpers tipados ─────────
+
+_local = threading.local()
+
+# Conexión caída o cerrada: se puede reintentar con otra. Un statement_timeout
+# (QueryCanceledError, subclase de OperationalError) no se reintenta. Las
+# escrituras sólo se reintentan si falló antes de mandarlas (al conectar):
+# después no se sabe si el servidor las aplicó y un INSERT quedaría doble.
+_RETRYABLE = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+@contextmanager
+def transaction():
+    """Una conexión y una transacción para todo el bloque (anidable: el interno se suma al externo)."""
+    current = getattr(_local, "conn", None)
+    if current is not None:
+        yield current
+        return
+    with connection() as conn:
+        _local.conn = conn
+        try:
+            yield conn
+        finally:
+            _local.conn = None
+
+
+def _run(fn, retries=None, read_only=False):
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            return fn(cur)
+    retries = PG_RETRIES if retries is None else retries
+    for attempt in range(retries + 1):
+        sent = False
+        try:
+            with connection() as conn:
+                with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                    sent = True
+                    return fn(cur)
+        except QueryCanceledError:
+            raise
+        except _RETRYABLE as e:
+            if attempt >= retries or (sent and not read_only):
+                raise
+            log.warning(f"[PG] conexión caída ({e}); reintento {attempt + 1}/{retries}")
+            time.sleep(0.2 * (attempt + 1))
+
+
+# ───────── Statements preparados ─────────
+
+class Prepared:
+    """Consulta con nombre. Se escribe con %s como el resto del código."""
+
+    __slots__ = ("name", "sql", "nparams")
+
+    def __init__(self, name, sql):
+        if not re.fullmatch(r"[a-z_][a-z0-9_]*", name):
+            raise ValueError(f"nombre de statement inválido: {name!r}")
+        self.name = name
+        self.nparams = len(re.findall(r"(?<!%)%s", sql))
+        n = iter(range(1, self.nparams + 1))
+        self.sql = re.sub(r"(?<!%)%s", lambda _: f"${next(n)}", sql).replace("%%", "%")
+
+    def __repr__(self):
+        return f"<Prepared {self.name}>"
+
+
+_PREPARED: Dict[str, Prepared] = {}
+
+
+def prepared(name: str, sql: str) -> Prepared:
+    """Registra (o devuelve, si ya existe con el mismo SQL) una consulta preparada."""
+    stmt = Prepared(name, sql)
+    current = _PREPARED.get(name)
+    if current is not None:
+        if current.sql != stmt.sql:
+            raise ValueError(f"statement {name!r} ya registrado con otro SQL")
+        return current
+    _PREPARED[name] = stmt
+    return stmt
+
+
+def registry() -> Dict[str, str]:
+    return {name: stmt.sql for name, stmt in _PREPARED.items()}
+
+
+def cursor_execute(cur, sql, params=None):
+    """cur.execute que además acepta un Prepared (para código que maneja su propia conexión del pool)."""
+    if not isinstance(sql, Prepared):
+        return cur.execute(sql, params)
+    params = tuple(params or ())
+    if len(params) != sql.nparams:
+        raise TypeError(f"{sql.name}: se esperaban {sql.nparams} parámetros, llegaron {len(params)}")
+    p = get_pool()
+    done = p.prepared_on(cur.connection) if p else set()
+    if sql.name not in done:
+        cur.execute(f"PREPARE {sql.name} AS {sql.sql}")
+        done.add(sql.name)
+    args = f" ({', '.join(['%s'] * sql.nparams)})" if sql.nparams else ""
+    try:
+        cur.execute(f"EXECUTE {sql.name}{args}", params or None)
+    except psycopg2.errors.InvalidSqlStatementName:
+        # Alguien hizo DEALLOCATE/DISCARD en la sesión: se vuelve a preparar en la próxima
+        done.discard(sql.name)
+        raise
+
+
+def query(sql: str, params: Any = None) -> List[Dict[str, Any]]:
+    """Filas como dicts. `sql` puede ser un Prepared."""
+    def fn(cur):
+        cursor_execute(cur, sql, params)
+        return [dict(r) for r in cur.fetchall()]
+    return _run(fn, read_only=True)
+
+
+def query_one(sql: str, params: Any = None) -> Optional[Dict[str, Any]]:
+    def fn(cur):
+        cursor_execute(cur, sql, params)
+        row = cur.fetchone()
+        return dict(row) if row else None
+    return _run(fn, read_only=True)
+
+
+def scalar(sql: str, params: Any = None, default: Any = None) -> Any:
+    """Primera columna de la primera fila."""
+    row = query_one(sql, params)
+    return next(iter(row.values())) if row else default
+
+
+def execute(sql: str, params: Any = None) -> int:
+    """INSERT/UPDATE/DELETE; devuelve rowcount."""
+    def fn(cur):
+        cursor_execute(cur, sql, params)
+        return cur.rowcount
+    return _run(fn)
+
+
+def execute_many(sql: str, seq_params: Iterable[Any], page_size: int = 100) -> None:
+    """Mismo statement para muchas filas (execute_batch: page_size filas por round trip)."""
+    seq_params = list(seq_params)
+    if not seq_params:
+        return
+    _run(lambda cur: psycopg2.extras.execute_batch(cur, sql, seq_params, page_size=page_size))
+
+
+def execute_values(sql: str, rows: Sequence[Sequence[Any]], template: Optional[str] = None,
+                   page_size: int = 1000, fetch: bool = False) -> Any:
+    """INSERT ... VALUES %s multi-fila; con fetch=True devuelve lo del RETURNING."""
+    if not rows:
+        return [] if fetch else 0
+    def fn(cur):
+        res = psycopg2.extras.execute_values(cur, sql, rows, template=template,
+                                             page_size=page_size, fetch=fetch)
+        return [dict(r) for r in res] if fetch else cur.rowcount
+    return _run(fn)
+
+
+# ───────── Cursores de paginación (keyset) ─────────
+# Opacos para el cliente: base64 de [valor_de_orden..., id] de la última fila
+# entregada. La página siguiente arranca con un WHERE sobre el índice en vez de
+# un OFFSET que recorre (y descarta) todas las filas anteriores.
+
+def encode_cursor(*values: Any) -> str:
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int = 2) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("cursor inválido")
+    return values
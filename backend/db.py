@@ -1,28 +1,39 @@
-import os
-from contextlib import contextmanager
-from sqlalchemy import create_engine, text
+import dal
+from pg_copy import copy_rows, content_hash, odoo_value
 
-DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_URL = dal.dsn()
 
-engine = create_engine(
-    DATABASE_URL,
-    pool_size=3, max_overflow=2, pool_pre_ping=True,
-    pool_recycle=1800, future=True
-)
+# Compatibilidad: una transacción del pool compartido (ver dal.transaction)
+db_session = dal.transaction
 
-@contextmanager
-def db_session():
-    with engine.begin() as conn:
-        yield conn
+PRODUCT_COLS = ["id","default_code","name","brand","category","price_list","currency","stock_qty"]
+PARTNER_COLS = ["id","name","vat","email","phone","salesperson_id"]
+# Columnas fuera del content_hash: stock_qty también la escribe update_stock_qty,
+# que no recalcula el hash, así que los upserts la comparan aparte
+UNHASHED_COLS = {"stock_qty"}
+
+def _prepare(rows, cols):
+    """Normaliza filas de Odoo y agrega content_hash (sin el id) para saltear las que no cambiaron."""
+    values = []
+    for r in rows:
+        v = {k: odoo_value(r.get(k)) for k in cols}
+        v["content_hash"] = content_hash(v[k] for k in cols[1:] if k not in UNHASHED_COLS)
+        values.append(v)
+    return values
+
+def _changed(table, cols):
+    """WHERE del ON CONFLICT: reescribe si cambió el hash, alguna columna fuera de él, o estaba borrada."""
+    extra = "".join(f"\n           or {table}.{c} is distinct from excluded.{c}" for c in cols if c in UNHASHED_COLS)
+    return (f"{table}.content_hash is distinct from excluded.content_hash{extra}"
+            f"\n           or {table}.deleted_utc is not null")
 
 def upsert_products(rows):
     if not rows:
         return 0
-    cols = ["id","default_code","name","brand","category","price_list","currency","stock_qty"]
-    values = [{k: r.get(k) for k in cols} for r in rows]
-    sql = text("""
-        insert into products (id, default_code, name, brand, category, price_list, currency, stock_qty, last_update_utc)
-        values (:id, :default_code, :name, :brand, :category, :price_list, :currency, :stock_qty, now())
+    values = _prepare(rows, PRODUCT_COLS)
+    sql = """
+        insert into products (id, default_code, name, brand, category, price_list, currency, stock_qty, content_hash, last_update_utc)
+        values (%(id)s, %(default_code)s, %(name)s, %(brand)s, %(category)s, %(price_list)s, %(currency)s, %(stock_qty)s, %(content_hash)s, now())
         on conflict (id) do update set
           default_code = excluded.default_code,
           name         = excluded.name,
@@ -31,45 +42,232 @@ def upsert_products(rows):
           price_list   = excluded.price_list,
           currency     = excluded.currency,
           stock_qty    = excluded.stock_qty,
-          last_update_utc = now();
-    """)
-    with db_session() as conn:
-        conn.execute(sql, values)
+          content_hash = excluded.content_hash,
+          deleted_utc  = null,
+          last_update_utc = now()
+        where """ + _changed("products", PRODUCT_COLS) + ";"
+    dal.execute_many(sql, values)
     return len(values)
 
 def upsert_partners(rows):
     if not rows:
         return 0
-    cols = ["id","name","vat","email","phone","salesperson_id"]
-    values = [{k: r.get(k) for k in cols} for r in rows]
-    sql = text("""
-        insert into partners (id, name, vat, email, phone, salesperson_id, last_update_utc)
-        values (:id, :name, :vat, :email, :phone, :salesperson_id, now())
+    values = _prepare(rows, PARTNER_COLS)
+    sql = """
+        insert into partners (id, name, vat, email, phone, salesperson_id, content_hash, last_update_utc)
+        values (%(id)s, %(name)s, %(vat)s, %(email)s, %(phone)s, %(salesperson_id)s, %(content_hash)s, now())
         on conflict (id) do update set
           name = excluded.name,
           vat  = excluded.vat,
           email= excluded.email,
           phone= excluded.phone,
           salesperson_id = excluded.salesperson_id,
-          last_update_utc = now();
-    """)
-    with db_session() as conn:
-        conn.execute(sql, values)
+          content_hash = excluded.content_hash,
+          deleted_utc  = null,
+          last_update_utc = now()
+        where partners.content_hash is distinct from excluded.content_hash
+           or partners.deleted_utc is not null;
+    """
+    dal.execute_many(sql, values)
     return len(values)
 
-def fetch_products(q=None, limit=50, offset=0):
-    where = ""
-    params = {"limit": limit, "offset": offset}
+# ───────── Carga masiva (COPY + merge) para syncs completos ─────────
+
+def _bulk_merge(table, cols, rows):
+    """
+    COPY a una tabla temporal (sin WAL, privada de la sesión, así las particiones
+    en paralelo no se pisan) y merge al destino en un solo INSERT ... ON CONFLICT.
+    Las filas con el mismo content_hash no se reescriben.
+    Devuelve (procesadas, escritas).
+    """
+    if not rows:
+        return 0, 0
+    # Último valor por id (ON CONFLICT no admite el mismo id dos veces)
+    values = list({v["id"]: v for v in _prepare(rows, cols)}.values())
+    all_cols = cols + ["content_hash"]
+    updates = ",\n          ".join(f"{c} = excluded.{c}" for c in all_cols[1:])
+    stage = f"{table}_stage"
+    with dal.transaction() as conn:
+        cur = conn.cursor()
+        cur.execute(f"create temp table {stage} (like {table} including defaults) on commit drop")
+        copy_rows(cur, stage, all_cols, ([v[c] for c in all_cols] for v in values))
+        cur.execute(f"""
+            insert into {table} ({", ".join(all_cols)}, last_update_utc)
+            select {", ".join(all_cols)}, now() from {stage}
+            on conflict (id) do update set
+              {updates},
+              deleted_utc = null,
+              last_update_utc = now()
+            where {_changed(table, cols)}
+        """)
+        written = cur.rowcount
+        cur.close()
+    return len(values), written
+
+def bulk_upsert_products(rows):
+    processed, _ = _bulk_merge("products", PRODUCT_COLS, rows)
+    return processed
+
+def bulk_upsert_partners(rows):
+    processed, _ = _bulk_merge("partners", PARTNER_COLS, rows)
+    return processed
+
+def update_stock_qty(rows):
+    """
+    Stock por COPY a una temporal + un solo UPDATE; sólo toca las filas cuyo
+    stock cambió. Devuelve las filas actualizadas.
+    """
+    if not rows:
+        return 0
+    values = {r["id"]: odoo_value(r.get("stock_qty")) for r in rows}
+    with dal.transaction() as conn:
+        cur = conn.cursor()
+        cur.execute("create temp table products_stock_stage (id bigint, stock_qty numeric(14,2)) on commit drop")
+        copy_rows(cur, "products_stock_stage", ["id", "stock_qty"], values.items())
+        cur.execute("""
+            update products p
+               set stock_qty = s.stock_qty, last_update_utc = now()
+              from products_stock_stage s
+             where p.id = s.id
+               and p.stock_qty is distinct from s.stock_qty
+        """)
+        updated = cur.rowcount
+        cur.close()
+    return updated
+
+# ───────── Búsqueda de productos (/productos_rapido) ─────────
+# Con q: substring (ILIKE) sobre name y default_code, resuelto con los índices
+# GIN de pg_trgm (migración 5), y ordenado por similitud: primero lo que más se
+# parece a lo buscado. Sin q: orden alfabético (índice (name, id)).
+# En ambos casos se pagina por keyset con el cursor de la última fila.
+
+PRODUCT_SEARCH_COLS = "id, default_code, name, brand, category, price_list, currency, stock_qty"
+
+def _like_escape(q):
+    return q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def products_search_query(q=None, limit=50, offset=0, cursor=None, table="products"):
+    """(sql, params) de la búsqueda; `table` existe para el benchmark (tools/bench_trgm.py)."""
+    params = {"limit": limit, "offset": 0 if cursor else offset}
+    where = "where deleted_utc is null"
     if q:
-        where = "where name ilike :q or default_code ilike :q"
-        params["q"] = f"%{q}%"
-    sql = text(f"""
-        select id, default_code, name, brand, category, price_list, currency, stock_qty
-        from products
+        params["q"] = q
+        params["like"] = f"%{_like_escape(q)}%"
+        where += " and (name ilike %(like)s or default_code ilike %(like)s)"
+        score = "greatest(similarity(name, %(q)s), similarity(coalesce(default_code, ''), %(q)s))"
+        if cursor:
+            params["c_score"], params["c_name"], params["c_id"] = dal.decode_cursor(cursor, 3)
+            where += f" and ({score}, %(c_name)s, %(c_id)s) < (%(c_score)s, name, id)"
+        return f"""
+            select {PRODUCT_SEARCH_COLS}, {score} as score
+            from {table}
+            {where}
+            order by score desc, name asc, id asc
+            limit %(limit)s offset %(offset)s
+        """, params
+    if cursor:
+        params["c_name"], params["c_id"] = dal.decode_cursor(cursor, 2)
+        where += " and (name, id) > (%(c_name)s, %(c_id)s)"
+    return f"""
+        select {PRODUCT_SEARCH_COLS}
+        from {table}
         {where}
-        order by name asc
-        limit :limit offset :offset
-    """)
-    with db_session() as conn:
-        res = conn.execute(sql, params).mappings().all()
-    return [dict(r) for r in res]
+        order by name asc, id asc
+        limit %(limit)s offset %(offset)s
+    """, params
+
+def search_products(q=None, limit=50, offset=0, cursor=None):
+    """{"rows", "next_cursor"}: una página y el cursor de la siguiente (None si no hay más)."""
+    sql, params = products_search_query(q, limit + 1, offset, cursor)
+    rows = dal.query(sql, params)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        keys = (last["score"], last["name"], last["id"]) if q else (last["name"], last["id"])
+        next_cursor = dal.encode_cursor(*keys)
+    for r in rows:
+        r.pop("score", None)
+    return {"rows": rows, "next_cursor": next_cursor}
+
+def fetch_products(q=None, limit=50, offset=0):
+    return search_products(q, limit, offset)["rows"]
+
+# ───────── Cursor de sincronización incremental ─────────
+
+def get_sync_state(model):
+    sql = """
+        select model, cursor_write_date, cursor_id, last_full_utc,
+               full_resume_id, full_mark_write_date, full_mark_id
+        from sync_state
+        where model = %(model)s
+    """
+    return dal.query_one(sql, {"model": model})
+
+def save_sync_state(model, write_date, last_id, full=False):
+    """Persiste el high-water mark (write_date, id). full=True marca además la última pasada completa."""
+    sql = """
+        insert into sync_state (model, cursor_write_date, cursor_id, last_full_utc, updated_utc)
+        values (%(model)s, %(write_date)s, %(last_id)s, case when %(full)s then now() end, now())
+        on conflict (model) do update set
+          cursor_write_date = excluded.cursor_write_date,
+          cursor_id         = excluded.cursor_id,
+          last_full_utc     = coalesce(excluded.last_full_utc, sync_state.last_full_utc),
+          updated_utc       = now();
+    """
+    dal.execute(sql, {"model": model, "write_date": write_date, "last_id": int(last_id), "full": bool(full)})
+
+def save_full_checkpoint(model, resume_id, mark_write_date=None, mark_id=None):
+    """
+    Checkpoint de una pasada completa en curso: último id procesado y la marca
+    (write_date, id) tomada al arrancar, que será el cursor al terminar.
+    """
+    sql = """
+        insert into sync_state (model, full_resume_id, full_mark_write_date, full_mark_id, updated_utc)
+        values (%(model)s, %(resume_id)s, %(mark_wd)s, %(mark_id)s, now())
+        on conflict (model) do update set
+          full_resume_id       = excluded.full_resume_id,
+          full_mark_write_date = coalesce(excluded.full_mark_write_date, sync_state.full_mark_write_date),
+          full_mark_id         = coalesce(excluded.full_mark_id, sync_state.full_mark_id),
+          updated_utc          = now();
+    """
+    dal.execute(sql, {"model": model, "resume_id": int(resume_id),
+                      "mark_wd": mark_write_date, "mark_id": mark_id})
+
+def finish_full_sync(model):
+    """Cierra la pasada completa: el cursor pasa a la marca inicial y se limpia el checkpoint."""
+    sql = """
+        update sync_state set
+          cursor_write_date    = coalesce(full_mark_write_date, cursor_write_date),
+          cursor_id            = coalesce(full_mark_id, cursor_id),
+          last_full_utc        = now(),
+          full_resume_id       = null,
+          full_mark_write_date = null,
+          full_mark_id         = null,
+          updated_utc          = now()
+        where model = %(model)s;
+    """
+    dal.execute(sql, {"model": model})
+
+# ───────── Tombstones (registros archivados/borrados en Odoo) ─────────
+
+TOMBSTONE_TABLES = ("products", "partners")
+
+def fetch_local_ids(table):
+    """Ids vivos del espejo, ordenados (para diferencia por merge con los de Odoo)."""
+    assert table in TOMBSTONE_TABLES
+    return [r["id"] for r in dal.query(f"select id from {table} where deleted_utc is null order by id")]
+
+def mark_deleted(table, ids, hard=False, chunk=10000):
+    """Marca (o borra, con hard=True) en bloque las filas que ya no existen en Odoo."""
+    assert table in TOMBSTONE_TABLES
+    if hard:
+        sql = f"delete from {table} where id = any(%(ids)s)"
+    else:
+        sql = f"update {table} set deleted_utc = now() where id = any(%(ids)s) and deleted_utc is null"
+    done = 0
+    with dal.transaction():
+        for i in range(0, len(ids), chunk):
+            done += dal.execute(sql, {"ids": list(ids[i:i + chunk])})
+    return done
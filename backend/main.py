@@ -4,6 +4,9 @@ import json
 import base64
 import traceback
 import time
+import math
+import random
+import uuid
 import logging
 import threading  # <--- Necesario para Thread Local y Lock
 from datetime import datetime, timedelta
@@ -18,7 +21,7 @@ import urllib.parse
 import ssl
 import requests
 import psycopg2 
-from psycopg2.extras import RealDictCursor 
+from psycopg2.extras import RealDictCursor, execute_values
 
 # --- IMPORTANTE: Importar odooly correctamente ---
 import odooly as odoo
@@ -30,17 +33,27 @@ import redis
 
 # ==== Sync & DB (opcionales) ====
 try:
-    from sync_worker import sync_products, sync_partners
+    from sync_worker import sync_products, sync_partners, sync_stock, run_partitioned_sync
     HAS_SYNC = True
 except Exception:
     HAS_SYNC = False
 
 try:
-    from db import fetch_products  # para endpoint rápido
+    from db import search_products  # para endpoint rápido
     HAS_DB = True
 except Exception:
     HAS_DB = False
 
+import offer_engine
+import cache_codec
+import dal
+import migrations
+import write_behind
+from cache_l1 import LRUCache, Invalidator
+from cache_metrics import CacheMetrics, namespace, scan_report
+from scheduler import Lease
+from cache_swr import init_swr, swr_cache, swr_set, stats as swr_stats
+
 # Opcionales (solo si los usás para R2 debug)
 try:
     from r2_debug import list_keys, head_key, find_media_for_code
@@ -78,39 +91,365 @@ if REDIS_URL:
 
 CACHE_EXPIRATION = 300  # seg
 
-def cache_get(k):
+# L1 por worker delante de Redis (ver cache_l1.py); TTL corto, coherencia por pub/sub
+CACHE_L1_SIZE = int(os.getenv("CACHE_L1_SIZE", "2048"))
+CACHE_L1_TTL = float(os.getenv("CACHE_L1_TTL", "5"))
+l1_cache = LRUCache(maxsize=CACHE_L1_SIZE, ttl=CACHE_L1_TTL)
+l1_invalidator = Invalidator(redis_client, l1_cache)
+if redis_client and CACHE_L1_TTL > 0:
+    l1_invalidator.start()
+
+_cache_counters = {"redis_hits": 0, "redis_misses": 0}
+# Hits/misses/errores, costo del fallback y tamaño por namespace (ver cache_metrics.py y /metrics)
+cache_metrics = CacheMetrics()
+
+def cache_get(k, record=True):
     if not redis_client:
         return None
+    v = l1_cache.get(k)
+    if v is not None:
+        if record:
+            cache_metrics.hit(k, "l1")
+        return v
+    snap = l1_cache.snapshot(k)
     try:
-        v = redis_client.get(k)
-        if v:
-            return json.loads(v)
+        raw = redis_client.get(k)
+        if raw:
+            _cache_counters["redis_hits"] += 1
+            v = cache_codec.loads(raw)
+            l1_cache.set(k, v, snapshot=snap)
+            if record:
+                cache_metrics.hit(k, "redis")
+            return v
+        _cache_counters["redis_misses"] += 1
+        if record:
+            cache_metrics.miss(k)
     except Exception as e:
+        cache_metrics.error(k)
         log.warning(f"[CACHE] get {k} error: {e}")
     return None
 
-def cache_setex(k, ttl, v):
+# Tags: cada key cacheada puede anotarse en sets `tag:<tag>` (product:<id>,
+# partner:<id>, offers, config:<key>) y las mutaciones invalidan por tag.
+CACHE_TAG_TTL = int(os.getenv("CACHE_TAG_TTL", str(7 * 86400)))
+
+def _tag_key(tag):
+    return f"tag:{tag}"
+
+def cache_setex(k, ttl, v, tags=(), record=True):
     if not redis_client:
         return
     try:
-        redis_client.setex(k, ttl, json.dumps(v))
+        blob = cache_codec.dumps(v)
+        if tags:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.setex(k, ttl, blob)
+            for tag in tags:
+                pipe.sadd(_tag_key(tag), k)
+                pipe.expire(_tag_key(tag), max(CACHE_TAG_TTL, ttl))
+            pipe.execute()
+        else:
+            redis_client.setex(k, ttl, blob)
     except Exception as e:
+        cache_metrics.error(k)
         log.warning(f"[CACHE] setex {k} error: {e}")
+        return
+    if record:
+        cache_metrics.size(k, len(blob))
+    version = time.time_ns()
+    l1_cache.set(k, v, ttl=ttl, version=version)
+    l1_invalidator.publish(k, version)
+
+# El SWR (cache_swr.py) lee y escribe por acá: L1, pub/sub, tags y métricas incluidos
+init_swr(redis_client, cache_get, cache_setex, cache_metrics)
+
+def cache_delete(*keys):
+    """Borra las keys en Redis y en el L1 de todos los workers."""
+    if not redis_client or not keys:
+        return
+    try:
+        redis_client.delete(*keys)
+    except Exception as e:
+        log.warning(f"[CACHE] delete {keys} error: {e}")
+    version = time.time_ns()
+    for k in keys:
+        l1_cache.invalidate(k)
+        l1_invalidator.publish(k, version)
 
-def get_cache_or_execute(key: str, ttl: int = 300, fallback_fn=None):
-    cached = cache_get(key)
-    if cached is not None:
-        log.info(f"✅ Redis hit: {key}")
-        return cached
-    result = None
+# ── API batch: muchas keys chicas en un round trip ──
+
+def cache_get_many(keys):
+    """{key: valor} de las keys presentes: L1 primero y un solo MGET para el resto."""
+    if not redis_client or not keys:
+        return {}
+    out, missing = {}, []
+    for k in keys:
+        v = l1_cache.get(k)
+        if v is not None:
+            out[k] = v
+            cache_metrics.hit(k, "l1")
+        else:
+            missing.append(k)
+    if not missing:
+        return out
+    snaps = {k: l1_cache.snapshot(k) for k in missing}
+    try:
+        raws = redis_client.mget(missing)
+    except Exception as e:
+        cache_metrics.error(missing[0])
+        log.warning(f"[CACHE] mget {len(missing)} keys error: {e}")
+        return out
+    for k, raw in zip(missing, raws):
+        if raw:
+            _cache_counters["redis_hits"] += 1
+            cache_metrics.hit(k, "redis")
+            out[k] = cache_codec.loads(raw)
+            l1_cache.set(k, out[k], snapshot=snaps[k])
+        else:
+            _cache_counters["redis_misses"] += 1
+            cache_metrics.miss(k)
+    return out
+
+def cache_set_many(items, ttl, tags=()):
+    """Guarda {key: valor} con un solo pipeline de SETEX (y SADD de tags)."""
+    if not redis_client or not items:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for k, v in items.items():
+            blob = cache_codec.dumps(v)
+            cache_metrics.size(k, len(blob))
+            pipe.setex(k, ttl, blob)
+        for tag in tags:
+            pipe.sadd(_tag_key(tag), *items.keys())
+            pipe.expire(_tag_key(tag), max(CACHE_TAG_TTL, ttl))
+        pipe.execute()
+    except Exception as e:
+        log.warning(f"[CACHE] set_many {len(items)} keys error: {e}")
+        return
+    version = time.time_ns()
+    for k, v in items.items():
+        l1_cache.set(k, v, ttl=ttl, version=version)
+    l1_invalidator.publish_many(items.keys(), version)
+
+def get_many_or_execute(keys, batch_fallback, ttl: int = 300, tags=()):
+    """
+    {key: valor} para `keys`. Lo que no está en cache se pide en UNA llamada a
+    `batch_fallback(missing_keys) -> {key: valor}` y se guarda en lote.
+    Los None no se cachean.
+    """
+    found = cache_get_many(keys)
+    missing = [k for k in keys if k not in found]
+    if missing and batch_fallback:
+        t0 = time.monotonic()
+        try:
+            fresh = batch_fallback(missing) or {}
+        except Exception as e:
+            cache_metrics.error(missing[0])
+            log.error(f"[batch_fallback:{len(missing)} keys] {e}")
+            fresh = {}
+        cache_metrics.fallback(missing[0], time.monotonic() - t0)
+        fresh = {k: v for k, v in fresh.items() if v is not None}
+        cache_set_many(fresh, ttl, tags=tags)
+        found.update(fresh)
+    return found
+
+_tag_hooks = {}
+
+def on_tag_invalidated(tag, fn):
+    """`fn()` corre en todos los workers cuando se invalida `tag` (ej. recargar el índice de ofertas)."""
+    _tag_hooks[tag] = fn
+    l1_invalidator.on(_tag_key(tag), fn)
+
+def invalidate_tags(*tags):
+    """Borra todas las keys registradas bajo cada tag (con su sidecar :meta) en Redis y en los L1."""
+    dropped = 0
+    for tag in tags:
+        if redis_client:
+            try:
+                members = [m.decode() if isinstance(m, bytes) else m
+                           for m in redis_client.smembers(_tag_key(tag))]
+                if members:
+                    cache_delete(*members, *[_meta_key(m) for m in members])
+                    dropped += len(members)
+                redis_client.delete(_tag_key(tag))
+            except Exception as e:
+                log.warning(f"[CACHE] invalidate tag {tag} error: {e}")
+            l1_invalidator.publish(_tag_key(tag), time.time_ns())
+        hook = _tag_hooks.get(tag)
+        if hook:
+            try:
+                hook()
+            except Exception as e:
+                log.warning(f"[CACHE] hook tag {tag} error: {e}")
+    if dropped:
+        log.info(f"[CACHE] invalidados {dropped} keys por tags {tags}")
+    return dropped
+
+def cache_stats():
+    return {"l1": l1_cache.stats(), **_cache_counters, "namespaces": cache_metrics.snapshot()}
+
+# ── Protección contra estampida ──
+# Sólo un worker recalcula una key (lock en Redis); el resto espera un poco a
+# que aparezca el valor. Además, XFetch: cada entrada guarda en `<key>:meta`
+# cuánto tardó en calcularse y cuándo vence, y cada hit decide al azar si la
+# refresca antes de tiempo (más probable cuanto más cara y más cerca del TTL).
+CACHE_XFETCH_BETA = float(os.getenv("CACHE_XFETCH_BETA", "1.0"))
+CACHE_LOCK_WAIT = float(os.getenv("CACHE_LOCK_WAIT", "3"))
+# El lock dura 3x lo que costó calcular la key la última vez (mínimo CACHE_LOCK_TTL).
+# El meta sobrevive CACHE_META_GRACE seg al valor, así un miss todavía sabe el costo;
+# si no hay meta se usa el último costo visto en el namespace (por proceso).
+CACHE_LOCK_TTL = float(os.getenv("CACHE_LOCK_TTL", "5"))
+CACHE_META_GRACE = int(os.getenv("CACHE_META_GRACE", "3600"))
+_ns_delta = {}
+
+def _meta_key(key):
+    return f"{key}:meta"
+
+def _cache_get_with_meta(key):
+    """(valor, meta) pasando por el L1; un solo MGET a Redis si no está local."""
+    if not redis_client:
+        return None, None
+    v = l1_cache.get(key)
+    if v is not None:
+        cache_metrics.hit(key, "l1")
+        return v, l1_cache.get(_meta_key(key))
+    snap, snap_meta = l1_cache.snapshot(key), l1_cache.snapshot(_meta_key(key))
+    try:
+        raw, raw_meta = redis_client.mget([key, _meta_key(key)])
+    except Exception as e:
+        cache_metrics.error(key)
+        log.warning(f"[CACHE] mget {key} error: {e}")
+        return None, None
+    meta = cache_codec.loads(raw_meta) if raw_meta else None
+    if not raw:
+        _cache_counters["redis_misses"] += 1
+        cache_metrics.miss(key)
+        return None, meta
+    _cache_counters["redis_hits"] += 1
+    cache_metrics.hit(key, "redis")
+    v = cache_codec.loads(raw)
+    l1_cache.set(key, v, snapshot=snap)
+    if meta:
+        l1_cache.set(_meta_key(key), meta, snapshot=snap_meta)
+    return v, meta
+
+def _xfetch_due(meta, now=None):
+    """True si toca refrescar antes de vencer: now - delta*beta*ln(rand) >= expiry."""
+    if not meta or not meta.get("delta") or not meta.get("exp"):
+        return False
+    now = now or time.time()
+    r = random.random() or 1e-12
+    return now - meta["delta"] * CACHE_XFETCH_BETA * math.log(r) >= meta["exp"]
+
+def _lock_ttl(key, meta):
+    delta = (meta or {}).get("delta") or _ns_delta.get(namespace(key), 0)
+    return max(CACHE_LOCK_TTL, delta * 3)
+
+def _recompute(key, ttl, fallback_fn, tags=()):
+    t0 = time.monotonic()
     try:
         result = fallback_fn() if fallback_fn else None
     except Exception as e:
+        cache_metrics.error(key)
         log.error(f"[fallback_fn:{key}] {e}")
+        return None
+    cache_metrics.fallback(key, time.monotonic() - t0)
     if result is not None:
-        cache_setex(key, ttl, result)
+        delta = round(time.monotonic() - t0, 4)
+        _ns_delta[namespace(key)] = delta
+        cache_setex(key, ttl, result, tags=tags)
+        cache_setex(_meta_key(key), ttl + CACHE_META_GRACE, {"delta": delta, "exp": time.time() + ttl},
+                    record=False)
     return result
 
+def get_cache_or_execute(key: str, ttl: int = 300, fallback_fn=None, tags=()):
+    cached, meta = _cache_get_with_meta(key)
+    if cached is not None:
+        log.debug(f"✅ cache hit: {key}")
+        if _xfetch_due(meta):
+            lock = Lease(redis_client, f"lock:{key}", _lock_ttl(key, meta), heartbeat=False)
+            if lock.acquire():
+                try:
+                    fresh = _recompute(key, ttl, fallback_fn, tags)
+                finally:
+                    lock.release()
+                if fresh is not None:
+                    return fresh
+        return cached
+
+    if not redis_client:
+        return _recompute(key, ttl, fallback_fn, tags)
+
+    lock = Lease(redis_client, f"lock:{key}", _lock_ttl(key, meta), heartbeat=False)
+    if lock.acquire():
+        try:
+            return _recompute(key, ttl, fallback_fn, tags)
+        finally:
+            lock.release()
+    if lock.error:
+        # Redis caído: nadie va a publicar el valor, no tiene sentido esperar
+        return _recompute(key, ttl, fallback_fn, tags)
+
+    # Otro worker lo está calculando: esperamos un poco a que lo publique
+    deadline = time.monotonic() + CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        cached = cache_get(key, record=False)
+        if cached is not None:
+            return cached
+    return _recompute(key, ttl, fallback_fn, tags)
+
+# ── Cache negativo ──
+# get_cache_or_execute nunca guarda None ni errores, así que un CUIT inválido o
+# un adjunto inexistente vuelve a Odoo en cada reintento. cache_lookup guarda
+# "no existe" con un centinela y TTL corto, y un error de Odoo con otro
+# centinela y TTL más corto todavía (mientras dure, falla sin tocar Odoo).
+NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", "120"))
+FAILURE_CACHE_TTL = int(os.getenv("FAILURE_CACHE_TTL", "15"))
+_NEG_NOT_FOUND = {"__neg__": "not_found"}
+_NEG_FAILED = "failed"
+
+class CachedFailure(Exception):
+    """La misma búsqueda falló en Odoo hace menos de FAILURE_CACHE_TTL seg."""
+
+@app.errorhandler(CachedFailure)
+def _cached_failure_response(e):
+    # Los endpoints la dejan subir (handle_connection_error la re-levanta)
+    return jsonify({"error": str(e)}), 503, {"Retry-After": str(FAILURE_CACHE_TTL)}
+
+def cache_lookup(key, lookup_fn, ttl=CACHE_EXPIRATION, negative_ttl=None, failure_ttl=None, tags=()):
+    """
+    `lookup_fn()` devuelve el valor o None si no existe; cache_lookup devuelve lo mismo.
+    `tags` puede ser una función del valor (ej. lambda v: [f"partner:{v['partner_id']}"]).
+    Levanta CachedFailure si hay un error reciente cacheado para la key.
+    """
+    negative_ttl = NEGATIVE_CACHE_TTL if negative_ttl is None else negative_ttl
+    failure_ttl = FAILURE_CACHE_TTL if failure_ttl is None else failure_ttl
+    cached = cache_get(key)
+    if isinstance(cached, dict) and "__neg__" in cached:
+        if cached["__neg__"] == _NEG_FAILED:
+            raise CachedFailure(f"{key}: error reciente de Odoo ({cached.get('error')})")
+        return None
+    if cached is not None:
+        return cached
+    t0 = time.monotonic()
+    try:
+        value = lookup_fn()
+    except Exception as e:
+        cache_metrics.error(key)
+        # Una conexión rota se arregla con el próximo cliente: eso no se cachea
+        if failure_ttl > 0 and not is_connection_error(e):
+            cache_setex(key, failure_ttl, {"__neg__": _NEG_FAILED, "error": type(e).__name__}, record=False)
+        raise
+    cache_metrics.fallback(key, time.monotonic() - t0)
+    if value is None:
+        if negative_ttl > 0:
+            cache_setex(key, negative_ttl, _NEG_NOT_FOUND, record=False)
+        return None
+    cache_setex(key, ttl, value, tags=tags(value) if callable(tags) else tags)
+    return value
+
 # Helper para calcular rango de fechas del mes seleccionado
 def get_month_range(year, month):
     # Primer día del mes
@@ -209,6 +548,9 @@ def execute_odoo_operation(func):
 
 # Handler Legacy para endpoints que aún no usan execute_odoo_operation
 def handle_connection_error(e):
+    # Una falla cacheada no es un error del endpoint: la responde el errorhandler (503)
+    if isinstance(e, CachedFailure):
+        raise e
     try:
         if is_connection_error(e):
             log.warning('⚠️ Conexión fallida a Odoo (Legacy Handler). Reset Thread Local.')
@@ -217,66 +559,13 @@ def handle_connection_error(e):
         pass
 
 # ───────── Background Sync (opción B, gratis) ─────────
-import random
+# Los jobs (productos, partners, ofertas, stock, KPIs) los corre el scheduler
+# definido al final del archivo, cada uno con su intervalo y su lease en Redis.
+# El sync es incremental (write_date > cursor), así que puede correr seguido (ej. 60s);
+# la reconciliación completa la decide sync_worker según SYNC_FULL_INTERVAL.
 BACKGROUND_SYNC_INTERVAL = int(os.getenv("BACKGROUND_SYNC_INTERVAL", "600"))  # cada 10 min por defecto
 ENABLE_BACKGROUND_SYNC = os.getenv("ENABLE_BACKGROUND_SYNC", "1") == "1"
 
-def acquire_lock(lock_key: str, ttl: int) -> bool:
-    """Intenta tomar un lock en Redis para evitar que múltiples réplicas sincronicen a la vez."""
-    if not redis_client:
-        return True
-    try:
-        return bool(redis_client.set(lock_key, "1", nx=True, ex=ttl))
-    except Exception:
-        return True  # si Redis falla, seguimos (hay una sola réplica en free)
-
-def release_lock(lock_key: str):
-    if not redis_client:
-        return
-    try:
-        redis_client.delete(lock_key)
-    except Exception:
-        pass
-
-def periodic_sync_loop(interval_sec: int):
-    """
-    Loop de sincronización en segundo plano. 
-    Ahora incluye la actualización de la tabla de ofertas en PostgreSQL.
-    """
-    if not HAS_SYNC:
-        log.info("SYNC: módulo sync_worker no disponible; deshabilitado.")
-        return
-
-    # Pequeño jitter inicial para evitar colisiones en reinicios
-    time.sleep(random.randint(3, 12))
-
-    while True:
-        # Intentamos tomar el lock en Redis para que solo una instancia sincronice
-        if acquire_lock("salbom:sync_lock", ttl=interval_sec):
-            try:
-                log.info("🔄 Iniciando ciclo de sincronización periódica...")
-                
-                # 1. Sincronización base de Odoo (Productos y Partners)
-                p = sync_products()
-                c = sync_partners()
-                
-                # 2. Sincronización de Ofertas (Tarifa 70) a PostgreSQL
-                # Realizamos una llamada interna al endpoint de ofertas
-                with app.test_client() as c_sync:
-                    res = c_sync.post('/admin/sync-offers')
-                    offers_data = res.get_json()
-                    offers_count = offers_data.get('count', 0) if offers_data else 0
-
-                log.info(f"✅ SYNC OK: productos={p}, partners={c}, ofertas_skus={offers_count}")
-
-            except Exception as e:
-                log.error(f"❌ SYNC ERROR: {e}\n{traceback.format_exc()}")
-            finally:
-                release_lock("salbom:sync_lock")
-        
-        # Esperar hasta el próximo ciclo
-        time.sleep(interval_sec)
-
 # ───────────── NO-PG (mem) y utilidades varias ───────────────
 USE_DB = False
 _MEM_PEDIDOS_CACHE = []
@@ -323,34 +612,20 @@ if HAS_R2_DEBUG:
             return jsonify({"error": "Parámetro code requerido"}), 400
         return jsonify(find_media_for_code(code))
     
-# --- HERRAMIENTA DE REPARACIÓN (SOLUCIÓN DEFINITIVA) ---
+# --- HERRAMIENTA DE REPARACIÓN: aplica las migraciones pendientes (migrations.py) ---
 @app.route('/fix-schema', methods=['GET'])
 def fix_schema_manual():
-    conn = get_pg_connection()
-    if not conn: return jsonify({"error": "No DB connection"}), 500
-    
-    log_msgs = []
+    if not _sync_token_ok():
+        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    if not DATABASE_URL:
+        return jsonify({"error": "No DB connection"}), 500
     try:
-        cur = conn.cursor()
-        
-        # 1. Asegurar restricción UNIQUE en app_users (para evitar error ON CONFLICT)
-        try:
-            cur.execute("ALTER TABLE app_users ADD CONSTRAINT app_users_cuit_key UNIQUE (cuit);")
-            log_msgs.append("Constraint UNIQUE CUIT: OK")
-        except:
-            conn.rollback()
-            log_msgs.append("Constraint UNIQUE CUIT: Ya existía")
-
-        # 2. Limpiar app_user_roles de columnas problemáticas si fuera necesario
-        # (Opcional, pero para tu tranquilidad quitamos el requerimiento de email en los SELECTs de arriba)
-        
-        conn.commit()
-        return jsonify({"status": "Reparación Finalizada", "detalles": log_msgs})
+        applied = migrations.migrate()
+        return jsonify({"status": "Reparación Finalizada", "aplicadas": applied,
+                        "migraciones": migrations.status()})
     except Exception as e:
-        conn.rollback()
+        log.error(f"❌ /fix-schema: {e}")
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 # ───────────────────────── ENDPOINTS ─────────────────────────
@@ -360,65 +635,26 @@ def fix_schema_manual():
 # ---------------------------------------------------------------
 
 def get_pg_connection():
+    """Conexión del pool compartido (dal.py); conn.close() la devuelve al pool."""
     if not DATABASE_URL:
         return None
     try:
-        # sslmode='require' es necesario para Render/Heroku
-        return psycopg2.connect(DATABASE_URL)
+        return dal.get_connection()
     except Exception as e:
         log.error(f"❌ Error conectando a Postgres: {e}")
         return None
 
-def init_roles_table():
-    """
-    Inicializa la tabla de roles.
-    CORRECCIÓN: Elimina la restricción de Primary Key vieja para permitir pre-asignados.
-    """
-    if not DATABASE_URL: return
-    conn = get_pg_connection()
-    if not conn: return
-    try:
-        cur = conn.cursor()
-        
-        # 1. Crear tabla si no existe
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS app_user_roles (
-                user_id INTEGER,
-                role_name TEXT NOT NULL
-            );
-        """)
-        
-        # 2. AGREGAR COLUMNAS FALTANTES
-        for col in ['email', 'name', 'cuit']:
-            cur.execute(f"ALTER TABLE app_user_roles ADD COLUMN IF NOT EXISTS {col} TEXT;")
-
-        # --- CORRECCIÓN CRÍTICA ---
-        # 3. Eliminar la restricción PRIMARY KEY vieja (si existe) que impide guardar NULLs
-        try:
-            cur.execute("ALTER TABLE app_user_roles DROP CONSTRAINT IF EXISTS app_user_roles_pkey;")
-        except Exception as e:
-            log.warning(f"Nota: No se pudo borrar PK (quizás no existía): {e}")
-
-        # 4. Permitir explícitamente que user_id sea NULL
-        try:
-            cur.execute("ALTER TABLE app_user_roles ALTER COLUMN user_id DROP NOT NULL;")
-        except Exception as e:
-            log.warning(f"Nota: No se pudo alterar columna user_id: {e}")
-        # --------------------------
-
-        # 5. Índices para evitar duplicados
-        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_roles_cuit ON app_user_roles (cuit) WHERE cuit IS NOT NULL;")
-        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_roles_email ON app_user_roles (email) WHERE email IS NOT NULL;")
-
-        conn.commit()
-        cur.close()
-        log.info("✅ Tabla 'app_user_roles' LIBERADA y lista para pre-asignaciones.")
-    except Exception as e:
-        if conn: conn.rollback()
-        log.error(f"⚠️ Init Roles Error: {e}")
-    finally:
-        if conn: conn.close()
-# --- ENDPOINTS GESTIÓN USUARIOS (Pre-asignación) ---
+# Consultas calientes como statements preparados (dal.prepared): se preparan una
+# vez por conexión del pool y después sólo se ejecutan. Usar con dal.query* o,
+# si el código ya tiene su cursor, con dal.cursor_execute(cur, SQL_..., params).
+SQL_USER_ROLE = dal.prepared("app_user_role", "SELECT role FROM app_users WHERE cuit = %s")
+SQL_USER_ROLE_ID = dal.prepared("app_user_role_id", "SELECT role, id FROM app_users WHERE cuit = %s")
+SQL_USER_EXISTS = dal.prepared("app_user_exists", "SELECT id FROM app_users WHERE cuit = %s")
+SQL_USER_LOGIN = dal.prepared("app_user_login", "SELECT id, password_hash, role, name, is_active FROM app_users WHERE cuit = %s")
+SQL_OFFERS_ACTIVE = dal.prepared("offers_active", "SELECT sku, price_offer FROM app_product_offers WHERE is_active = TRUE")
+SQL_FAVORITE_EXISTS = dal.prepared("favorite_exists", "SELECT 1 FROM app_user_favorites WHERE user_id = %s AND product_id = %s")
+SQL_FAVORITES = dal.prepared("favorites_by_user", "SELECT product_id FROM app_user_favorites WHERE user_id = %s ORDER BY created_at DESC")
+SQL_DISCOUNT_RULE = dal.prepared("discount_rule", "SELECT discount, min_amount FROM app_payment_discounts WHERE payment_term_id = %s")
 
 @app.route('/odoo-users', methods=['GET'])
 def get_odoo_users():
@@ -488,7 +724,7 @@ def preasignar_rol():
         
         if cuit:
             # Lógica CUIT (Ignora email para no fallar)
-            cur.execute("SELECT id FROM app_users WHERE cuit = %s", (cuit,))
+            dal.cursor_execute(cur, SQL_USER_EXISTS, (cuit,))
             row = cur.fetchone()
             if row:
                 user_id = row[0]
@@ -527,50 +763,27 @@ def preasignar_rol():
     finally:
         conn.close()
 
-# --- INICIALIZAR TABLA DE CONFIGURACIONES GENERALES ---
-def init_config_table():
-    if not DATABASE_URL: return
-    conn = get_pg_connection()
-    if not conn: return
-    try:
-        cur = conn.cursor()
-        # Tabla simple: Clave (ej: 'popup_tc') -> Valor (JSON text)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS app_configurations (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            );
-        """)
-        conn.commit()
-        cur.close()
-        log.info("✅ Tabla 'app_configurations' verificada.")
-    except Exception as e:
-        log.error(f"❌ Error tabla config: {e}")
-    finally:
-        if conn: conn.close()
-
-init_config_table()
-
 # --- ENDPOINTS PARA CONFIGURACIÓN (Generic Key-Value) ---
 
+# La config cambia sólo por POST /config/<key>, que invalida su tag: TTL largo
+CONFIG_CACHE_TTL = int(os.getenv("CONFIG_CACHE_TTL", "86400"))
+
 @app.route('/config/<string:key>', methods=['GET'])
 def get_app_config(key):
-    pg_conn = get_pg_connection()
-    if not pg_conn: return jsonify({})
-    try:
-        cur = pg_conn.cursor()
-        cur.execute("SELECT value FROM app_configurations WHERE key = %s", (key,))
-        row = cur.fetchone()
-        cur.close()
-        
-        if row and row[0]:
-            return jsonify(json.loads(row[0]))
-        return jsonify({}) # Retorna vacío si no existe
-    except Exception as e:
-        log.error(f"Error getting config {key}: {e}")
-        return jsonify({}), 500
-    finally:
-        if pg_conn: pg_conn.close()
+    # Sin base configurada (entorno local) la app usa sus valores por defecto
+    if not DATABASE_URL:
+        return jsonify({})
+
+    def query():
+        value = dal.scalar("SELECT value FROM app_configurations WHERE key = %s", (key,))
+        return json.loads(value) if value else {} # Vacío si no existe
+
+    # None = Postgres no respondió: no se cachea y se avisa, para no pisar la config con {}
+    data = get_cache_or_execute(f"config:{key}", ttl=CONFIG_CACHE_TTL, fallback_fn=query,
+                                tags=[f"config:{key}"])
+    if data is None:
+        return jsonify({"error": "Configuración no disponible"}), 503, {"Retry-After": "30"}
+    return jsonify(data)
 
 @app.route('/config/<string:key>', methods=['POST'])
 def save_app_config(key):
@@ -592,6 +805,7 @@ def save_app_config(key):
         cur.execute(sql, (key, json_val))
         pg_conn.commit()
         cur.close()
+        invalidate_tags(f"config:{key}")
         return jsonify({"ok": True})
     except Exception as e:
         if pg_conn: pg_conn.rollback()
@@ -600,8 +814,30 @@ def save_app_config(key):
     finally:
         if pg_conn: pg_conn.close()
 
-# Ejecutar la inicialización al arrancar
-init_roles_table()
+# ─────────────── Esquema (migrations.py) ───────────────
+# El DDL ya no corre al importar main: lo aplican las migraciones versionadas.
+# Render no tiene fase release (la línea del ProcFile la ignora), así que por
+# defecto cada worker, al arrancar, aplica lo pendiente bajo el advisory lock de
+# migrations.py: el primero migra y el resto espera y no encuentra nada.
+# MIGRATE_ON_BOOT=0 (si el deploy ya corre `python migrations.py`) sólo avisa.
+MIGRATE_ON_BOOT = os.getenv("MIGRATE_ON_BOOT", "1") == "1"
+
+def check_schema():
+    if not DATABASE_URL:
+        return
+    try:
+        # pending() es una lectura: en el caso normal no se toma el lock
+        missing = migrations.pending()
+        if not missing:
+            return
+        if MIGRATE_ON_BOOT:
+            migrations.migrate()
+        else:
+            log.warning(f"⚠️ Migraciones pendientes {missing}: correr `python migrations.py`")
+    except Exception as e:
+        log.error(f"❌ Aplicando migraciones: {e}")
+
+check_schema()
 
 # ---------- Endpoint rápido desde Postgres (opcional) ----------
 from flask import jsonify as _jsonify  # alias para evitar shadowing
@@ -614,9 +850,13 @@ def productos_rapido():
         q = (request.args.get("q") or "").strip()
         page = max(1, int(request.args.get("page", 1)))
         limit = max(1, min(200, int(request.args.get("limit", 50))))
-        offset = (page - 1) * limit
-        rows = fetch_products(q=q, limit=limit, offset=offset)
-        return _jsonify({"ok": True, "rows": rows, "page": page, "limit": limit})
+        # ?cursor=<next_cursor de la respuesta anterior> (keyset); ?page sigue andando sin cursor
+        cursor = request.args.get("cursor") or None
+        res = search_products(q=q or None, limit=limit, offset=(page - 1) * limit, cursor=cursor)
+        return _jsonify({"ok": True, "rows": res["rows"], "page": page, "limit": limit,
+                         "next_cursor": res["next_cursor"]})
+    except ValueError as e:
+        return _jsonify({"ok": False, "error": str(e)}), 400
     except Exception as e:
         return _jsonify({"ok": False, "error": str(e)}), 500
 # ---------------------------------------------------------------
@@ -627,6 +867,24 @@ def fb_url(path: str) -> str:
 
 # ---------------------------------------------------------------
 
+# CUIT -> partner/usuario de Odoo, cacheado (también el "no existe")
+CUIT_CACHE_TTL = int(os.getenv("CUIT_CACHE_TTL", "900"))
+
+def resolve_cuit(client, cuit):
+    """
+    {"partner_id", "user_id"} del CUIT (user_id None si el partner no tiene login),
+    o None si no hay partner con ese CUIT.
+    """
+    def lookup():
+        partner = client.env["res.partner"].search([("vat", "=", cuit)], limit=1)
+        if not partner:
+            return None
+        partner_id = int(partner[0].id)
+        user = client.env["res.users"].search([("partner_id", "=", partner_id)], limit=1)
+        return {"partner_id": partner_id, "user_id": int(user[0].id) if user else None}
+    return cache_lookup(f"cuit:{cuit}", lookup, ttl=CUIT_CACHE_TTL,
+                        tags=lambda v: [f"partner:{v['partner_id']}"])
+
 @app.route("/facturas", methods=["GET"])
 def get_facturas():
     client = get_odoo_client()
@@ -635,22 +893,22 @@ def get_facturas():
         if not cuit:
             return jsonify({"error": "CUIT no proporcionado"}), 400
 
-        partner = client.env["res.partner"].search([("vat", "=", cuit)], limit=1)
-        if not partner:
+        ids = resolve_cuit(client, cuit)
+        if not ids:
             return jsonify({"error": "CUIT inválido"}), 404
 
-        user = client.env["res.users"].search([("partner_id", "=", partner.id)], limit=1)
-        if not user:
+        user_id = ids["user_id"]
+        if not user_id:
             return jsonify({"error": "Usuario no encontrado"}), 404
 
         hoy = datetime.today()
         inicio_mes = hoy.replace(day=1)
-        key = f"facturas:{user.id}"
+        key = f"facturas:{user_id}"
 
         def query():
             facturas_raw = client.env["account.move"].search_read(
                 [
-                    ("invoice_user_id", "=", user.id),
+                    ("invoice_user_id", "=", user_id),
                     ("move_type", "=", "out_invoice"),
                     ("state", "=", "posted"),
                     ("invoice_date", ">=", inicio_mes.strftime("%Y-%m-%d")),
@@ -668,7 +926,8 @@ def get_facturas():
                 for f in facturas_raw
             ]
 
-        facturas = get_cache_or_execute(key, fallback_fn=query) or []
+        facturas = get_cache_or_execute(key, fallback_fn=query,
+                                        tags=[f"partner:{ids['partner_id']}"]) or []
         return jsonify(facturas)
     except Exception as e:
         handle_connection_error(e)
@@ -681,31 +940,77 @@ def get_facturas():
 
 # ---------------------------------------------------------------
 
-# main.py
+# ───────── Precios de oferta (Tarifa 70) ─────────
+# El índice en memoria (offer_engine) resuelve min_quantity y ventanas de fecha;
+# mientras no esté cargado se usa el mapa plano sku -> precio de PostgreSQL.
+OFFER_PRICELIST_ID = int(os.getenv("OFFER_PRICELIST_ID", "70"))
+OFFER_INDEX_MAX_AGE = int(os.getenv("OFFER_INDEX_MAX_AGE", "300"))
 
-@app.route("/productos", methods=["GET"])
-def get_productos():
-    client = get_odoo_client()
-    pg_conn = None
-    try:
-        search   = (request.args.get("search") or "").strip()
-        limit    = int(request.args.get("limit", 20))
-        offset   = int(request.args.get("offset", 0))
-        as_array = str(request.args.get("format", "")).lower() in ("array", "arr", "list")
-        no_tag   = str(request.args.get("no_tag_filter", "false")).lower() == "true"
-        marca_id = request.args.get("marca_id")
-        categ_id = request.args.get("categ_id")
+def refresh_offer_index():
+    return execute_odoo_operation(lambda client: offer_engine.refresh(client, OFFER_PRICELIST_ID))
 
-        # 1. Obtener mapeo de ofertas desde PostgreSQL (Persistencia SKU)
-        offer_map = {}
-        pg_conn = get_pg_connection()
-        if pg_conn:
-            cur = pg_conn.cursor()
-            cur.execute("SELECT sku, price_offer FROM app_product_offers WHERE is_active = TRUE")
-            rows = cur.fetchall()
-            offer_map = {r[0]: float(r[1]) for r in rows}
-            cur.close()
+# Crear/editar/borrar una promo invalida "offers": cada worker marca vencido su índice
+on_tag_invalidated("offers", offer_engine.invalidate)
+
+def _pg_offer_map(pg_conn):
+    if not pg_conn:
+        return {}
+    cur = pg_conn.cursor()
+    dal.cursor_execute(cur, SQL_OFFERS_ACTIVE)
+    rows = cur.fetchall()
+    cur.close()
+    return {r[0]: float(r[1]) for r in rows}
 
+def resolve_offer_prices(lines, pg_conn=None, at=None):
+    """
+    Precio de oferta para cada línea ({"sku", "qty", "tmpl_id", "categ_id", "list_price"}),
+    en el mismo orden. Si la oferta no es menor al precio de lista, va None.
+    """
+    idx = offer_engine.ensure_fresh(refresh_offer_index, OFFER_INDEX_MAX_AGE)
+    if idx is not None:
+        prices = idx.prices(lines, at=at)
+    else:
+        offer_map = _pg_offer_map(pg_conn)
+        prices = [offer_map.get((l.get("sku") or "").strip()) for l in lines]
+    out = []
+    for l, price in zip(lines, prices):
+        list_price = l.get("list_price")
+        if price is not None and list_price is not None and price >= float(list_price):
+            price = None
+        out.append(price)
+    return out
+
+CATALOG_SOFT_TTL = int(os.getenv("CATALOG_SOFT_TTL", "60"))
+CATALOG_HARD_TTL = int(os.getenv("CATALOG_HARD_TTL", "3600"))
+# Búsquedas de texto libre: keyspace abierto, así que TTL corto y sin refresh en segundo plano
+CATALOG_SEARCH_TTL = int(os.getenv("CATALOG_SEARCH_TTL", "60"))
+CATALOG_SEARCH_MAX_LEN = 64
+
+def _catalog_key(search, no_tag, marca_id, categ_id):
+    return f"catalogo:v1:{int(no_tag)}:{marca_id or ''}:{categ_id or ''}:{search}"
+
+def query_catalogo(search, no_tag, marca_id, categ_id):
+    """
+    Templates del catálogo para los filtros dados (sin stock ni ofertas, que van por request).
+
+    Sólo el listado sin búsqueda va por SWR; con `search` (normalizado y recortado
+    a CATALOG_SEARCH_MAX_LEN) es un get_cache_or_execute de CATALOG_SEARCH_TTL.
+    """
+    search = " ".join((search or "").lower().split())[:CATALOG_SEARCH_MAX_LEN]
+    marca_id = int(marca_id) if marca_id else None
+    categ_id = int(categ_id) if categ_id else None
+    if not search:
+        return _browse_catalogo(no_tag, marca_id, categ_id)
+    return get_cache_or_execute(_catalog_key(search, no_tag, marca_id, categ_id), ttl=CATALOG_SEARCH_TTL,
+                                fallback_fn=lambda: _fetch_catalogo(search, no_tag, marca_id, categ_id))
+
+@swr_cache(lambda no_tag, marca_id, categ_id: _catalog_key("", no_tag, marca_id, categ_id),
+           ttl=CATALOG_SOFT_TTL, bg_ttl=CATALOG_HARD_TTL)
+def _browse_catalogo(no_tag, marca_id, categ_id):
+    return _fetch_catalogo("", no_tag, marca_id, categ_id)
+
+def _fetch_catalogo(search, no_tag, marca_id, categ_id):
+    def logic(client):
         # 2. Detectar campo marca en Odoo
         posibles_campos = ["product_brand_id", "x_brand", "x_marca", "brand_id", "x_studio_marca"]
         campo_marca = None
@@ -721,7 +1026,7 @@ def get_productos():
         domain = []
         if not no_tag: 
             domain.append(["product_tag_ids", "ilike", "APP"])
-        
+
         if search:
             for term in search.split():
                 domain.append("|")
@@ -744,17 +1049,50 @@ def get_productos():
             domain or [], base_fields, offset=0, limit=1000
         ) or []
 
+        return {"campo_marca": campo_marca, "productos": productos}
+    return execute_odoo_operation(logic)
+
+# main.py
+
+@app.route("/productos", methods=["GET"])
+def get_productos():
+    client = get_odoo_client()
+    pg_conn = None
+    try:
+        search   = (request.args.get("search") or "").strip()
+        limit    = int(request.args.get("limit", 20))
+        offset   = int(request.args.get("offset", 0))
+        as_array = str(request.args.get("format", "")).lower() in ("array", "arr", "list")
+        no_tag   = str(request.args.get("no_tag_filter", "false")).lower() == "true"
+        marca_id = request.args.get("marca_id")
+        categ_id = request.args.get("categ_id")
+
+        # 1. Las ofertas se resuelven con el motor en memoria (ver resolve_offer_prices)
+        pg_conn = None if offer_engine.get_index() else get_pg_connection()
+
+        # 2-4. Marca, dominio y templates (cacheado con SWR por filtros)
+        catalogo = query_catalogo(search, no_tag, marca_id, categ_id)
+        productos = catalogo["productos"]
+        campo_marca = catalogo["campo_marca"]
+
         # 5. Calcular Stock (Solo para la página solicitada)
         total = len(productos)
         page_slice = productos[offset: offset + limit]
-        stock_data_map = _compute_stock_states(client, page_slice)
+        stock_data_map = cached_stock_states(client, page_slice)
 
         def get_fb_url(p):
             return f"https://firebasestorage.googleapis.com/v0/b/{FIREBASE_BUCKET}/o/{quote(p, safe='')}?alt=media"
 
+        offer_prices = resolve_offer_prices([{
+            "sku": (r.get("default_code") or "").strip(),
+            "tmpl_id": int(r.get("id")),
+            "categ_id": r["categ_id"][0] if r.get("categ_id") else None,
+            "list_price": float(r.get("list_price") or 0),
+        } for r in page_slice], pg_conn)
+
         # 6. Normalización de Resultados
         norm = []
-        for r in page_slice:
+        for r, offer_price in zip(page_slice, offer_prices):
             brand_name = ""
             if campo_marca:
                 pb = r.get(campo_marca)
@@ -770,13 +1108,7 @@ def get_productos():
             md_path    = code_path or f"products/{pid}/md.webp"
             thumb_path = code_path or f"products/{pid}/thumb.webp"
 
-            # Lógica de Precios con persistencia de PG
             list_price = float(r.get("list_price") or 0)
-            offer_price = offer_map.get(sku, None)
-            
-            # Validar que la oferta sea menor al precio de lista
-            if offer_price is not None and offer_price >= list_price: 
-                offer_price = None
 
             st_info = stock_data_map.get(pid, {'state': 'green', 'quantity': 0})
 
@@ -809,87 +1141,87 @@ def get_productos():
     finally:
         release_odoo_client(client)
 
-@app.route("/marcas", methods=["GET"])
-def get_marcas():
-    client = get_odoo_client()
-    try:
-        # Usamos una clave de caché distinta para diferenciarla de la lista completa anterior
-        key = "marcas_filtradas_app"
+# ── Listados calientes con stale-while-revalidate (ver cache_swr.py) ──
+# Las queries viven a nivel módulo para que el refresh en segundo plano pueda
+# correrlas sin el request: cada una toma su propio cliente Odoo.
+SWR_SOFT_TTL = int(os.getenv("SWR_SOFT_TTL", "300"))
+SWR_HARD_TTL = int(os.getenv("SWR_HARD_TTL", "86400"))
 
-        def query():
-            # 1. Buscar TODOS los productos con etiqueta 'APP'
-            # Solo traemos el campo 'product_brand_id' para que sea rápido
-            products = client.env["product.template"].search_read(
-                [("product_tag_ids", "ilike", "APP")], 
-                ["product_brand_id"]
-            )
-            
-            # 2. Extraer los IDs únicos de las marcas usadas en esos productos
-            brand_ids = set()
-            for p in products:
-                pb = p.get("product_brand_id")
-                # Odoo devuelve many2one como [id, "Nombre"] o False
-                if pb and isinstance(pb, (list, tuple)) and len(pb) > 0:
-                    brand_ids.add(pb[0])
-            
-            if not brand_ids:
-                return []
+# Usamos una clave de caché distinta para diferenciarla de la lista completa anterior
+@swr_cache(lambda: "marcas_filtradas_app", ttl=SWR_SOFT_TTL, bg_ttl=SWR_HARD_TTL)
+def query_marcas():
+    def logic(client):
+        # 1. Buscar TODOS los productos con etiqueta 'APP'
+        # Solo traemos el campo 'product_brand_id' para que sea rápido
+        products = client.env["product.template"].search_read(
+            [("product_tag_ids", "ilike", "APP")], 
+            ["product_brand_id"]
+        )
+        
+        # 2. Extraer los IDs únicos de las marcas usadas en esos productos
+        brand_ids = set()
+        for p in products:
+            pb = p.get("product_brand_id")
+            # Odoo devuelve many2one como [id, "Nombre"] o False
+            if pb and isinstance(pb, (list, tuple)) and len(pb) > 0:
+                brand_ids.add(pb[0])
+        
+        if not brand_ids:
+            return []
 
-            # 3. Buscar los detalles (nombre) solo de esas marcas
-            return client.env["product.brand"].search_read(
-                [("id", "in", list(brand_ids))], 
-                ["id", "name"],
-                order="name asc"
-            )
+        # 3. Buscar los detalles (nombre) solo de esas marcas
+        return client.env["product.brand"].search_read(
+            [("id", "in", list(brand_ids))], 
+            ["id", "name"],
+            order="name asc"
+        )
+    return execute_odoo_operation(logic)
+
+@swr_cache(lambda: "categorias_filtradas_app", ttl=SWR_SOFT_TTL, bg_ttl=SWR_HARD_TTL)
+def query_categorias():
+    def logic(client):
+        # 1. Buscar TODOS los productos con etiqueta 'APP'
+        products = client.env["product.template"].search_read(
+            [("product_tag_ids", "ilike", "APP")], 
+            ["categ_id"]
+        )
+        
+        # 2. Extraer IDs únicos de categorías
+        categ_ids = set()
+        for p in products:
+            pc = p.get("categ_id")
+            if pc and isinstance(pc, (list, tuple)) and len(pc) > 0:
+                categ_ids.add(pc[0])
+        
+        if not categ_ids:
+            return []
 
-        return jsonify(get_cache_or_execute(key, fallback_fn=query))
+        # 3. Buscar los detalles de esas categorías
+        return client.env["product.category"].search_read(
+            [("id", "in", list(categ_ids))], 
+            ["id", "name"],
+            order="name asc"
+        )
+    return execute_odoo_operation(logic)
 
+@app.route("/marcas", methods=["GET"])
+def get_marcas():
+    try:
+        return jsonify(query_marcas())
     except Exception as e:
         handle_connection_error(e)
         log.error(f"❌ /marcas: {str(e)}")
         return jsonify({"error": str(e)}), 500
-    finally:
-        release_odoo_client(client)
 
 
 @app.route("/categorias", methods=["GET"])
 def get_categorias():
-    client = get_odoo_client()
     try:
-        key = "categorias_filtradas_app"
-
-        def query():
-            # 1. Buscar TODOS los productos con etiqueta 'APP'
-            products = client.env["product.template"].search_read(
-                [("product_tag_ids", "ilike", "APP")], 
-                ["categ_id"]
-            )
-            
-            # 2. Extraer IDs únicos de categorías
-            categ_ids = set()
-            for p in products:
-                pc = p.get("categ_id")
-                if pc and isinstance(pc, (list, tuple)) and len(pc) > 0:
-                    categ_ids.add(pc[0])
-            
-            if not categ_ids:
-                return []
-
-            # 3. Buscar los detalles de esas categorías
-            return client.env["product.category"].search_read(
-                [("id", "in", list(categ_ids))], 
-                ["id", "name"],
-                order="name asc"
-            )
-
-        return jsonify(get_cache_or_execute(key, fallback_fn=query))
-
+        return jsonify(query_categorias())
     except Exception as e:
         handle_connection_error(e)
         log.error(f"❌ /categorias: {str(e)}")
         return jsonify({"error": str(e)}), 500
-    finally:
-        release_odoo_client(client)
 
 # ---------------------------------------------------------------
 # ADMIN: OBTENER PROMOCIONES (MEJORADO PARA EDICIÓN)
@@ -1021,6 +1353,12 @@ def get_admin_promociones():
 # ---------------------------------------------------------------
 # ADMIN: EDITAR PROMOCIÓN (PUT)
 # ---------------------------------------------------------------
+def _promo_tags(target_type, target_id):
+    """Tags a invalidar al tocar un ítem de la Tarifa 70."""
+    if target_type != 'category' and target_id:
+        return ("offers", f"product:{int(target_id)}")
+    return ("offers",)
+
 @app.route('/admin/promociones/editar/<int:promo_id>', methods=['PUT'])
 def edit_admin_promocion(promo_id):
     client = get_odoo_client()
@@ -1053,6 +1391,7 @@ def edit_admin_promocion(promo_id):
             vals['categ_id'] = False # Limpiar categoría si había
 
         client.env['product.pricelist.item'].write([promo_id], vals)
+        invalidate_tags(*_promo_tags(target_type, target_id))
         
         return jsonify({'ok': True})
 
@@ -1071,6 +1410,7 @@ def delete_admin_promocion(promo_id):
     client = get_odoo_client()
     try:
         client.env['product.pricelist.item'].unlink([promo_id])
+        invalidate_tags("offers")
         return jsonify({'ok': True})
     except Exception as e:
         log.error(f"❌ /admin/promociones/eliminar: {e}")
@@ -1131,7 +1471,7 @@ def get_product_attributes(product_id):
         # Ejecutar de forma segura con reintentos
         return execute_odoo_operation(_op)
 
-    return jsonify(get_cache_or_execute(key, ttl=120, fallback_fn=query))
+    return jsonify(get_cache_or_execute(key, ttl=120, fallback_fn=query, tags=[f"product:{product_id}"]))
 
 # ---------------------------------------------------------------
 # ADMIN: CREAR PROMOCIÓN (TARIFA 70) - CON HORA EXACTA
@@ -1184,6 +1524,7 @@ def create_admin_promocion():
             vals['product_tmpl_id'] = int(target_id)
 
         new_item = client.env['product.pricelist.item'].create(vals)
+        invalidate_tags(*_promo_tags(target_type, target_id))
         
         return jsonify({'ok': True, 'id': int(new_item)})
 
@@ -1225,14 +1566,24 @@ def get_admin_productos_simple():
     finally:
         release_odoo_client(client)
 
+PRODUCT_IMAGE_CACHE_TTL = int(os.getenv("PRODUCT_IMAGE_CACHE_TTL", "3600"))
+
 @app.route("/producto/<int:producto_id>/imagen", methods=["GET"])
 def get_imagen_producto(producto_id):
     client = get_odoo_client()
     try:
-        producto = client.env["product.template"].browse(producto_id)
-        if not producto.exists():
+        def lookup():
+            rows = client.env["product.template"].search_read(
+                [("id", "=", producto_id), ("active", "in", [True, False])], ["image_128"])
+            if not rows:
+                return None
+            return {"image_128": rows[0].get("image_128") or ""}
+
+        data = cache_lookup(f"prod_img:{producto_id}", lookup, ttl=PRODUCT_IMAGE_CACHE_TTL,
+                            tags=[f"product:{producto_id}"])
+        if data is None:
             return jsonify({"error": "Producto no encontrado"}), 404
-        return jsonify({"image_128": getattr(producto, "image_128", "") or ""})
+        return jsonify(data)
     except Exception as e:
         handle_connection_error(e)
         log.error(f"❌ /producto/<id>/imagen:\n{traceback.format_exc()}")
@@ -1280,28 +1631,26 @@ def get_clientes_del_comercial():
     finally:
         release_odoo_client(client)
 
+# Cambié la key para forzar recarga de caché
+@swr_cache(lambda: "plazos_pago_filtrados_v2", ttl=SWR_SOFT_TTL, bg_ttl=SWR_HARD_TTL)
+def query_plazos_pago():
+    def logic(client):
+        # ⚠️ ACTUALIZADO: Agregados 31 y 22 a la lista permitida del backend
+        ids_permitidos = [1, 21, 22, 24, 31, 12, 23, 29, 26, 28, 20] 
+        domain = [('id', 'in', ids_permitidos)]
+        plazos = client.env['account.payment.term'].search_read(domain, ['id', 'name'])
+        plazos.sort(key=lambda x: x['name'])
+        return [{"id": p["id"], "nombre": p["name"]} for p in plazos]
+    return execute_odoo_operation(logic)
+
 @app.route('/plazos-pago', methods=['GET'])
 def obtener_plazos_pago():
-    client = get_odoo_client()
     try:
-        def query():
-            # ⚠️ ACTUALIZADO: Agregados 31 y 22 a la lista permitida del backend
-            ids_permitidos = [1, 21, 22, 24, 31, 12, 23, 29, 26, 28, 20] 
-            domain = [('id', 'in', ids_permitidos)]
-            plazos = client.env['account.payment.term'].search_read(domain, ['id', 'name'])
-            plazos.sort(key=lambda x: x['name'])
-            return [{"id": p["id"], "nombre": p["name"]} for p in plazos]
-
-        return jsonify(get_cache_or_execute(
-            "plazos_pago_filtrados_v2", # Cambié la key para forzar recarga de caché
-            fallback_fn=query
-        ))
+        return jsonify(query_plazos_pago())
     except Exception as e:
         handle_connection_error(e)
         log.error(f"❌ /plazos-pago: {str(e)}")
         return jsonify({"error": f"Error al obtener plazos: {str(e)}"}), 500
-    finally:
-        release_odoo_client(client)
 
 @app.route("/mis_ventas", methods=["GET"])
 def get_mis_ventas():
@@ -1329,8 +1678,7 @@ def get_mis_ventas():
 
     # 2. Lógica
     def logic(client):
-        partner = client.env["res.partner"].search([("vat", "=", cuit)], limit=1)
-        if not partner:
+        if not resolve_cuit(client, cuit):
              return jsonify({"error": "Vendedor no encontrado"}), 404
         
         domain = [
@@ -1363,6 +1711,7 @@ def get_mis_ventas():
     try:
         return execute_odoo_operation(logic)
     except Exception as e:
+        handle_connection_error(e)
         log.error(f"❌ /mis_ventas Error final: {e}")
         return jsonify({"error": str(e)}), 500
     
@@ -1386,17 +1735,13 @@ def get_mis_pedidos():
             limit = 20
             offset = 0
 
-        partner = client.env["res.partner"].search([("vat", "=", cuit)], limit=1)
-        if not partner:
+        ids = resolve_cuit(client, cuit)
+        if not ids:
             return jsonify({"error": "CUIT no encontrado"}), 404
-        
-        partner_id = int(partner[0].id)
-        user = client.env["res.users"].search([("partner_id", "=", partner_id)], limit=1)
-        
-        if not user:
+
+        user_id = ids["user_id"]
+        if not user_id:
             return jsonify({"error": "Usuario vendedor no encontrado"}), 404
-            
-        user_id = int(user[0].id)
 
         domain = [("user_id", "=", user_id)]
 
@@ -1540,17 +1885,13 @@ def get_mis_facturas():
             limit = 20
             offset = 0
 
-        partner = client.env["res.partner"].search([("vat", "=", cuit)], limit=1)
-        if not partner:
+        ids = resolve_cuit(client, cuit)
+        if not ids:
             return jsonify({"error": "CUIT no encontrado"}), 404
-        
-        partner_id = int(partner[0].id)
-        user = client.env["res.users"].search([("partner_id", "=", partner_id)], limit=1)
-        
-        if not user:
+
+        user_id = ids["user_id"]
+        if not user_id:
             return jsonify({"error": "Usuario vendedor no encontrado"}), 404
-            
-        user_id = int(user[0].id)
 
         domain = [
             ("invoice_user_id", "=", user_id),
@@ -1621,15 +1962,7 @@ def producto_relacionados(producto_id: int):
         if not tmpl or not tmpl.exists():
             return jsonify({"items": []}), 200
 
-        # 1. Obtener mapeo de ofertas desde PostgreSQL (Cruce por SKU)
-        offer_map = {}
-        pg_conn = get_pg_connection()
-        if pg_conn:
-            cur = pg_conn.cursor()
-            cur.execute("SELECT sku, price_offer FROM app_product_offers WHERE is_active = TRUE")
-            rows = cur.fetchall()
-            offer_map = {r[0]: float(r[1]) for r in rows}
-            cur.close()
+        pg_conn = None if offer_engine.get_index() else get_pg_connection()
 
         # Buscamos campos de productos relacionados en Odoo
         candidates = [
@@ -1642,33 +1975,30 @@ def producto_relacionados(producto_id: int):
             if not sku: return None
             return f"https://firebasestorage.googleapis.com/v0/b/{FIREBASE_BUCKET}/o/products%2F{quote(sku.strip())}%2F{quote(sku.strip())}.webp?alt=media"
 
-        items = []
+        items, lines = [], []
         for t in list(related)[:limit]:
             try:
                 sku = (t.default_code or "").strip()
                 list_price = float(t.list_price or 0.0)
-                
-                # Cruce con tabla de ofertas
-                offer_price = offer_map.get(sku, None)
-                
-                # Validar que la oferta sea menor al precio de lista
-                if offer_price is not None and offer_price >= list_price:
-                    offer_price = None
-
+                categ_id = t.categ_id.id if t.categ_id else None
                 items.append({
                     "id": int(t.id),
                     "name": t.name or "",
                     "list_price": list_price,
-                    "price_offer": offer_price, # Enviamos el precio de oferta a la App
                     "default_code": sku,
-                    "categ_id": [t.categ_id.id, t.categ_id.name] if t.categ_id else None,
+                    "categ_id": [categ_id, t.categ_id.name] if categ_id else None,
                     "image_md_url": get_fb_url(sku),
                     "image_thumb_url": get_fb_url(sku),
                     "write_date": str(t.write_date or "")
                 })
+                lines.append({"sku": sku, "tmpl_id": int(t.id), "list_price": list_price, "categ_id": categ_id})
             except Exception:
                 continue
 
+        # Ofertas de todos los relacionados en una sola pasada (como el carrito)
+        for item, offer_price in zip(items, resolve_offer_prices(lines, pg_conn)):
+            item["price_offer"] = offer_price # Enviamos el precio de oferta a la App
+
         return jsonify({"items": items})
     except Exception as e:
         handle_connection_error(e)
@@ -1703,6 +2033,8 @@ def descargar_pdf():
     finally:
         release_odoo_client(client)
 
+FACTURA_PDF_CACHE_TTL = int(os.getenv("FACTURA_PDF_CACHE_TTL", "86400"))
+
 @app.route("/factura_pdf")
 def factura_pdf():
     client = get_odoo_client()
@@ -1711,23 +2043,32 @@ def factura_pdf():
         if not factura_name:
             return jsonify({"error": "Parámetro facturaId requerido"}), 400
 
-        invoice = client.env['account.move'].search([('name', '=', factura_name)], limit=1)
-        if not invoice:
+        # Factura y adjunto no cambian una vez publicados: se cachea también el "no está"
+        def find_invoice():
+            invoice = client.env['account.move'].search([('name', '=', factura_name)], limit=1)
+            return int(invoice[0].id) if invoice else None
+
+        invoice_id = cache_lookup(f"factura_id:{factura_name}", find_invoice, ttl=FACTURA_PDF_CACHE_TTL)
+        if not invoice_id:
             return jsonify({"error": "Factura no encontrada"}), 404
 
-        factura_numero = factura_name.split(' ')[1] if ' ' in factura_name else factura_name
-        attachments = client.env['ir.attachment'].search([
-            ('res_model', '=', 'account.move'),
-            ('res_id', '=', invoice.id)
-        ])
-        attachment_pdf = next((att for att in attachments if factura_numero in att.name and att.name.endswith('.pdf')), None)
-        if not attachment_pdf:
+        def find_attachment():
+            factura_numero = factura_name.split(' ')[1] if ' ' in factura_name else factura_name
+            attachments = client.env['ir.attachment'].search_read([
+                ('res_model', '=', 'account.move'),
+                ('res_id', '=', invoice_id)
+            ], ['name'])
+            att = next((a for a in attachments if factura_numero in (a['name'] or '') and (a['name'] or '').endswith('.pdf')), None)
+            return {"id": att['id'], "name": att['name']} if att else None
+
+        found = cache_lookup(f"factura_pdf:{invoice_id}", find_attachment, ttl=FACTURA_PDF_CACHE_TTL)
+        if not found:
             return jsonify({"error": "Archivo no encontrado"}), 404
 
         base = PUBLIC_BASE_URL or (request.url_root.rstrip("/"))
         return {
-            "nombre_archivo": attachment_pdf.name,
-            "pdf_url": f"{base}/descargar_pdf?attachment_id={attachment_pdf.id}"
+            "nombre_archivo": found["name"],
+            "pdf_url": f"{base}/descargar_pdf?attachment_id={found['id']}"
         }
     except Exception as e:
         handle_connection_error(e)
@@ -1736,58 +2077,25 @@ def factura_pdf():
     finally:
         release_odoo_client(client)
 
-# --- AGREGAR AL INICIO JUNTO A init_roles_table ---
-
-def init_discounts_table():
-    """Crea o actualiza la tabla de descuentos."""
-    if not DATABASE_URL:
-        return
-    conn = get_pg_connection()
-    if not conn:
-        return
-    try:
-        cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS app_payment_discounts (
-                payment_term_id INTEGER PRIMARY KEY,
-                discount NUMERIC(5,2) DEFAULT 0,
-                min_amount NUMERIC(12,2) DEFAULT 0
-            );
-        """)
-        
-        # Migración 1: discount2
-        try:
-            cur.execute("ALTER TABLE app_payment_discounts ADD COLUMN discount2 NUMERIC(5,2) DEFAULT 0;")
-            conn.commit()
-        except Exception:
-            conn.rollback()
-
-        # Migración 2: allow_in_offer (NUEVO)
-        try:
-            cur.execute("ALTER TABLE app_payment_discounts ADD COLUMN allow_in_offer BOOLEAN DEFAULT FALSE;")
-            conn.commit()
-        except Exception:
-            conn.rollback()
-
-        conn.commit()
-        cur.close()
-        log.info("✅ Tabla 'app_payment_discounts' verificada.")
-    except Exception as e:
-        log.error(f"❌ Error tabla descuentos: {e}")
-    finally:
-        if conn: conn.close()
-
-init_discounts_table()
-
 
 # --- NUEVOS ENDPOINTS PARA EL PANEL ADMIN ---
 # ====== DESCUENTOS ======
 
 @app.route('/admin/plazos-descuentos', methods=['GET'])
 def get_payment_discounts_config():
+    if not DATABASE_URL:
+        return jsonify({})
+    data = get_cache_or_execute("config:plazos-descuentos", ttl=CONFIG_CACHE_TTL,
+                                fallback_fn=_query_payment_discounts, tags=["config:plazos-descuentos"])
+    if data is None:
+        return jsonify({"error": "Descuentos no disponibles"}), 503, {"Retry-After": "30"}
+    return jsonify(data)
+
+def _query_payment_discounts():
+    # None (y no {}) si no hay conexión: get_cache_or_execute no guarda None
     pg_conn = get_pg_connection()
     if not pg_conn:
-        return jsonify({})
+        return None
     try:
         cur = pg_conn.cursor()
         # Traemos también allow_in_offer
@@ -1803,10 +2111,10 @@ def get_payment_discounts_config():
                 "descuento2": float(r[3] if len(r) > 3 and r[3] is not None else 0),
                 "oferta": bool(r[4] if len(r) > 4 and r[4] is not None else False) # Nuevo campo
             }
-        return jsonify(config)
+        return config
     except Exception as e:
         log.error(f"Error getting discounts: {e}")
-        return jsonify({}), 500
+        return None
     finally:
         if pg_conn: pg_conn.close()
 
@@ -1842,6 +2150,7 @@ def save_payment_discounts_config():
             
         pg_conn.commit()
         cur.close()
+        invalidate_tags("config:plazos-descuentos")
         return jsonify({"ok": True})
     except Exception as e:
         if pg_conn: pg_conn.rollback()
@@ -1878,10 +2187,7 @@ def calcular_descuentos():
             pg_conn = get_pg_connection()
             if pg_conn:
                 cur = pg_conn.cursor()
-                cur.execute(
-                    "SELECT discount, min_amount FROM app_payment_discounts WHERE payment_term_id = %s", 
-                    (payment_term_id,)
-                )
+                dal.cursor_execute(cur, SQL_DISCOUNT_RULE, (payment_term_id,))
                 row = cur.fetchone()
                 cur.close()
                 
@@ -1921,7 +2227,7 @@ def get_clients():
     if conn:
         try:
             cur = conn.cursor(cursor_factory=RealDictCursor)
-            cur.execute("SELECT role, id FROM app_users WHERE cuit = %s", (cuit_solicitante,))
+            dal.cursor_execute(cur, SQL_USER_ROLE_ID, (cuit_solicitante,))
             ud = cur.fetchone()
             if ud:
                 rol = ud['role']
@@ -2196,6 +2502,7 @@ def editar_perfil():
             if vals_user:
                 client.env["res.users"].write([user_id], vals_user)
 
+        invalidate_tags(f"partner:{partner_id}")
         return jsonify({"ok": True, "message": "Perfil actualizado correctamente"})
 
     except Exception as e:
@@ -2459,18 +2766,11 @@ def usuario_perfil():
         role_name = "Cliente" 
         
         if DATABASE_URL:
-            pg_conn = get_pg_connection()
-            if pg_conn:
-                try:
-                    cur = pg_conn.cursor()
-                    # Buscamos el rol real asignado por el admin
-                    cur.execute("SELECT role FROM app_users WHERE cuit = %s", (cuit,))
-                    row = cur.fetchone()
-                    if row and row[0]:
-                        role_name = row[0]
-                    cur.close()
-                except Exception as e:
-                    log.error(f"Error buscando rol en app_users: {e}")
+            try:
+                # Buscamos el rol real asignado por el admin
+                role_name = dal.scalar(SQL_USER_ROLE, (cuit,)) or role_name
+            except Exception as e:
+                log.error(f"Error buscando rol en app_users: {e}")
 
         return jsonify({
             "name": display_name,
@@ -2605,7 +2905,7 @@ def cliente_direccion_entrega():
                 "zip": target.get('zip') or "",
             }
 
-        data = get_cache_or_execute(key, ttl=CACHE_EXPIRATION, fallback_fn=query)
+        data = get_cache_or_execute(key, ttl=CACHE_EXPIRATION, fallback_fn=query, tags=[f"partner:{cid}"])
         if not data:
             return jsonify({"error": "Cliente no encontrado o sin dirección disponible"}), 404
         return jsonify(data)
@@ -2672,7 +2972,7 @@ def get_cliente_direcciones():
             return result
 
         try:
-            data = get_cache_or_execute(cache_key, fallback_fn=query)
+            data = get_cache_or_execute(cache_key, fallback_fn=query, tags=[f"partner:{cliente_id}"])
         except NameError: 
             data = query()
             
@@ -2699,15 +2999,14 @@ def get_pedidos_vendedor():
         if not cuit:
             return jsonify({"error": "CUIT requerido"}), 400
 
-        partner = client.env["res.partner"].search([("vat", "=", cuit)], limit=1)
-        if not partner:
+        ids = resolve_cuit(client, cuit)
+        if not ids:
             return jsonify({"error": "CUIT no válido"}), 404
 
-        user = client.env["res.users"].search([("partner_id", "=", partner.id)], limit=1)
-        if not user:
+        if not ids["user_id"]:
             return jsonify({"error": "No se encontró el usuario para ese CUIT"}), 404
 
-        domain = [("user_id", "=", user.id), ("state", "!=", "cancel")]
+        domain = [("user_id", "=", ids["user_id"]), ("state", "!=", "cancel")]
         if fecha_inicio:
             domain.append(("date_order", ">=", fecha_inicio))
         if fecha_fin:
@@ -2747,19 +3046,19 @@ def clientes_del_vendedor():
             return jsonify({"error": "CUIT requerido"}), 400
 
         # 1. Identificar al usuario en Odoo
-        partner = client.env["res.partner"].search([("vat", "=", cuit)], limit=1)
-        if not partner:
+        ids = resolve_cuit(client, cuit)
+        if not ids:
             return jsonify({"items": [], "is_admin": False}) # Devolver vacío en lugar de error 404 para evitar que el front se rompa
         
-        user = client.env["res.users"].search([("partner_id", "=", partner.id)], limit=1)
+        user_id = ids["user_id"]
         
         # 2. Verificar Rol con Manejo de Errores (Evita el error HTML <)
         is_admin = False
         try:
             pg_conn = get_pg_connection()
-            if pg_conn and user:
+            if pg_conn and user_id:
                 cur = pg_conn.cursor()
-                cur.execute("SELECT role_name FROM app_user_roles WHERE user_id = %s", (user.id,))
+                cur.execute("SELECT role_name FROM app_user_roles WHERE user_id = %s", (user_id,))
                 row = cur.fetchone()
                 if row and row[0].upper() == 'ADMIN':
                     is_admin = True
@@ -2774,8 +3073,7 @@ def clientes_del_vendedor():
         if is_admin:
             domain = [("customer_rank", ">", 0)]
         else:
-            user_id = user.id if user else 0
-            domain = [("user_id", "=", user_id), ("customer_rank", ">", 0)]
+            domain = [("user_id", "=", user_id or 0), ("customer_rank", ">", 0)]
 
         # Agregamos filtro de búsqueda si existe
         if q:
@@ -2795,6 +3093,7 @@ def clientes_del_vendedor():
         })
 
     except Exception as e:
+        handle_connection_error(e)
         log.error(f"❌ Error en clientes-del-vendedor: {e}")
         return jsonify({"error": str(e), "items": []}), 500
     finally:
@@ -2940,11 +3239,11 @@ def get_mis_comprobantes_propios():
             offset = 0
 
         # 1. Identificar al Partner (El usuario mismo)
-        partner = client.env["res.partner"].search([("vat", "=", cuit)], limit=1)
-        if not partner:
+        ids = resolve_cuit(client, cuit)
+        if not ids:
             return jsonify({"error": "CUIT no encontrado"}), 404
         
-        partner_id = int(partner[0].id)
+        partner_id = ids["partner_id"]
 
         # 2. Definir dominio: Buscar donde el partner sea EL USUARIO
         # move_type 'out_invoice' = Factura de Venta (La empresa le vendió al usuario -> El usuario es Cliente)
@@ -3010,11 +3309,10 @@ def get_mis_comprobantes_propios():
     finally:
         release_odoo_client(client)
 
-@app.route('/tipo-cambio', methods=['GET'])
-def get_tipo_cambio():
-    """Obtiene la cotización del USD desde Odoo"""
-    client = get_odoo_client()
-    try:
+@swr_cache(lambda: "tipo_cambio", ttl=SWR_SOFT_TTL, bg_ttl=SWR_HARD_TTL)
+def query_tipo_cambio():
+    """Cotización del USD desde Odoo"""
+    def logic(client):
         # Buscamos la moneda USD
         currency = client.env['res.currency'].search_read(
             [('name', '=', 'USD')], 
@@ -3023,7 +3321,7 @@ def get_tipo_cambio():
         )
         
         if not currency:
-            return jsonify({"rate": 1450, "source": "fallback_backend"}), 200
+            return {"rate": 1450, "source": "fallback_backend"}
 
         data = currency[0]
         rate = data.get('rate', 0)
@@ -3036,148 +3334,167 @@ def get_tipo_cambio():
         elif rate and rate > 0:
             final_rate = 1.0 / rate
 
-        return jsonify({
+        return {
             "rate": final_rate,
             "inverse_rate": final_rate, 
             "source": "odoo"
-        })
+        }
+    return execute_odoo_operation(logic)
 
+@app.route('/tipo-cambio', methods=['GET'])
+def get_tipo_cambio():
+    """Obtiene la cotización del USD desde Odoo"""
+    try:
+        return jsonify(query_tipo_cambio()), 200
     except Exception as e:
         log.error(f"❌ Error obteniendo tipo de cambio: {e}")
         return jsonify({"rate": 1450, "error": str(e)}), 200
-    finally:
-        release_odoo_client(client)
 
-@app.route("/kpi-vendedor", methods=["GET"])
-def get_kpi_vendedor():
-    cuit = request.args.get("cuit")
-    now = datetime.today()
-    try:
-        req_month = int(request.args.get("month", now.month))
-        req_year = int(request.args.get("year", now.year))
-    except ValueError:
-        req_month = now.month
-        req_year = now.year
-
-    if not cuit:
-        return jsonify({"error": "CUIT requerido"}), 400
-
-    def logic(client):
-        partner_recs = client.env["res.partner"].search([("vat", "=", cuit)], limit=1)
-        if not partner_recs:
-            return jsonify({"error": "CUIT inválido"}), 404
-        partner_id = partner_recs[0].id
-        
-        user_recs = client.env["res.users"].search([("partner_id", "=", partner_id)], limit=1)
-        if not user_recs:
-            return jsonify({"error": "Usuario no encontrado"}), 404
-        user_id = user_recs[0].id
-        
-        # Fechas
-        start_date, end_date = get_month_range(req_year, req_month)
-        start_str = start_date.strftime("%Y-%m-%d")
-        end_str = end_date.strftime("%Y-%m-%d")
+# Los KPIs del mes los precalcula el scheduler (job "kpis") y se sirven con SWR:
+# fresco hasta KPI_SOFT_TTL, después se sirve el viejo y se refresca de fondo.
+KPI_SOFT_TTL = int(os.getenv("KPI_SOFT_TTL", "300"))
+KPI_CACHE_TTL = int(os.getenv("KPI_CACHE_TTL", "1800"))
 
-        # --- A. TOTAL PEDIDOS ---
-        pedidos_mes = client.env["sale.order"].search_read(
-            [
-                ("user_id", "=", user_id),
-                ("date_order", ">=", start_str),
-                ("date_order", "<", end_str),
-                ("state", "!=", "cancel") 
-            ],
-            ["amount_total", "partner_id"]
-        )
-        pedidos_count = len(pedidos_mes)
+def _kpi_cache_key(cuit, year, month):
+    return f"kpi_vendedor:{cuit}:{year}-{month:02d}"
 
-        # --- B. TOTAL FACTURADO (Base Facturas) ---
-        facturas_mes = client.env["account.move"].search_read(
+def _compute_kpi_vendedor(client, cuit, req_year, req_month):
+    """KPIs del mes para el vendedor del CUIT. Devuelve (payload, status)."""
+    partner_recs = client.env["res.partner"].search([("vat", "=", cuit)], limit=1)
+    if not partner_recs:
+        return {"error": "CUIT inválido"}, 404
+    partner_id = partner_recs[0].id
+    
+    user_recs = client.env["res.users"].search([("partner_id", "=", partner_id)], limit=1)
+    if not user_recs:
+        return {"error": "Usuario no encontrado"}, 404
+    user_id = user_recs[0].id
+    
+    # Fechas
+    start_date, end_date = get_month_range(req_year, req_month)
+    start_str = start_date.strftime("%Y-%m-%d")
+    end_str = end_date.strftime("%Y-%m-%d")
+
+    # --- A. TOTAL PEDIDOS ---
+    pedidos_mes = client.env["sale.order"].search_read(
+        [
+            ("user_id", "=", user_id),
+            ("date_order", ">=", start_str),
+            ("date_order", "<", end_str),
+            ("state", "!=", "cancel") 
+        ],
+        ["amount_total", "partner_id"]
+    )
+    pedidos_count = len(pedidos_mes)
+
+    # --- B. TOTAL FACTURADO (Base Facturas) ---
+    facturas_mes = client.env["account.move"].search_read(
+        [
+            ("invoice_user_id", "=", user_id),
+            ("move_type", "=", "out_invoice"),
+            ("state", "=", "posted"),
+            ("invoice_date", ">=", start_str),
+            ("invoice_date", "<", end_str)
+        ],
+        ["amount_total", "partner_id"]
+    )
+    total_facturado = sum(f["amount_total"] for f in facturas_mes)
+
+    # --- C. CLIENTES NUEVOS ---
+    partners_invoice_this_month = set()
+    for f in facturas_mes:
+        if f.get("partner_id"): partners_invoice_this_month.add(f["partner_id"][0])
+    
+    clientes_nuevos = 0
+    if partners_invoice_this_month:
+        old_buyers = client.env["account.move"].search_count([
+            ("move_type", "=", "out_invoice"),
+            ("state", "=", "posted"),
+            ("invoice_date", "<", start_str),
+            ("partner_id", "in", list(partners_invoice_this_month))
+        ])
+        # Nota: para exactitud total deberíamos comparar sets, pero por rendimiento simplificado:
+        # Si quieres exactitud de "quién es nuevo", hay que traer IDs viejos. 
+        # Dejamos tu lógica original o la mejoramos levemente:
+        old_buyers_data = client.env["account.move"].search_read(
             [
-                ("invoice_user_id", "=", user_id),
                 ("move_type", "=", "out_invoice"),
                 ("state", "=", "posted"),
-                ("invoice_date", ">=", start_str),
-                ("invoice_date", "<", end_str)
+                ("invoice_date", "<", start_str),
+                ("partner_id", "in", list(partners_invoice_this_month))
             ],
-            ["amount_total", "partner_id"]
+            ["partner_id"]
         )
-        total_facturado = sum(f["amount_total"] for f in facturas_mes)
+        old_ids = set(x["partner_id"][0] for x in old_buyers_data if x["partner_id"])
+        clientes_nuevos = len(partners_invoice_this_month - old_ids)
 
-        # --- C. CLIENTES NUEVOS ---
-        partners_invoice_this_month = set()
-        for f in facturas_mes:
-            if f.get("partner_id"): partners_invoice_this_month.add(f["partner_id"][0])
-        
-        clientes_nuevos = 0
-        if partners_invoice_this_month:
-            old_buyers = client.env["account.move"].search_count([
+    # --- D. CLIENTES PERDIDOS ---
+    six_months_ago = (start_date - timedelta(days=180)).strftime("%Y-%m-%d")
+    
+    # Mis clientes cartera
+    my_client_data = client.env["res.partner"].search_read(
+        [("user_id", "=", user_id), ("active", "=", True), ("customer_rank", ">", 0)],
+        ["id"]
+    )
+    all_ids_set = set(p["id"] for p in my_client_data)
+
+    # Quienes compraron en los ultimos 6 meses hasta fin de mes actual
+    recent_ids = set()
+    if all_ids_set:
+        recent_moves = client.env["account.move"].search_read(
+            [
                 ("move_type", "=", "out_invoice"),
                 ("state", "=", "posted"),
-                ("invoice_date", "<", start_str),
-                ("partner_id", "in", list(partners_invoice_this_month))
-            ])
-            # Nota: para exactitud total deberíamos comparar sets, pero por rendimiento simplificado:
-            # Si quieres exactitud de "quién es nuevo", hay que traer IDs viejos. 
-            # Dejamos tu lógica original o la mejoramos levemente:
-            old_buyers_data = client.env["account.move"].search_read(
-                [
-                    ("move_type", "=", "out_invoice"),
-                    ("state", "=", "posted"),
-                    ("invoice_date", "<", start_str),
-                    ("partner_id", "in", list(partners_invoice_this_month))
-                ],
-                ["partner_id"]
-            )
-            old_ids = set(x["partner_id"][0] for x in old_buyers_data if x["partner_id"])
-            clientes_nuevos = len(partners_invoice_this_month - old_ids)
-
-        # --- D. CLIENTES PERDIDOS ---
-        six_months_ago = (start_date - timedelta(days=180)).strftime("%Y-%m-%d")
-        
-        # Mis clientes cartera
-        my_client_data = client.env["res.partner"].search_read(
-            [("user_id", "=", user_id), ("active", "=", True), ("customer_rank", ">", 0)],
-            ["id"]
+                ("invoice_date", ">=", six_months_ago),
+                ("invoice_date", "<", end_str),
+                ("partner_id", "in", list(all_ids_set))
+            ],
+            ["partner_id"] 
         )
-        all_ids_set = set(p["id"] for p in my_client_data)
-
-        # Quienes compraron en los ultimos 6 meses hasta fin de mes actual
-        recent_ids = set()
-        if all_ids_set:
-            recent_moves = client.env["account.move"].search_read(
-                [
-                    ("move_type", "=", "out_invoice"),
-                    ("state", "=", "posted"),
-                    ("invoice_date", ">=", six_months_ago),
-                    ("invoice_date", "<", end_str),
-                    ("partner_id", "in", list(all_ids_set))
-                ],
-                ["partner_id"] 
-            )
-            for m in recent_moves:
-                if m.get("partner_id"): recent_ids.add(m["partner_id"][0])
-        
-        clientes_perdidos = len(all_ids_set - recent_ids)
+        for m in recent_moves:
+            if m.get("partner_id"): recent_ids.add(m["partner_id"][0])
+    
+    clientes_perdidos = len(all_ids_set - recent_ids)
+
+    # --- E. CLIENTES ATENDIDOS (NUEVO) ---
+    # Clientes únicos que metieron pedido en este mes
+    atendidos_ids = set()
+    for p in pedidos_mes:
+        if p.get("partner_id"):
+            atendidos_ids.add(p["partner_id"][0])
+    clientes_atendidos = len(atendidos_ids)
+
+    return {
+        "periodo": f"{req_month}/{req_year}",
+        "total_pedidos": pedidos_count,
+        "total_facturado": total_facturado,
+        "clientes_nuevos": clientes_nuevos,
+        "clientes_perdidos": clientes_perdidos,
+        "clientes_atendidos": clientes_atendidos # <--- DATO NUEVO
+    }, 200
+
+@swr_cache(_kpi_cache_key, ttl=KPI_SOFT_TTL, bg_ttl=KPI_CACHE_TTL)
+def query_kpi_vendedor(cuit, year, month):
+    """(payload, status); se cachea también el 404 de un CUIT inválido."""
+    return execute_odoo_operation(lambda client: _compute_kpi_vendedor(client, cuit, year, month))
 
-        # --- E. CLIENTES ATENDIDOS (NUEVO) ---
-        # Clientes únicos que metieron pedido en este mes
-        atendidos_ids = set()
-        for p in pedidos_mes:
-            if p.get("partner_id"):
-                atendidos_ids.add(p["partner_id"][0])
-        clientes_atendidos = len(atendidos_ids)
+@app.route("/kpi-vendedor", methods=["GET"])
+def get_kpi_vendedor():
+    cuit = request.args.get("cuit")
+    now = datetime.today()
+    try:
+        req_month = int(request.args.get("month", now.month))
+        req_year = int(request.args.get("year", now.year))
+    except ValueError:
+        req_month = now.month
+        req_year = now.year
 
-        return jsonify({
-            "periodo": f"{req_month}/{req_year}",
-            "total_pedidos": pedidos_count,
-            "total_facturado": total_facturado,
-            "clientes_nuevos": clientes_nuevos,
-            "clientes_perdidos": clientes_perdidos,
-            "clientes_atendidos": clientes_atendidos # <--- DATO NUEVO
-        })
+    if not cuit:
+        return jsonify({"error": "CUIT requerido"}), 400
 
     try:
-        return execute_odoo_operation(logic)
+        data, status = query_kpi_vendedor(cuit, req_year, req_month)
+        return jsonify(data), status
     except Exception as e:
         log.error(f"❌ /kpi-vendedor Error: {e}")
         return jsonify({"error": str(e)}), 500
@@ -3212,10 +3529,14 @@ def pedido_cache():
 
 @app.get("/health")
 def health():
+    # 503 mientras se calienta la cache (acotado por WARMUP_TIMEOUT) para no recibir tráfico en frío
+    wu = warmup.status()
     return jsonify({
         "ok": True,
+        "status": wu["state"],
+        "warmup": {"done": wu["done"], "failed": wu["failed"], "total": wu["total"]},
         "env": {"server": bool(ODOO_SERVER), "db": bool(ODOO_DB), "user": bool(ODOO_USER)},
-    })
+    }), 200 if wu["state"] == "ready" else 503
 
 @app.get("/_diag")
 def diag():
@@ -3252,6 +3573,9 @@ def diag():
     except Exception as e:
         data["checks"]["redis"] = {"ok": False, "error": str(e)}
         data["ok"] = False
+    data["cache"] = {**cache_stats(), "swr": swr_stats}
+    data["pg_pool"] = dal.stats()
+    data["write_behind"] = write_behind.stats()
 
     return jsonify(data), 200 if data["ok"] else 500
 
@@ -3309,37 +3633,11 @@ def odoo_invoices_partners():
     finally:
         release_odoo_client(client)
 
-# main.py - Agregar a las funciones de inicialización
-def init_offers_cache_table():
-    if not DATABASE_URL: return
-    conn = get_pg_connection()
-    if not conn: return
-    try:
-        cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS app_product_offers (
-                sku TEXT PRIMARY KEY,
-                price_offer NUMERIC(12,2),
-                is_active BOOLEAN DEFAULT TRUE,
-                last_sync TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        conn.commit()
-        cur.close()
-        log.info("✅ Tabla 'app_product_offers' verificada.")
-    except Exception as e:
-        log.error(f"❌ Error tabla ofertas: {e}")
-    finally:
-        if conn: conn.close()
-
-init_offers_cache_table()
-
-# Endpoint para que el Admin o un Cron fuerce la actualización desde Odoo
-@app.route("/admin/sync-offers", methods=["POST"])
-def sync_offers_to_pg():
+def sync_offers():
     """
     Sincronización total de Tarifa 70. 
     Busca SKUs tanto en variantes como en plantillas de producto.
+    Devuelve la cantidad de SKUs activos (la usan el endpoint y el scheduler).
     """
     client = get_odoo_client()
     pg_conn = get_pg_connection()
@@ -3360,70 +3658,111 @@ def sync_offers_to_pg():
 
         if not items:
             log.info("⚠️ Odoo no devolvió ningún ítem para la Tarifa 70.")
-            return jsonify({"ok": True, "count": 0, "message": "No hay datos en Odoo"})
-
+            return 0
+
+        # 2. Una sola lectura por modelo: variantes, plantillas y productos de las categorías
+        def _ids(field, applied_on):
+            return sorted({it[field][0] for it in items
+                           if it.get('applied_on') == applied_on and it.get(field)})
+
+        variant_ids = _ids('product_id', '0_product_variant')
+        tmpl_ids = _ids('product_tmpl_id', '1_product')
+        cat_ids = _ids('categ_id', '2_product_category')
+
+        variant_sku = {r['id']: r.get('default_code') for r in
+                       client.env['product.product'].read(variant_ids, ['default_code'])} if variant_ids else {}
+        tmpl_sku = {r['id']: r.get('default_code') for r in
+                    client.env['product.template'].read(tmpl_ids, ['default_code'])} if tmpl_ids else {}
+
+        categ_skus = {}
+        if cat_ids:
+            prods = client.env['product.template'].search_read(
+                [('categ_id', 'child_of', cat_ids)], ['default_code', 'categ_id']
+            )
+            leaf_ids = sorted({p['categ_id'][0] for p in prods if p.get('categ_id')})
+            # parent_path ("1/5/12/") da los ancestros de cada categoría sin recorrer el árbol
+            paths = {c['id']: c.get('parent_path') or f"{c['id']}/" for c in
+                     client.env['product.category'].read(leaf_ids, ['parent_path'])} if leaf_ids else {}
+            wanted = set(cat_ids)
+            for p in prods:
+                if not p.get('categ_id'):
+                    continue
+                path = paths.get(p['categ_id'][0], "")
+                for anc in {int(x) for x in path.split('/') if x} & wanted:
+                    categ_skus.setdefault(anc, []).append(p.get('default_code'))
+
+        offers = _offer_prices(items, variant_sku, tmpl_sku, categ_skus)
+
+        # 3. Reemplazo atómico de las ofertas activas
         cur = pg_conn.cursor()
-        cur.execute("UPDATE app_product_offers SET is_active = FALSE")
-        
-        sync_count = 0
-        for it in items:
-            price = float(it['fixed_price'])
-            applied_on = it.get('applied_on')
-            sku = None
-
-            # CASO A: Oferta aplicada a una VARIANTE específica
-            if applied_on == '0_product_variant' and it.get('product_id'):
-                variant_id = it['product_id'][0]
-                # Buscamos el SKU en la variante
-                variant_data = client.env['product.product'].read([variant_id], ['default_code'])[0]
-                sku = (variant_data.get('default_code') or "").strip()
-
-            # CASO B: Oferta aplicada al MODELO (Template)
-            elif applied_on == '1_product' and it.get('product_tmpl_id'):
-                tmpl_id = it['product_tmpl_id'][0]
-                tmpl_data = client.env['product.template'].read([tmpl_id], ['default_code'])[0]
-                sku = (tmpl_data.get('default_code') or "").strip()
-
-            # CASO C: Oferta aplicada a una CATEGORÍA
-            elif applied_on == '2_product_category' and it.get('categ_id'):
-                cat_id = it['categ_id'][0]
-                prods = client.env['product.template'].search_read(
-                    [('categ_id', 'child_of', cat_id)], ['default_code']
-                )
-                for p in prods:
-                    p_sku = (p.get('default_code') or "").strip()
-                    if p_sku:
-                        _upsert_offer_row(cur, p_sku, price)
-                        sync_count += 1
-                continue # Saltamos el upsert de abajo porque ya lo hicimos en el loop
-
-            # Si encontramos un SKU válido en Caso A o B, guardamos
-            if sku:
-                _upsert_offer_row(cur, sku, price)
-                sync_count += 1
-            
+        _replace_offers(cur, offers)
         pg_conn.commit()
         cur.close()
+        sync_count = len(offers)
         log.info(f"✅ Sincronización finalizada. SKUs activos: {sync_count}")
-        return jsonify({"ok": True, "count": sync_count})
+        return sync_count
     except Exception as e:
         if pg_conn: pg_conn.rollback()
-        log.error(f"❌ Error crítico en sync-offers: {e}")
-        return jsonify({"error": str(e)}), 500
+        handle_connection_error(e)
+        raise
     finally:
-        release_odoo_client(client)
         if pg_conn: pg_conn.close()
 
-def _upsert_offer_row(cursor, sku, price):
-    """Helper para insertar o actualizar la oferta en Postgres."""
-    cursor.execute("""
+# Endpoint para que el Admin o un Cron fuerce la actualización desde Odoo
+@app.route("/admin/sync-offers", methods=["POST"])
+def sync_offers_to_pg():
+    try:
+        count = sync_offers()
+        if not count:
+            return jsonify({"ok": True, "count": 0, "message": "No hay datos en Odoo"})
+        return jsonify({"ok": True, "count": count})
+    except Exception as e:
+        log.error(f"❌ Error crítico en sync-offers: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def _offer_prices(items, variant_sku, tmpl_sku, categ_skus):
+    """
+    SKU -> precio de oferta. Los ítems se aplican en el orden en que los
+    devuelve Odoo: si un SKU aparece en varios, gana el último (como hacía el
+    upsert fila por fila).
+    """
+    offers = {}
+    for it in items:
+        price = float(it['fixed_price'])
+        applied_on = it.get('applied_on')
+        codes = []
+        # CASO A: Oferta aplicada a una VARIANTE específica
+        if applied_on == '0_product_variant' and it.get('product_id'):
+            codes = [variant_sku.get(it['product_id'][0])]
+        # CASO B: Oferta aplicada al MODELO (Template)
+        elif applied_on == '1_product' and it.get('product_tmpl_id'):
+            codes = [tmpl_sku.get(it['product_tmpl_id'][0])]
+        # CASO C: Oferta aplicada a una CATEGORÍA (incluye subcategorías)
+        elif applied_on == '2_product_category' and it.get('categ_id'):
+            codes = categ_skus.get(it['categ_id'][0], [])
+        for code in codes:
+            sku = (code or "").strip()
+            if sku:
+                offers[sku] = price
+    return offers
+
+def _replace_offers(cursor, offers):
+    """
+    Reemplaza el contenido de app_product_offers dentro de la transacción del
+    caller: DELETE + un solo execute_values. La tabla no se recrea (conserva
+    OID, grants, vistas y estadísticas) y el DELETE no bloquea a los lectores,
+    que por MVCC ven el set viejo o el nuevo, nunca uno a medio actualizar.
+    ON CONFLICT cubre una sync concurrente que haya insertado antes del commit.
+    """
+    cursor.execute("SET LOCAL lock_timeout = '5s'")
+    cursor.execute("DELETE FROM app_product_offers")
+    execute_values(cursor, """
         INSERT INTO app_product_offers (sku, price_offer, is_active, last_sync)
-        VALUES (%s, %s, TRUE, CURRENT_TIMESTAMP)
-        ON CONFLICT (sku) DO UPDATE SET 
-            price_offer = EXCLUDED.price_offer,
-            is_active = TRUE,
-            last_sync = CURRENT_TIMESTAMP;
-    """, (sku, price))
+        VALUES %s
+        ON CONFLICT (sku) DO UPDATE SET
+            price_offer = EXCLUDED.price_offer, is_active = TRUE, last_sync = EXCLUDED.last_sync
+    """, [(sku, price) for sku, price in offers.items()],
+        template="(%s, %s, TRUE, CURRENT_TIMESTAMP)", page_size=1000)
 
 # ========= DEBUG ROUTES (temporales) =========
 @app.get("/__routes")
@@ -3498,6 +3837,20 @@ def __try_login_now():
 
 # main.py
 
+# Stock por template, cacheado de a una key por template (stock_state:<id>)
+STOCK_CACHE_TTL = int(os.getenv("STOCK_CACHE_TTL", "60"))
+
+def cached_stock_states(client, product_templates):
+    """Como _compute_stock_states, pero sólo consulta Odoo por los templates que no están en cache."""
+    keys = {f"stock_state:{int(p['id'])}": int(p['id']) for p in product_templates}
+
+    def batch(missing):
+        computed = _compute_stock_states(client, [{'id': keys[k]} for k in missing])
+        return {f"stock_state:{tid}": v for tid, v in computed.items()}
+
+    found = get_many_or_execute(list(keys), batch, ttl=STOCK_CACHE_TTL)
+    return {tid: found[k] for k, tid in keys.items() if k in found}
+
 def _compute_stock_states(client, product_templates):
     """
     Calcula el estado de stock Y la cantidad exacta.
@@ -3635,33 +3988,6 @@ def _compute_stock_states(client, product_templates):
 
 # --- AGREGAR EN main.py ---
 
-def init_newsletter_table():
-    """Crea la tabla de suscriptores si no existe."""
-    if not DATABASE_URL:
-        return
-    conn = get_pg_connection()
-    if not conn:
-        return
-    try:
-        cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS newsletter_subscribers (
-                id SERIAL PRIMARY KEY,
-                email TEXT UNIQUE NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        conn.commit()
-        cur.close()
-        log.info("✅ Tabla 'newsletter_subscribers' verificada.")
-    except Exception as e:
-        log.error(f"❌ Error tabla newsletter: {e}")
-    finally:
-        if conn: conn.close()
-
-# Inicializamos la tabla al arrancar
-init_newsletter_table()
-
 @app.route('/subscribe', methods=['POST'])
 def subscribe_newsletter():
     data = request.get_json() or {}
@@ -3697,31 +4023,6 @@ def subscribe_newsletter():
 
 # main.py
 
-# --- INICIALIZAR TABLA FAVORITOS ---
-def init_favorites_table():
-    if not DATABASE_URL: return
-    conn = get_pg_connection()
-    if not conn: return
-    try:
-        cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS app_user_favorites (
-                user_id INTEGER,
-                product_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (user_id, product_id)
-            );
-        """)
-        conn.commit()
-        cur.close()
-        log.info("✅ Tabla 'app_user_favorites' verificada.")
-    except Exception as e:
-        log.error(f"❌ Error tabla favoritos: {e}")
-    finally:
-        if conn: conn.close()
-
-init_favorites_table()
-
 # --- ENDPOINTS FAVORITOS (CORREGIDOS) ---
 
 @app.route('/favoritos/toggle', methods=['POST'])
@@ -3738,23 +4039,17 @@ def toggle_favorito():
     
     try:
         # 1. Obtener User ID desde Odoo
-        partner = client.env["res.partner"].search([("vat", "=", cuit)], limit=1)
-        if not partner: return jsonify({"error": "Usuario no encontrado"}), 404
-        
-        # CORRECCIÓN: Accedemos a [0] para sacar el ID escalar
-        partner_id = int(partner[0].id)
-        
-        user = client.env["res.users"].search([("partner_id", "=", partner_id)], limit=1)
-        if not user: return jsonify({"error": "Usuario sin login"}), 404
+        ids = resolve_cuit(client, cuit)
+        if not ids: return jsonify({"error": "Usuario no encontrado"}), 404
         
-        # CORRECCIÓN: Accedemos a [0] para evitar el error "argument must be... not list"
-        user_id = int(user[0].id)
+        user_id = ids["user_id"]
+        if not user_id: return jsonify({"error": "Usuario sin login"}), 404
         
         # 2. Toggle en PostgreSQL
         cur = pg_conn.cursor()
         
         # Verificar si existe
-        cur.execute("SELECT 1 FROM app_user_favorites WHERE user_id = %s AND product_id = %s", (user_id, product_id))
+        dal.cursor_execute(cur, SQL_FAVORITE_EXISTS, (user_id, product_id))
         exists = cur.fetchone()
         
         is_favorite = False
@@ -3774,6 +4069,7 @@ def toggle_favorito():
 
     except Exception as e:
         if pg_conn: pg_conn.rollback()
+        handle_connection_error(e)
         log.error(f"❌ /favoritos/toggle: {e}")
         return jsonify({"error": str(e)}), 500
     finally:
@@ -3790,19 +4086,14 @@ def get_favoritos():
     
     try:
         # 1. Obtener User ID (Misma corrección aplicada aquí)
-        partner = client.env["res.partner"].search([("vat", "=", cuit)], limit=1)
-        if not partner: return jsonify({"items": []}) 
-        
-        partner_id = int(partner[0].id)
+        ids = resolve_cuit(client, cuit)
+        if not ids or not ids["user_id"]: return jsonify({"items": []})
         
-        user = client.env["res.users"].search([("partner_id", "=", partner_id)], limit=1)
-        if not user: return jsonify({"items": []})
-        
-        user_id = int(user[0].id)
+        user_id = ids["user_id"]
 
         # 2. Obtener IDs de productos favoritos desde PG
         cur = pg_conn.cursor()
-        cur.execute("SELECT product_id FROM app_user_favorites WHERE user_id = %s ORDER BY created_at DESC", (user_id,))
+        dal.cursor_execute(cur, SQL_FAVORITES, (user_id,))
         rows = cur.fetchall()
         cur.close()
         
@@ -3813,38 +4104,31 @@ def get_favoritos():
 
         # 3. Obtener detalles de productos desde Odoo
         
-        # A. Mapa de ofertas (PG)
-        offer_map = {}
-        cur = pg_conn.cursor()
-        cur.execute("SELECT sku, price_offer FROM app_product_offers WHERE is_active = TRUE")
-        offer_rows = cur.fetchall()
-        cur.close()
-        offer_map = {r[0]: float(r[1]) for r in offer_rows}
-
-        # B. Consulta Odoo
+        # A. Consulta Odoo
         prods_odoo = client.env["product.template"].search_read(
             [("id", "in", fav_ids)],
             ["id", "name", "list_price", "default_code", "write_date", "categ_id"]
         )
         
-        # C. Stock
-        stock_map = _compute_stock_states(client, prods_odoo)
+        # B. Stock y ofertas
+        stock_map = cached_stock_states(client, prods_odoo)
+        offer_prices = resolve_offer_prices([{
+            "sku": (p.get("default_code") or "").strip(),
+            "tmpl_id": p["id"],
+            "categ_id": p["categ_id"][0] if p.get("categ_id") else None,
+            "list_price": float(p.get("list_price") or 0),
+        } for p in prods_odoo], pg_conn)
 
         def get_fb_url(path):
             return f"https://firebasestorage.googleapis.com/v0/b/{FIREBASE_BUCKET}/o/{quote(path, safe='')}?alt=media"
 
-        # D. Normalizar
+        # C. Normalizar
         items = []
-        for p in prods_odoo:
+        for p, offer_price in zip(prods_odoo, offer_prices):
             pid = p["id"]
             sku = (p["default_code"] or "").strip()
             wd = str(p["write_date"] or "")
             list_price = float(p.get("list_price") or 0)
-            
-            # Oferta
-            offer_price = offer_map.get(sku, None)
-            if offer_price is not None and offer_price >= list_price:
-                offer_price = None
 
             # Imagen
             code_path = f"products/{sku}/{sku}.webp" if sku else None
@@ -3869,6 +4153,7 @@ def get_favoritos():
         return jsonify({"items": items})
 
     except Exception as e:
+        handle_connection_error(e)
         log.error(f"❌ /favoritos: {e}")
         return jsonify({"error": str(e)}), 500
     finally:
@@ -3879,46 +4164,8 @@ def get_favoritos():
 
 from werkzeug.security import generate_password_hash, check_password_hash
 
-# 1. ACTUALIZAR TABLAS (Puedes reemplazar tu init_db o agregar esta función)
 # main.py
 
-def init_auth_tables():
-    if not DATABASE_URL: return
-    conn = get_pg_connection()
-    if not conn: return
-    try:
-        cur = conn.cursor()
-        # Aseguramos que cuit sea UNIQUE para que el ON CONFLICT funcione
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS app_users (
-                id SERIAL PRIMARY KEY,
-                cuit VARCHAR(20) UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                role VARCHAR(50) DEFAULT 'PENDING', 
-                name VARCHAR(255),
-                push_token VARCHAR(255),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_active BOOLEAN DEFAULT TRUE
-            );
-        """)
-        
-        # Si la tabla ya existe pero no tiene el UNIQUE, lo agregamos:
-        try:
-            cur.execute("ALTER TABLE app_users ADD CONSTRAINT unique_cuit_auth UNIQUE (cuit);")
-        except:
-            conn.rollback() # Ya existe o error, no importa
-
-        conn.commit()
-        cur.close()
-        log.info("✅ Tabla 'app_users' sincronizada correctamente.")
-    except Exception as e:
-        log.error(f"❌ Error init_auth_tables: {e}")
-    finally:
-        if conn: conn.close()
-
-# Ejecutar al inicio
-init_auth_tables()
-
 def send_expo_push_notification(token, title, body, data=None):
     """Envía una notificación a través de los servidores de Expo"""
     if not token: 
@@ -3982,7 +4229,7 @@ def register():
         cur = pg_conn.cursor()
         
         # A. Verificar si ya tiene cuenta en la APP (Postgres)
-        cur.execute("SELECT id FROM app_users WHERE cuit = %s", (cuit,))
+        dal.cursor_execute(cur, SQL_USER_EXISTS, (cuit,))
         if cur.fetchone():
             return jsonify({"error": "Ya existe una cuenta para este CUIT. Intente iniciar sesión."}), 409
 
@@ -4039,7 +4286,7 @@ def login():
     
     try:
         cur = pg_conn.cursor()
-        cur.execute("SELECT id, password_hash, role, name, is_active FROM app_users WHERE cuit = %s", (cuit,))
+        dal.cursor_execute(cur, SQL_USER_LOGIN, (cuit,))
         user = cur.fetchone()
         cur.close()
 
@@ -4238,31 +4485,6 @@ def update_app_user_role():
 
 # --- GESTIÓN DE CARRITO PERSISTENTE ---
 
-def init_cart_table():
-    if not DATABASE_URL: return
-    conn = get_pg_connection()
-    if not conn: return
-    try:
-        cur = conn.cursor()
-        # Tabla simple: Un usuario -> Un JSON gigante con sus items (o filas por item)
-        # Usaremos filas por usuario para simplicidad: user_id | items_json
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS app_user_carts (
-                user_id INTEGER PRIMARY KEY,
-                items_json TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        conn.commit()
-        cur.close()
-        log.info("✅ Tabla 'app_user_carts' verificada.")
-    except Exception as e:
-        log.error(f"❌ Error tabla carrito: {e}")
-    finally:
-        if conn: conn.close()
-
-init_cart_table()
-
 @app.route('/cart/save', methods=['POST'])
 def update_cart():
     data = request.json or {}
@@ -4319,13 +4541,9 @@ def load_cart():
     client = get_odoo_client()
     try:
         # 1. Obtener User ID
-        partner = client.env["res.partner"].search([("vat", "=", cuit)], limit=1)
-        if not partner: return jsonify({"items": []})
-        partner_id = int(partner[0].id)
-        
-        user = client.env["res.users"].search([("partner_id", "=", partner_id)], limit=1)
-        if not user: return jsonify({"items": []})
-        user_id = int(user[0].id)
+        ids = resolve_cuit(client, cuit)
+        if not ids or not ids["user_id"]: return jsonify({"items": []})
+        user_id = ids["user_id"]
 
         # 2. Leer de Postgres
         cur = pg_conn.cursor()
@@ -4346,6 +4564,44 @@ def load_cart():
         if pg_conn: pg_conn.close()
         release_odoo_client(client)
 
+@app.route('/cart/pricing', methods=['POST'])
+def cart_pricing():
+    """
+    Precio de oferta por línea del carrito según cantidad y fecha/hora actual.
+    Body: {"items": [{"default_code"|"sku", "quantity", "list_price"?}]}
+    """
+    data = request.get_json(silent=True) or {}
+    raw = (data.get('items') or []) if isinstance(data, dict) else None
+    if not isinstance(raw, list):
+        return jsonify({"error": "items debe ser una lista"}), 400
+    lines = []
+    for n, i in enumerate(raw):
+        if not isinstance(i, dict):
+            return jsonify({"error": f"Item {n} inválido"}), 400
+        sku = str(i.get('default_code') or i.get('sku') or "").strip()
+        try:
+            qty = float(i.get('quantity') or i.get('product_uom_qty') or 1)
+            if not math.isfinite(qty) or qty <= 0: raise ValueError()
+        except Exception:
+            return jsonify({"error": f"Cantidad inválida para producto {sku or n}"}), 400
+        list_price = i.get('list_price')
+        try:
+            list_price = float(list_price) if list_price is not None else None
+        except Exception:
+            return jsonify({"error": f"list_price inválido para producto {sku or n}"}), 400
+        lines.append({"sku": sku, "qty": qty, "list_price": list_price})
+    pg_conn = None if offer_engine.get_index() else get_pg_connection()
+    try:
+        prices = resolve_offer_prices(lines, pg_conn)
+        return jsonify({"items": [
+            {"sku": l["sku"], "quantity": l["qty"], "price_offer": p} for l, p in zip(lines, prices)
+        ]})
+    except Exception as e:
+        log.error(f"❌ /cart/pricing: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if pg_conn: pg_conn.close()
+
 # ---------- Disparar sync manual (protegido por token) ----------
 SYNC_TOKEN = os.getenv("SYNC_TOKEN")
 
@@ -4356,23 +4612,202 @@ def admin_sync_now():
     token = request.headers.get("X-Sync-Token")
     if SYNC_TOKEN and token != SYNC_TOKEN:
         return jsonify({"ok": False, "error": "unauthorized"}), 401
+    # ?full=1 fuerza la reconciliación completa; si no, incremental por write_date
+    full = True if request.args.get("full") in ("1", "true") else None
     try:
-        p = sync_products()
-        c = sync_partners()
+        # ?parallel=1: pasada completa particionada por rangos de id
+        if request.args.get("parallel") in ("1", "true"):
+            return jsonify({"ok": True, **run_partitioned_sync()})
+        p = sync_products(full=full)
+        c = sync_partners(full=full)
         return jsonify({"ok": True, "synced_products": p, "synced_partners": c})
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
-# ─────────────────────────── Run ──────────────────────────────
-if __name__ == "__main__":
-    port = int(os.environ.get("PORT", 5000))
+# ───────── Scheduler de jobs en segundo plano ─────────
+from scheduler import Scheduler, Job
+
+# Intervalos por job (seg); productos/partners/ofertas heredan BACKGROUND_SYNC_INTERVAL
+JOB_INTERVALS = {
+    "products": int(os.getenv("JOB_PRODUCTS_INTERVAL", BACKGROUND_SYNC_INTERVAL)),
+    "partners": int(os.getenv("JOB_PARTNERS_INTERVAL", BACKGROUND_SYNC_INTERVAL)),
+    "offers":   int(os.getenv("JOB_OFFERS_INTERVAL", BACKGROUND_SYNC_INTERVAL)),
+    "stock":    int(os.getenv("JOB_STOCK_INTERVAL", "120")),
+    "kpis":     int(os.getenv("JOB_KPIS_INTERVAL", "900")),
+    # Por debajo de OFFER_INDEX_MAX_AGE (con jitter) para que el request nunca lo encuentre vencido
+    "offer_index": int(os.getenv("JOB_OFFER_INDEX_INTERVAL", OFFER_INDEX_MAX_AGE * 2 // 3)),
+}
+
+def record_sync_run(job, started, finished, duration_ms, rows, error):
+    if not DATABASE_URL:
+        return
+    dal.execute("""
+        INSERT INTO sync_runs (job, started_at, finished_at, duration_ms, row_count, ok, error)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """, (job, started, finished, duration_ms, rows, error is None, error[:2000] if error else None))
+
+def _kpi_seller_cuits():
+    """CUITs de los vendedores activos (app_users)."""
+    if not DATABASE_URL:
+        return []
+    rows = dal.query("SELECT cuit FROM app_users WHERE is_active = TRUE AND role IN ('Vendedor', 'Vendedor Black')")
+    return [r["cuit"] for r in rows if r["cuit"]]
+
+def precompute_kpi(cuit, year, month):
+    """Calcula y cachea los KPIs de un vendedor; True si quedó guardado."""
+    data, status = execute_odoo_operation(
+        lambda client: _compute_kpi_vendedor(client, cuit, year, month)
+    )
+    if status != 200:
+        return False
+    swr_set(_kpi_cache_key(cuit, year, month), [data, status], KPI_CACHE_TTL)
+    return True
+
+def precompute_kpis():
+    """Calcula y cachea los KPIs del mes en curso de cada vendedor activo."""
+    if not redis_client:
+        return 0
+    now = datetime.today()
+    done = 0
+    for cuit in _kpi_seller_cuits():
+        try:
+            done += precompute_kpi(cuit, now.year, now.month)
+        except Exception as e:
+            log.warning(f"[KPI] {cuit}: {e}")
+    return done
+
+scheduler = Scheduler(redis_client, on_run=record_sync_run)
+if HAS_SYNC:
+    scheduler.add(Job("products", sync_products, JOB_INTERVALS["products"]))
+    scheduler.add(Job("partners", sync_partners, JOB_INTERVALS["partners"]))
+    scheduler.add(Job("stock", sync_stock, JOB_INTERVALS["stock"]))
+scheduler.add(Job("offers", sync_offers, JOB_INTERVALS["offers"]))
+scheduler.add(Job("kpis", precompute_kpis, JOB_INTERVALS["kpis"]))
+
+# El índice de ofertas vive en la memoria de cada worker: lo recarga cada proceso,
+# sin lease (Scheduler sin Redis) y sin historial en sync_runs.
+worker_scheduler = Scheduler()
+worker_scheduler.add(Job("offer_index", refresh_offer_index, JOB_INTERVALS["offer_index"], initial_delay=0))
+
+# Arrancan al importar, como warmup, porque gunicorn no pasa por __main__. Todos
+# los workers corren el loop de `scheduler`; el lease de cada job en Redis hace
+# que una sola réplica lo ejecute por vez.
+if ENABLE_BACKGROUND_SYNC:
+    for _sched in (scheduler, worker_scheduler):
+        try:
+            _sched.start()
+        except Exception as e:
+            log.warning(f"No se pudo iniciar el scheduler: {e}")
 
-    # Lanzar sync en background si está habilitado
-    if ENABLE_BACKGROUND_SYNC:
+@app.get("/admin/sync/status")
+def admin_sync_status():
+    token = request.headers.get("X-Sync-Token")
+    if SYNC_TOKEN and token != SYNC_TOKEN:
+        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    limit = min(int(request.args.get("limit", 20)), 200)
+    runs = []
+    if DATABASE_URL:
+        conn = get_pg_connection()
         try:
-            import threading
-            t = threading.Thread(target=periodic_sync_loop, args=(BACKGROUND_SYNC_INTERVAL,), daemon=True)
-            t.start()
-            log.info(f"Background sync habilitado cada {BACKGROUND_SYNC_INTERVAL}s")
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute("""
+                SELECT job, started_at, finished_at, duration_ms, row_count, ok, error
+                FROM sync_runs ORDER BY started_at DESC LIMIT %s
+            """, (limit,))
+            for r in cur.fetchall():
+                r["started_at"] = r["started_at"].isoformat()
+                r["finished_at"] = r["finished_at"].isoformat()
+                runs.append(r)
+            cur.close()
         except Exception as e:
-            log.warning(f"No se pudo iniciar background sync: {e}")
+            log.warning(f"[SCHED] no se pudo leer sync_runs: {e}")
+        finally:
+            if conn: conn.close()
+    return jsonify({"ok": True, "enabled": ENABLE_BACKGROUND_SYNC, "jobs": scheduler.status(),
+                    "worker_jobs": worker_scheduler.status(), "runs": runs})
+
+# ───────── Métricas de cache ─────────
+
+def _sync_token_ok():
+    """X-Sync-Token o Authorization: Bearer (lo que manda Prometheus); abierto si no hay SYNC_TOKEN."""
+    if not SYNC_TOKEN:
+        return True
+    auth = request.headers.get("Authorization", "")
+    token = request.headers.get("X-Sync-Token") or (auth[7:] if auth.startswith("Bearer ") else None)
+    return token == SYNC_TOKEN
+
+@app.get("/metrics")
+def metrics():
+    """Contadores e histogramas de cache de ESTE worker; ?format=json para verlos como JSON."""
+    if not _sync_token_ok():
+        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    if request.args.get("format") == "json":
+        return jsonify({"pid": os.getpid(), **cache_stats(), "swr": swr_stats})
+    return Response(cache_metrics.prometheus(), mimetype="text/plain; version=0.0.4")
+
+@app.get("/admin/cache/report")
+def admin_cache_report():
+    """Keys, memoria y TTL promedio por namespace (SCAN, no bloquea Redis). ?match=facturas:*&max_keys=50000&memory=0"""
+    if not _sync_token_ok():
+        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    if not redis_client:
+        return jsonify({"ok": False, "error": "sin REDIS_URL"}), 501
+    try:
+        report = scan_report(
+            redis_client,
+            match=request.args.get("match", "*"),
+            max_keys=min(int(request.args.get("max_keys", 200000)), 1000000),
+            memory=request.args.get("memory", "1") not in ("0", "false"),
+        )
+        info = redis_client.info("memory")
+        report["used_memory"] = info.get("used_memory")
+        report["maxmemory"] = info.get("maxmemory")
+        return jsonify({"ok": True, **report})
+    except Exception as e:
+        log.error(f"❌ /admin/cache/report: {e}")
+        return jsonify({"ok": False, "error": str(e)}), 500
+
+# ───────── Warm-up de cache después del deploy (ver warmup.py) ─────────
+from warmup import Warmup
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", "4"))
+WARMUP_TIMEOUT = int(os.getenv("WARMUP_TIMEOUT", "120"))
+WARMUP_PRODUCT_PAGES = int(os.getenv("WARMUP_PRODUCT_PAGES", "3"))
+WARMUP_PAGE_SIZE = 20  # límite por defecto de /productos
+
+def _warm_productos():
+    """Catálogo por defecto de /productos y el stock de sus primeras páginas."""
+    catalogo = query_catalogo("", False, None, None)
+    first = catalogo["productos"][:WARMUP_PRODUCT_PAGES * WARMUP_PAGE_SIZE]
+    execute_odoo_operation(lambda client: cached_stock_states(client, first))
+
+def warmup_plan():
+    tasks = [
+        ("marcas", query_marcas),
+        ("categorias", query_categorias),
+        ("plazos_pago", query_plazos_pago),
+        ("tipo_cambio", query_tipo_cambio),
+        ("productos", _warm_productos),
+    ]
+    now = datetime.today()
+    for cuit in _kpi_seller_cuits():
+        tasks.append((f"kpi:{cuit}", lambda c=cuit: precompute_kpi(c, now.year, now.month)))
+    return tasks
+
+warmup = Warmup(
+    redis_client if WARMUP_ENABLED else None, warmup_plan,
+    concurrency=WARMUP_CONCURRENCY, timeout=WARMUP_TIMEOUT,
+    # Sin commit de deploy, un id por proceso: un reinicio no hereda el "ready" anterior
+    run_id=os.getenv("RENDER_GIT_COMMIT") or f"boot-{uuid.uuid4().hex[:12]}",
+)
+# Cada worker de gunicorn importa main: todos lo intentan, uno solo toma el lease
+warmup.start()
+
+@app.get("/_diag/warmup")
+def diag_warmup():
+    return jsonify(warmup.status())
+
+# ─────────────────────────── Run ──────────────────────────────
+if __name__ == "__main__":
+    port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port)
\ No newline at end of file
@@ -0,0 +1,452 @@
+# migrations.py
+"""
+Migraciones de esquema versionadas.
+
+Antes cada worker de gunicorn corría al importar main.py / repos.py una docena
+de init_* con CREATE/ALTER (incluido DROP CONSTRAINT). Ahora el DDL vive acá,
+numerado, y se aplica una sola vez por deploy: al arrancar los workers
+(main.check_schema, MIGRATE_ON_BOOT=1 por defecto, porque Render ignora la
+fase release) o a mano / en un pre-deploy:
+
+    python migrations.py            # aplica lo pendiente
+    python migrations.py --status   # lista aplicadas / pendientes
+
+- `schema_migrations` guarda versión, nombre, checksum y duración de cada una.
+- Un advisory lock de Postgres serializa corridas simultáneas (dos deploys,
+  o varios workers arrancando con MIGRATE_ON_BOOT): el segundo espera y no encuentra nada
+  pendiente.
+- Cada migración corre en su propia transacción junto con su fila en
+  schema_migrations; si falla no queda a medias. Las que no pueden ir en
+  transacción (CREATE INDEX CONCURRENTLY) se declaran con transaction=False y
+  una lista de statements. Un CONCURRENTLY cortado deja el índice INVALID con
+  ese nombre (que IF NOT EXISTS saltearía), así que antes de cada uno se borra
+  el índice inválido si lo hay.
+- Las primeras versiones son el DDL que ya existía, escrito idempotente
+  (IF NOT EXISTS), así que aplicarlas sobre una base en producción no cambia
+  nada.
+
+Nunca editar una migración ya aplicada: agregar una nueva al final.
+"""
+import os
+import re
+import sys
+import time
+import hashlib
+import logging
+from collections import namedtuple
+
+import psycopg2
+
+import dal
+
+log = logging.getLogger("salbom.migrations")
+
+# Identificador fijo del advisory lock (cualquier bigint propio de esta app)
+MIGRATIONS_LOCK_ID = 7_261_046
+MIGRATIONS_LOCK_TIMEOUT = int(os.getenv("MIGRATIONS_LOCK_TIMEOUT", "300"))
+
+Migration = namedtuple("Migration", "version name sql transaction", defaults=(True,))
+
+_CONCURRENT_INDEX = re.compile(
+    r"^\s*CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.I)
+
+
+MIGRATIONS = [
+    Migration(1, "app_tables", """
+        -- main.py: init_auth_tables
+        CREATE TABLE IF NOT EXISTS app_users (
+            id SERIAL PRIMARY KEY,
+            cuit VARCHAR(20) UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            role VARCHAR(50) DEFAULT 'PENDING',
+            name VARCHAR(255),
+            push_token VARCHAR(255),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT TRUE
+        );
+        -- El ON CONFLICT (cuit) necesita un UNIQUE; tablas viejas pueden no tenerlo
+        -- (antes lo agregaban init_auth_tables y /fix-schema)
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_constraint c
+                JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY (c.conkey)
+                WHERE c.conrelid = 'app_users'::regclass AND c.contype IN ('u', 'p')
+                  AND a.attname = 'cuit' AND array_length(c.conkey, 1) = 1
+            ) THEN
+                ALTER TABLE app_users ADD CONSTRAINT app_users_cuit_key UNIQUE (cuit);
+            END IF;
+        END $$;
+
+        -- init_roles_table: sin PK para permitir pre-asignados (user_id NULL)
+        CREATE TABLE IF NOT EXISTS app_user_roles (
+            user_id INTEGER,
+            role_name TEXT NOT NULL
+        );
+        ALTER TABLE app_user_roles ADD COLUMN IF NOT EXISTS email TEXT;
+        ALTER TABLE app_user_roles ADD COLUMN IF NOT EXISTS name TEXT;
+        ALTER TABLE app_user_roles ADD COLUMN IF NOT EXISTS cuit TEXT;
+        ALTER TABLE app_user_roles DROP CONSTRAINT IF EXISTS app_user_roles_pkey;
+        ALTER TABLE app_user_roles ALTER COLUMN user_id DROP NOT NULL;
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_roles_cuit ON app_user_roles (cuit) WHERE cuit IS NOT NULL;
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_roles_email ON app_user_roles (email) WHERE email IS NOT NULL;
+
+        -- init_config_table: clave (ej: 'popup_tc') -> valor (JSON text)
+        CREATE TABLE IF NOT EXISTS app_configurations (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+
+        -- init_discounts_table
+        CREATE TABLE IF NOT EXISTS app_payment_discounts (
+            payment_term_id INTEGER PRIMARY KEY,
+            discount NUMERIC(5,2) DEFAULT 0,
+            min_amount NUMERIC(12,2) DEFAULT 0
+        );
+        ALTER TABLE app_payment_discounts ADD COLUMN IF NOT EXISTS discount2 NUMERIC(5,2) DEFAULT 0;
+        ALTER TABLE app_payment_discounts ADD COLUMN IF NOT EXISTS allow_in_offer BOOLEAN DEFAULT FALSE;
+
+        -- init_offers_cache_table
+        CREATE TABLE IF NOT EXISTS app_product_offers (
+            sku TEXT PRIMARY KEY,
+            price_offer NUMERIC(12,2),
+            is_active BOOLEAN DEFAULT TRUE,
+            last_sync TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        -- init_newsletter_table
+        CREATE TABLE IF NOT EXISTS newsletter_subscribers (
+            id SERIAL PRIMARY KEY,
+            email TEXT UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        -- init_favorites_table
+        CREATE TABLE IF NOT EXISTS app_user_favorites (
+            user_id INTEGER,
+            product_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, product_id)
+        );
+
+        -- init_cart_table: una fila por usuario con sus items en JSON
+        CREATE TABLE IF NOT EXISTS app_user_carts (
+            user_id INTEGER PRIMARY KEY,
+            items_json TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        -- init_sync_runs_table: historial de corridas del scheduler
+        CREATE TABLE IF NOT EXISTS sync_runs (
+            id BIGSERIAL PRIMARY KEY,
+            job TEXT NOT NULL,
+            started_at TIMESTAMPTZ NOT NULL,
+            finished_at TIMESTAMPTZ NOT NULL,
+            duration_ms INTEGER,
+            row_count INTEGER,
+            ok BOOLEAN NOT NULL,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_sync_runs_job_started ON sync_runs (job, started_at DESC);
+    """),
+
+    Migration(2, "repos_tables", """
+        -- repos.py: _init_schema
+        CREATE TABLE IF NOT EXISTS transporte_cliente (
+            cliente_id      BIGINT PRIMARY KEY,
+            transporte      TEXT,
+            updated_at      TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+        CREATE TABLE IF NOT EXISTS direcciones_cliente (
+            cliente_id      BIGINT NOT NULL,
+            idx             INTEGER NOT NULL,
+            contacto        TEXT,
+            calle           TEXT,
+            ciudad          TEXT,
+            estado          TEXT,
+            codigo_postal   TEXT,
+            es_principal    BOOLEAN,
+            es_entrega      BOOLEAN,
+            PRIMARY KEY (cliente_id, idx)
+        );
+        CREATE TABLE IF NOT EXISTS pedido_cache (
+            id                BIGSERIAL PRIMARY KEY,
+            cliente_id        BIGINT,
+            moneda            TEXT,
+            tipo_cambio       NUMERIC,
+            base_imponible    NUMERIC,
+            impuestos_totales NUMERIC,
+            total             NUMERIC,
+            payload_json      JSONB,
+            respuesta_json    JSONB,
+            created_at        TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+        CREATE TABLE IF NOT EXISTS api_error_log (
+            id           BIGSERIAL PRIMARY KEY,
+            endpoint     TEXT,
+            metodo       TEXT,
+            status_code  TEXT,
+            mensaje      TEXT,
+            detalle_json JSONB,
+            created_at   TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+        CREATE TABLE IF NOT EXISTS productos_cache (
+            id           BIGINT PRIMARY KEY,         -- product.template id
+            name         TEXT,
+            default_code TEXT,
+            list_price   NUMERIC,
+            write_date   TIMESTAMP,
+            updated_at   TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS idx_productos_cache_name ON productos_cache USING GIN (to_tsvector('spanish', coalesce(name,'')));
+        CREATE INDEX IF NOT EXISTS idx_productos_cache_code ON productos_cache (default_code);
+        ALTER TABLE productos_cache ADD COLUMN IF NOT EXISTS content_hash TEXT;
+        ALTER TABLE productos_cache ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP;
+        CREATE TABLE IF NOT EXISTS clientes_vendedor_cache (
+            vendedor_cuit TEXT NOT NULL,
+            cliente_id    BIGINT NOT NULL,
+            name          TEXT,
+            vat           TEXT,
+            updated_at    TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (vendedor_cuit, cliente_id)
+        );
+        -- Assets externos (imágenes / PDFs) por producto
+        CREATE TABLE IF NOT EXISTS product_asset (
+            id               BIGSERIAL PRIMARY KEY,
+            product_tmpl_id  BIGINT NOT NULL,
+            kind             TEXT NOT NULL CHECK (kind IN ('image','pdf')),
+            variant          TEXT,
+            title            TEXT,
+            sort_order       INTEGER DEFAULT 0,
+            url              TEXT NOT NULL,     -- URL pública (CDN / r2.dev)
+            key              TEXT,              -- clave en el bucket (opcional)
+            meta             JSONB,             -- ej: {"w":1600,"h":900,"sha":"abc123"}
+            created_at       TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS idx_product_asset_prod ON product_asset(product_tmpl_id);
+        CREATE INDEX IF NOT EXISTS idx_product_asset_kind ON product_asset(kind);
+        CREATE INDEX IF NOT EXISTS idx_product_asset_sort ON product_asset(product_tmpl_id, kind, sort_order);
+    """),
+
+    Migration(3, "sync_mirror", """
+        -- db_schema.sql: espejo de Odoo que mantiene sync_worker.py
+        CREATE TABLE IF NOT EXISTS products (
+            id              BIGINT PRIMARY KEY,
+            default_code    TEXT,
+            name            TEXT NOT NULL,
+            brand           TEXT,
+            category        TEXT,
+            price_list      NUMERIC(14,2),
+            currency        TEXT,
+            stock_qty       NUMERIC(14,2),
+            last_update_utc TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        CREATE TABLE IF NOT EXISTS partners (
+            id              BIGINT PRIMARY KEY,
+            name            TEXT NOT NULL,
+            vat             TEXT,
+            email           TEXT,
+            phone           TEXT,
+            salesperson_id  BIGINT,
+            last_update_utc TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS idx_products_name ON products USING GIN (to_tsvector('simple', name));
+        CREATE INDEX IF NOT EXISTS idx_products_default_code ON products (default_code);
+        CREATE INDEX IF NOT EXISTS idx_partners_vat ON partners (vat);
+        CREATE TABLE IF NOT EXISTS sync_state (
+            model             TEXT PRIMARY KEY,
+            cursor_write_date TEXT,
+            cursor_id         BIGINT NOT NULL DEFAULT 0,
+            last_full_utc     TIMESTAMPTZ,
+            updated_utc       TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        ALTER TABLE sync_state ADD COLUMN IF NOT EXISTS full_resume_id BIGINT;
+        ALTER TABLE sync_state ADD COLUMN IF NOT EXISTS full_mark_write_date TEXT;
+        ALTER TABLE sync_state ADD COLUMN IF NOT EXISTS full_mark_id BIGINT;
+        ALTER TABLE products ADD COLUMN IF NOT EXISTS content_hash TEXT;
+        ALTER TABLE partners ADD COLUMN IF NOT EXISTS content_hash TEXT;
+        ALTER TABLE products ADD COLUMN IF NOT EXISTS deleted_utc TIMESTAMPTZ;
+        ALTER TABLE partners ADD COLUMN IF NOT EXISTS deleted_utc TIMESTAMPTZ;
+    """),
+
+    # Índices para la paginación por keyset de repos.search_productos_db y
+    # get_clientes_vendedor_db (mismo orden que el ORDER BY de cada una)
+    Migration(4, "keyset_indexes", [
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_productos_cache_recent
+           ON productos_cache (write_date DESC NULLS LAST, id DESC) WHERE deleted_at IS NULL""",
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_clientes_vendedor_name
+           ON clientes_vendedor_cache (vendedor_cuit, name, cliente_id)""",
+    ], transaction=False),
+
+    # Búsqueda por substring de db.search_products (/productos_rapido): ILIKE
+    # '%q%' sólo puede usar índices de trigramas, no el to_tsvector de db_schema.sql
+    Migration(5, "products_trgm", [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_products_name_trgm
+           ON products USING GIN (name gin_trgm_ops)""",
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_products_code_trgm
+           ON products USING GIN (default_code gin_trgm_ops)""",
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_products_name_id
+           ON products (name, id) WHERE deleted_utc IS NULL""",
+    ], transaction=False),
+]
+
+
+def checksum(m):
+    body = m.sql if isinstance(m.sql, str) else "\n;\n".join(m.sql)
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()[:16]
+
+
+def _connect(dsn=None):
+    """Conexión propia, fuera del pool: sin el statement_timeout de los workers
+    (un CREATE INDEX sobre una tabla grande puede tardar más)."""
+    dsn = dsn or dal.dsn()
+    if not dsn:
+        raise RuntimeError("DATABASE_URL no configurada")
+    kwargs = {"connect_timeout": dal.PG_CONNECT_TIMEOUT}
+    if dal.PG_SSLMODE and "sslmode=" not in dsn:
+        kwargs["sslmode"] = dal.PG_SSLMODE
+    return psycopg2.connect(dsn, **kwargs)
+
+
+def _ensure_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version     INTEGER PRIMARY KEY,
+            name        TEXT NOT NULL,
+            checksum    TEXT NOT NULL,
+            duration_ms INTEGER,
+            applied_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+    """)
+
+
+def _applied(cur):
+    cur.execute("SELECT version, checksum FROM schema_migrations")
+    return dict(cur.fetchall())
+
+
+def pending(migrations=MIGRATIONS, conn=None):
+    """Versiones que faltan aplicar (sólo lectura: no crea nada)."""
+    own = conn is None
+    conn = conn or _connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('schema_migrations')")
+            done = _applied(cur) if cur.fetchone()[0] else {}
+        conn.rollback()
+        return [m.version for m in migrations if m.version not in done]
+    finally:
+        if own:
+            conn.close()
+
+
+def migrate(migrations=MIGRATIONS, conn=None, lock_timeout=MIGRATIONS_LOCK_TIMEOUT):
+    """Aplica las migraciones pendientes en orden; devuelve las versiones aplicadas."""
+    versions = [m.version for m in migrations]
+    if versions != sorted(set(versions)):
+        raise ValueError("las versiones de MIGRATIONS deben ser únicas y crecientes")
+    own = conn is None
+    conn = conn or _connect()
+    applied_now = []
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            # lock_timeout también corta la espera del advisory lock
+            cur.execute("SET lock_timeout = %s", (f"{int(lock_timeout)}s",))
+            cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+            cur.execute("SET lock_timeout = 0")
+            try:
+                _ensure_table(cur)
+                done = _applied(cur)
+                for m in migrations:
+                    if m.version in done:
+                        if done[m.version] != checksum(m):
+                            log.warning(f"[MIGRATIONS] {m.version} {m.name}: cambió después de aplicada (checksum)")
+                        continue
+                    _apply(conn, cur, m)
+                    applied_now.append(m.version)
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+    finally:
+        if own:
+            conn.close()
+    if applied_now:
+        log.info(f"[MIGRATIONS] aplicadas: {applied_now}")
+    return applied_now
+
+
+def _apply(conn, cur, m):
+    statements = [m.sql] if isinstance(m.sql, str) else list(m.sql)
+    t0 = time.monotonic()
+    log.info(f"[MIGRATIONS] {m.version} {m.name} ...")
+    if m.transaction:
+        cur.execute("BEGIN")
+        try:
+            for sql in statements:
+                cur.execute(sql)
+            _record(cur, m, t0)
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+    else:
+        # autocommit: cada statement por separado (ej. CREATE INDEX CONCURRENTLY).
+        # Si se corta a mitad se vuelve a correr entera: los statements son IF NOT
+        # EXISTS y el índice INVALID que dejó el corte se borra antes de recrearlo.
+        for sql in statements:
+            index = _CONCURRENT_INDEX.match(sql)
+            if index:
+                _drop_invalid_index(cur, index.group(1))
+            cur.execute(sql)
+        _record(cur, m, t0)
+
+
+def _drop_invalid_index(cur, name):
+    """Borra `name` si quedó INVALID de un CREATE INDEX CONCURRENTLY que falló."""
+    cur.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = %s AND pg_table_is_visible(c.oid) AND NOT i.indisvalid
+        )
+    """, (name,))
+    if cur.fetchone()[0]:
+        log.warning(f"[MIGRATIONS] índice {name} inválido (build cortado): se recrea")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def _record(cur, m, t0):
+    cur.execute(
+        "INSERT INTO schema_migrations (version, name, checksum, duration_ms) VALUES (%s, %s, %s, %s)",
+        (m.version, m.name, checksum(m), int((time.monotonic() - t0) * 1000)),
+    )
+
+
+def status(migrations=MIGRATIONS):
+    conn = _connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('schema_migrations')")
+            rows = []
+            if cur.fetchone()[0]:
+                cur.execute("SELECT version, name, checksum, duration_ms, applied_at FROM schema_migrations ORDER BY version")
+                rows = cur.fetchall()
+        done = {r[0]: r for r in rows}
+        return [{
+            "version": m.version,
+            "name": m.name,
+            "applied_at": done[m.version][4].isoformat() if m.version in done else None,
+            "duration_ms": done[m.version][3] if m.version in done else None,
+            "modified": m.version in done and done[m.version][2] != checksum(m),
+        } for m in migrations]
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if "--status" in sys.argv:
+        for row in status():
+            print(row)
+        sys.exit(0)
+    print({"applied": migrate()})
@@ -0,0 +1,232 @@
+# offer_engine.py
+"""
+Motor de ofertas en memoria para la Tarifa 70.
+
+`app_product_offers` aplana la tarifa en `sku -> precio` y pierde min_quantity
+y las ventanas de fecha/hora. Acá se cargan los ítems tal cual vienen de Odoo,
+indexados por variante, plantilla y categoría, y se resuelve en el momento:
+"precio efectivo del SKU para qty q en el instante t".
+
+Precedencia: la de product.pricelist.item en Odoo (`_order = "applied_on,
+min_quantity desc, categ_id desc, id desc"`). Variante > plantilla > categoría;
+dentro del mismo nivel, mayor min_quantity primero y a igualdad el ítem más
+nuevo (id desc). Las reglas de todas las categorías ancestras compiten juntas:
+ordenan por min_quantity y después por id de categoría (no por profundidad).
+
+El índice se arma completo y se reemplaza de una sola vez, así que las
+lecturas no necesitan lock.
+"""
+import time
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+log = logging.getLogger("salbom.offers")
+
+_NO_END = float("inf")
+
+
+def _to_ts(value, end=False):
+    """Fecha/datetime de Odoo (UTC) a epoch. Una fecha sin hora de fin cubre el día entero."""
+    if not value:
+        return _NO_END if end else 0.0
+    if isinstance(value, datetime):
+        dt = value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+        return dt.timestamp()
+    value = str(value)
+    if len(value) <= 10:
+        dt = datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        if end:
+            dt += timedelta(days=1)
+        return dt.timestamp()
+    return datetime.strptime(value[:19], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+
+
+def _m2o_id(value):
+    if isinstance(value, (list, tuple)) and value:
+        return value[0]
+    return value or None
+
+
+class OfferIndex:
+    """Índice inmutable; se reconstruye entero en cada carga."""
+
+    def __init__(self, items, variants=(), templates=(), categories=()):
+        """
+        items:      product.pricelist.item (applied_on, product_id, product_tmpl_id,
+                    categ_id, min_quantity, date_start, date_end, fixed_price, id)
+        variants:   product.product (id, default_code, product_tmpl_id)
+        templates:  product.template (id, default_code, categ_id)
+        categories: product.category (id, parent_path)
+        """
+        self.loaded_at = time.time()
+        # categoría -> ancestros, del más profundo a la raíz
+        self.ancestors = {}
+        for c in categories:
+            path = [int(x) for x in (c.get("parent_path") or f"{c['id']}/").split("/") if x]
+            self.ancestors[c["id"]] = tuple(reversed(path))
+
+        self.tmpl_categ = {}
+        self.sku = {}      # sku -> (variant_id | None, tmpl_id, categ_id)
+        for t in templates:
+            categ = _m2o_id(t.get("categ_id"))
+            self.tmpl_categ[t["id"]] = categ
+            code = (t.get("default_code") or "").strip()
+            if code:
+                self.sku[code] = (None, t["id"], categ)
+        for v in variants:
+            tmpl = _m2o_id(v.get("product_tmpl_id"))
+            code = (v.get("default_code") or "").strip()
+            if code:
+                self.sku[code] = (v["id"], tmpl, self.tmpl_categ.get(tmpl))
+
+        self.by_variant, self.by_tmpl, self.by_categ = {}, {}, {}
+        for it in items:
+            applied_on = it.get("applied_on")
+            if applied_on == "0_product_variant":
+                key, bucket = _m2o_id(it.get("product_id")), self.by_variant
+            elif applied_on == "1_product":
+                key, bucket = _m2o_id(it.get("product_tmpl_id")), self.by_tmpl
+            elif applied_on == "2_product_category":
+                key, bucket = _m2o_id(it.get("categ_id")), self.by_categ
+            else:
+                continue
+            if not key:
+                continue
+            bucket.setdefault(key, []).append((
+                float(it.get("min_quantity") or 0),
+                _to_ts(it.get("date_start")),
+                _to_ts(it.get("date_end"), end=True),
+                float(it.get("fixed_price") or 0),
+                it.get("id") or 0,
+            ))
+        # Dentro de cada clave: min_quantity desc, id desc (el primero que aplique gana)
+        for bucket in (self.by_variant, self.by_tmpl, self.by_categ):
+            for entries in bucket.values():
+                entries.sort(key=lambda e: (-e[0], -e[4]))
+        self._categ_rules = {}  # categ_id -> reglas de sus ancestros, en el orden de Odoo
+
+    def _categ_entries(self, categ_id):
+        """Reglas de categoría que alcanzan a `categ_id`: min_quantity desc, categ_id desc, id desc."""
+        entries = self._categ_rules.get(categ_id)
+        if entries is None:
+            merged = [(c, e) for c in self.ancestors.get(categ_id, (categ_id,)) for e in self.by_categ.get(c, ())]
+            merged.sort(key=lambda ce: (-ce[1][0], -ce[0], -ce[1][4]))
+            entries = self._categ_rules[categ_id] = [e for _, e in merged]
+        return entries
+
+    def __len__(self):
+        return sum(len(v) for b in (self.by_variant, self.by_tmpl, self.by_categ) for v in b.values())
+
+    @staticmethod
+    def _first(entries, qty, ts):
+        for min_qty, start, end, price, _ in entries or ():
+            if qty >= min_qty and start <= ts < end:
+                return price
+        return None
+
+    def price(self, sku=None, qty=1, at=None, tmpl_id=None, categ_id=None, variant_id=None):
+        """Precio de oferta vigente o None. tmpl_id/categ_id sirven de pista si el SKU no está indexado."""
+        ts = at if isinstance(at, (int, float)) else _to_ts(at) if at else time.time()
+        known = self.sku.get((sku or "").strip()) if sku else None
+        if known:
+            variant_id = variant_id or known[0]
+            tmpl_id = tmpl_id or known[1]
+            categ_id = categ_id or known[2]
+        if categ_id is None and tmpl_id is not None:
+            categ_id = self.tmpl_categ.get(tmpl_id)
+
+        if variant_id is not None:
+            p = self._first(self.by_variant.get(variant_id), qty, ts)
+            if p is not None:
+                return p
+        if tmpl_id is not None:
+            p = self._first(self.by_tmpl.get(tmpl_id), qty, ts)
+            if p is not None:
+                return p
+        if categ_id is not None:
+            return self._first(self._categ_entries(categ_id), qty, ts)
+        return None
+
+    def prices(self, lines, at=None):
+        """
+        Versión batch. `lines` es una lista de dicts con sku y opcionalmente
+        qty, tmpl_id, categ_id; devuelve la lista de precios (o None) en el mismo orden.
+        """
+        ts = _to_ts(at) if at else time.time()
+        return [self.price(l.get("sku"), qty=float(l.get("qty") or 1), at=ts,
+                           tmpl_id=l.get("tmpl_id"), categ_id=l.get("categ_id"))
+                for l in lines]
+
+
+def load_index(client, pricelist_id=70):
+    """Lee de Odoo los ítems vigentes o futuros de la tarifa y todo lo necesario para resolverlos."""
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    items = client.env["product.pricelist.item"].search_read(
+        [("pricelist_id", "=", pricelist_id), "|", ("date_end", "=", False), ("date_end", ">=", today)],
+        ["applied_on", "product_id", "product_tmpl_id", "categ_id", "min_quantity",
+         "date_start", "date_end", "fixed_price"],
+    )
+    variant_ids = sorted({_m2o_id(i["product_id"]) for i in items
+                          if i.get("applied_on") == "0_product_variant" and i.get("product_id")})
+    tmpl_ids = {_m2o_id(i["product_tmpl_id"]) for i in items
+                if i.get("applied_on") == "1_product" and i.get("product_tmpl_id")}
+    cat_ids = sorted({_m2o_id(i["categ_id"]) for i in items
+                      if i.get("applied_on") == "2_product_category" and i.get("categ_id")})
+
+    variants = client.env["product.product"].read(variant_ids, ["default_code", "product_tmpl_id"]) if variant_ids else []
+    tmpl_ids.update(_m2o_id(v["product_tmpl_id"]) for v in variants if v.get("product_tmpl_id"))
+    domain = [("id", "in", sorted(tmpl_ids))]
+    if cat_ids:
+        domain = ["|"] + domain + [("categ_id", "child_of", cat_ids)]
+    templates = client.env["product.template"].search_read(domain, ["default_code", "categ_id"]) if (tmpl_ids or cat_ids) else []
+
+    categ_ids = sorted(set(cat_ids) | {_m2o_id(t["categ_id"]) for t in templates if t.get("categ_id")})
+    categories = client.env["product.category"].read(categ_ids, ["parent_path"]) if categ_ids else []
+    return OfferIndex(items, variants, templates, categories)
+
+
+# ───────── Instancia compartida del proceso ─────────
+
+_index = None
+_refresh_lock = threading.Lock()
+
+
+def get_index():
+    return _index
+
+
+def refresh(client, pricelist_id=70):
+    global _index
+    idx = load_index(client, pricelist_id)
+    _index = idx
+    log.info(f"[OFFERS] índice cargado: {len(idx)} ítems, {len(idx.sku)} SKUs")
+    return len(idx)
+
+
+def invalidate():
+    """Marca el índice como vencido: el próximo request dispara la recarga (y sigue sirviendo el actual)."""
+    idx = _index
+    if idx is not None:
+        idx.loaded_at = 0
+
+
+def ensure_fresh(loader, max_age):
+    """
+    Si el índice no existe o venció, dispara la recarga en un hilo (una sola a
+    la vez) y devuelve lo que haya: los requests nunca esperan a Odoo.
+    `loader()` debe devolver la cantidad de ítems (ej. lambda: refresh(client)).
+    """
+    idx = _index
+    if idx is not None and time.time() - idx.loaded_at < max_age:
+        return idx
+    if _refresh_lock.acquire(blocking=False):
+        def _run():
+            try:
+                loader()
+            except Exception as e:
+                log.warning(f"[OFFERS] no se pudo recargar el índice: {e}")
+            finally:
+                _refresh_lock.release()
+        threading.Thread(target=_run, daemon=True, name="offer-index").start()
+    return idx
@@ -0,0 +1,43 @@
+# pg_copy.py
+"""
+Helpers para cargas masivas con COPY (formato text de Postgres).
+Los usan db.py y repos.py para el camino bulk de los syncs completos.
+"""
+import io
+import json
+import hashlib
+from datetime import date, datetime
+from decimal import Decimal
+
+_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+def _copy_value(v):
+    if v is None:
+        return "\\N"
+    if isinstance(v, bool):
+        return "t" if v else "f"
+    if isinstance(v, (int, float, Decimal)):
+        return str(v)
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    if isinstance(v, (dict, list)):
+        v = json.dumps(v)
+    return str(v).translate(_ESCAPES)
+
+def copy_rows(cur, table, columns, rows):
+    """COPY de `rows` (tuplas en el orden de `columns`) a `table` en un solo stream."""
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join(_copy_value(v) for v in row))
+        buf.write("\n")
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+
+def odoo_value(v):
+    """Odoo devuelve False para campos vacíos; en las tablas espejo va NULL."""
+    return None if v is False else v
+
+def content_hash(values):
+    """Hash estable del contenido de una fila; si no cambia, el merge no la reescribe."""
+    raw = json.dumps(list(values), default=str, separators=(",", ":"))
+    return hashlib.md5(raw.encode("utf-8")).hexdigest()
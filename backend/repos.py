@@ -1,219 +1,33 @@
 # repos.py
-import os
 import json
-import time
 import traceback
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-import psycopg2
-import psycopg2.extras
+import dal
+from write_behind import WriteBehind
+from pg_copy import copy_rows, content_hash
 
 # =========================================================
-# Conexión a Postgres
+# Conexión a Postgres (pool compartido, ver dal.py)
 # =========================================================
 
-DATABASE_URL = (
-    os.getenv("DATABASE_URL")
-    or os.getenv("POSTGRES_URL")
-    or os.getenv("DATABASE_URI")
-)
+DATABASE_URL = dal.dsn()
 
 if not DATABASE_URL:
     raise RuntimeError("Falta la variable de entorno DATABASE_URL / POSTGRES_URL / DATABASE_URI")
 
-# Render suele requerir sslmode=require
-if "sslmode=" not in DATABASE_URL:
-    if DATABASE_URL.startswith("postgres://"):
-        # psycopg2 requiere postgresql://
-        DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-    sep = "&" if "?" in DATABASE_URL else "?"
-    DATABASE_URL = f"{DATABASE_URL}{sep}sslmode=require"
+# Cada llamada confirma sola; para agrupar varias, envolverlas en dal.transaction()
+def db_execute(sql: str, params: Tuple | List | Dict = None):
+    dal.execute(sql, params)
 
-def _connect():
-    return psycopg2.connect(DATABASE_URL, cursor_factory=psycopg2.extras.RealDictCursor)
-
-_CONN = None
-def _get_conn():
-    global _CONN
-    try:
-        if _CONN is None or _CONN.closed:
-            _CONN = _connect()
-        else:
-            with _CONN.cursor() as cur:
-                cur.execute("SELECT 1")
-        return _CONN
-    except Exception:
-        try:
-            _CONN = _connect()
-        except Exception:
-            raise
-        return _CONN
-
-def db_execute(sql: str, params: Tuple | List | Dict = None, commit: bool = True):
-    conn = _get_conn()
-    for _ in range(2):
-        try:
-            with conn.cursor() as cur:
-                cur.execute(sql, params)
-            if commit:
-                conn.commit()
-            return
-        except (psycopg2.OperationalError, psycopg2.InterfaceError):
-            try:
-                conn.close()
-            except Exception:
-                pass
-            time.sleep(0.2)
-            conn = _connect()
-        except Exception as e:
-            if commit:
-                conn.rollback()
-            raise e
-
-def db_execute_many(sql: str, seq_params: List[Tuple], commit: bool = True):
-    conn = _get_conn()
-    for _ in range(2):
-        try:
-            with conn.cursor() as cur:
-                psycopg2.extras.execute_batch(cur, sql, seq_params, page_size=100)
-            if commit:
-                conn.commit()
-            return
-        except (psycopg2.OperationalError, psycopg2.InterfaceError):
-            try:
-                conn.close()
-            except Exception:
-                pass
-            time.sleep(0.2)
-            conn = _connect()
-        except Exception as e:
-            if commit:
-                conn.rollback()
-            raise e
+def db_execute_many(sql: str, seq_params: List[Tuple]):
+    dal.execute_many(sql, seq_params, page_size=100)
 
 def db_query(sql: str, params: Tuple | List | Dict = None) -> List[Dict[str, Any]]:
-    conn = _get_conn()
-    for _ in range(2):
-        try:
-            with conn.cursor() as cur:
-                cur.execute(sql, params)
-                return cur.fetchall()
-        except (psycopg2.OperationalError, psycopg2.InterfaceError):
-            try:
-                conn.close()
-            except Exception:
-                pass
-            time.sleep(0.2)
-            conn = _connect()
-        except Exception as e:
-            raise e
-
-# =========================================================
-# Bootstrap de tablas
-# =========================================================
+    return dal.query(sql, params)
 
-def _init_schema():
-    # Transporte del cliente
-    db_execute("""
-    CREATE TABLE IF NOT EXISTS transporte_cliente (
-        cliente_id      BIGINT PRIMARY KEY,
-        transporte      TEXT,
-        updated_at      TIMESTAMP NOT NULL DEFAULT NOW()
-    )
-    """)
-
-    # Direcciones del cliente (lista)
-    db_execute("""
-    CREATE TABLE IF NOT EXISTS direcciones_cliente (
-        cliente_id      BIGINT NOT NULL,
-        idx             INTEGER NOT NULL,
-        contacto        TEXT,
-        calle           TEXT,
-        ciudad          TEXT,
-        estado          TEXT,
-        codigo_postal   TEXT,
-        es_principal    BOOLEAN,
-        es_entrega      BOOLEAN,
-        PRIMARY KEY (cliente_id, idx)
-    )
-    """)
-
-    # Cache de pedidos creados desde la app
-    db_execute("""
-    CREATE TABLE IF NOT EXISTS pedido_cache (
-        id                BIGSERIAL PRIMARY KEY,
-        cliente_id        BIGINT,
-        moneda            TEXT,
-        tipo_cambio       NUMERIC,
-        base_imponible    NUMERIC,
-        impuestos_totales NUMERIC,
-        total             NUMERIC,
-        payload_json      JSONB,
-        respuesta_json    JSONB,
-        created_at        TIMESTAMP NOT NULL DEFAULT NOW()
-    )
-    """)
-
-    # Log de errores API
-    db_execute("""
-    CREATE TABLE IF NOT EXISTS api_error_log (
-        id           BIGSERIAL PRIMARY KEY,
-        endpoint     TEXT,
-        metodo       TEXT,
-        status_code  TEXT,
-        mensaje      TEXT,
-        detalle_json JSONB,
-        created_at   TIMESTAMP NOT NULL DEFAULT NOW()
-    )
-    """)
-
-    # Cache de productos
-    db_execute("""
-    CREATE TABLE IF NOT EXISTS productos_cache (
-        id           BIGINT PRIMARY KEY,         -- product.template id
-        name         TEXT,
-        default_code TEXT,
-        list_price   NUMERIC,
-        write_date   TIMESTAMP,
-        updated_at   TIMESTAMP NOT NULL DEFAULT NOW()
-    )
-    """)
-    db_execute("CREATE INDEX IF NOT EXISTS idx_productos_cache_name ON productos_cache USING GIN (to_tsvector('spanish', coalesce(name,'')))")
-    db_execute("CREATE INDEX IF NOT EXISTS idx_productos_cache_code ON productos_cache (default_code)")
-
-    # Cache de clientes por vendedor
-    db_execute("""
-    CREATE TABLE IF NOT EXISTS clientes_vendedor_cache (
-        vendedor_cuit TEXT NOT NULL,
-        cliente_id    BIGINT NOT NULL,
-        name          TEXT,
-        vat           TEXT,
-        updated_at    TIMESTAMP NOT NULL DEFAULT NOW(),
-        PRIMARY KEY (vendedor_cuit, cliente_id)
-    )
-    """)
-
-    # Assets externos (imágenes / PDFs) por producto
-    db_execute("""
-    CREATE TABLE IF NOT EXISTS product_asset (
-        id               BIGSERIAL PRIMARY KEY,
-        product_tmpl_id  BIGINT NOT NULL,
-        kind             TEXT NOT NULL CHECK (kind IN ('image','pdf')),
-        variant          TEXT,
-        title            TEXT,
-        sort_order       INTEGER DEFAULT 0,
-        url              TEXT NOT NULL,     -- URL pública (CDN / r2.dev)
-        key              TEXT,              -- clave en el bucket (opcional)
-        meta             JSONB,             -- ej: {"w":1600,"h":900,"sha":"abc123"}
-        created_at       TIMESTAMP NOT NULL DEFAULT NOW()
-    )
-    """)
-    db_execute("CREATE INDEX IF NOT EXISTS idx_product_asset_prod ON product_asset(product_tmpl_id)")
-    db_execute("CREATE INDEX IF NOT EXISTS idx_product_asset_kind ON product_asset(kind)")
-    db_execute("CREATE INDEX IF NOT EXISTS idx_product_asset_sort ON product_asset(product_tmpl_id, kind, sort_order)")
-
-_init_schema()
+# Las tablas las crea migrations.py (versión 2).
 
 # =========================================================
 # Transporte cliente
@@ -245,32 +59,40 @@ def get_direcciones_db(cliente_id: int) -> List[Dict[str, Any]]:
     """, (cliente_id,))
 
 def replace_direcciones_db(cliente_id: int, direcciones: List[Dict[str, Any]]):
-    db_execute("DELETE FROM direcciones_cliente WHERE cliente_id=%s", (cliente_id,))
-    if not direcciones:
-        return
-    rows: List[Tuple] = []
-    for i, d in enumerate(direcciones):
-        rows.append((
-            cliente_id,
-            i,
-            d.get("contacto"),
-            d.get("calle"),
-            d.get("ciudad"),
-            d.get("estado"),
-            d.get("codigo_postal"),
-            bool(d.get("es_principal")),
-            bool(d.get("es_entrega")),
-        ))
-    db_execute_many("""
-        INSERT INTO direcciones_cliente
-        (cliente_id, idx, contacto, calle, ciudad, estado, codigo_postal, es_principal, es_entrega)
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)
-    """, rows)
+    # DELETE + INSERT en una sola transacción: nadie ve la lista vacía a mitad de camino
+    with dal.transaction():
+        db_execute("DELETE FROM direcciones_cliente WHERE cliente_id=%s", (cliente_id,))
+        if not direcciones:
+            return
+        rows: List[Tuple] = []
+        for i, d in enumerate(direcciones):
+            rows.append((
+                cliente_id,
+                i,
+                d.get("contacto"),
+                d.get("calle"),
+                d.get("ciudad"),
+                d.get("estado"),
+                d.get("codigo_postal"),
+                bool(d.get("es_principal")),
+                bool(d.get("es_entrega")),
+            ))
+        db_execute_many("""
+            INSERT INTO direcciones_cliente
+            (cliente_id, idx, contacto, calle, ciudad, estado, codigo_postal, es_principal, es_entrega)
+            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)
+        """, rows)
 
 # =========================================================
 # Pedido cache + Log de errores
 # =========================================================
 
+_PEDIDO_CACHE_TEMPLATE = "(%s,%s,%s,%s,%s,%s,%s::jsonb,%s::jsonb)"
+
+def _pedido_cache_row(cliente_id, moneda, tipo_cambio, base_imponible, impuestos_totales, total, payload, respuesta):
+    return (cliente_id, moneda, tipo_cambio, base_imponible, impuestos_totales, total,
+            json.dumps(payload or {}), json.dumps(respuesta or {}))
+
 def insert_pedido_cache_db(
     cliente_id: int,
     moneda: Optional[str],
@@ -281,28 +103,50 @@ def insert_pedido_cache_db(
     payload: Dict[str, Any],
     respuesta: Dict[str, Any],
 ) -> Tuple[int, str]:
-    db_execute("""
+    """Inserta ya y devuelve (id, created_at) de ESTA fila. Si no hace falta el id, usar queue_pedido_cache_db."""
+    # Por execute_values (escritura) y no query_one: una lectura se reintenta después de
+    # mandada y un corte tras el COMMIT duplicaría la fila
+    rows = dal.execute_values("""
         INSERT INTO pedido_cache
         (cliente_id, moneda, tipo_cambio, base_imponible, impuestos_totales, total, payload_json, respuesta_json)
-        VALUES (%s,%s,%s,%s,%s,%s,%s::jsonb,%s::jsonb)
-    """, (
-        cliente_id, moneda, tipo_cambio, base_imponible, impuestos_totales, total,
-        json.dumps(payload or {}), json.dumps(respuesta or {})
-    ))
-    row = db_query("""
-        SELECT id, to_char(created_at,'YYYY-MM-DD HH24:MI:SS') AS ts
-        FROM pedido_cache ORDER BY id DESC LIMIT 1
-    """)
-    if not row:
+        VALUES %s
+        RETURNING id, to_char(created_at,'YYYY-MM-DD HH24:MI:SS') AS ts
+    """, [_pedido_cache_row(cliente_id, moneda, tipo_cambio, base_imponible, impuestos_totales, total, payload, respuesta)],
+        template=_PEDIDO_CACHE_TEMPLATE, fetch=True)
+    if not rows:
         return -1, ""
-    return int(row[0]["id"]), row[0]["ts"]
+    return int(rows[0]["id"]), rows[0]["ts"]
+
+# Escrituras de auditoría fuera del request: se encolan y un hilo las inserta en lotes
+_pedido_cache_writer = WriteBehind("pedido_cache", """
+    INSERT INTO pedido_cache
+    (cliente_id, moneda, tipo_cambio, base_imponible, impuestos_totales, total, payload_json, respuesta_json)
+    VALUES %s
+""", template=_PEDIDO_CACHE_TEMPLATE)
+
+_api_error_writer = WriteBehind("api_error_log", """
+    INSERT INTO api_error_log (endpoint, metodo, status_code, mensaje, detalle_json)
+    VALUES %s
+""", template="(%s,%s,%s,%s,%s::jsonb)")
+
+def queue_pedido_cache_db(
+    cliente_id: int,
+    moneda: Optional[str],
+    tipo_cambio: Optional[float],
+    base_imponible: Optional[float],
+    impuestos_totales: Optional[float],
+    total: Optional[float],
+    payload: Dict[str, Any],
+    respuesta: Dict[str, Any],
+) -> bool:
+    """Igual que insert_pedido_cache_db pero diferido (write_behind.py); False si la cola estaba llena."""
+    return _pedido_cache_writer.put(
+        _pedido_cache_row(cliente_id, moneda, tipo_cambio, base_imponible, impuestos_totales, total, payload, respuesta))
 
 def log_api_error_db(endpoint: str, metodo: str, status_code: Any, mensaje: str, detalle: Dict[str, Any]):
+    """Diferido: encola y vuelve (ver write_behind.py)."""
     try:
-        db_execute("""
-            INSERT INTO api_error_log (endpoint, metodo, status_code, mensaje, detalle_json)
-            VALUES (%s, %s, %s, %s, %s::jsonb)
-        """, (
+        _api_error_writer.put((
             endpoint, metodo,
             str(status_code) if status_code is not None else None,
             mensaje, json.dumps(detalle or {})
@@ -314,118 +158,227 @@ def log_api_error_db(endpoint: str, metodo: str, status_code: Any, mensaje: str,
 # Productos cache: upsert + búsqueda paginada
 # =========================================================
 
-def upsert_productos_db(productos: List[Dict[str, Any]]):
+def upsert_productos_db(productos: List[Dict[str, Any]]) -> int:
     """
     Espera items con keys: id, name, default_code, list_price, write_date (string o timestamp).
+    Carga con COPY a una tabla temporal y hace merge en un solo statement;
+    las filas cuyo content_hash no cambió no se reescriben. Devuelve filas escritas.
     """
     if not productos:
-        return
-    rows: List[Tuple] = []
+        return 0
+    rows: Dict[int, Tuple] = {}
     for p in productos:
         pid = p.get("id")
         if not pid:
             continue
-        rows.append((
-            int(pid),
+        vals = (
             p.get("name"),
-            p.get("default_code"),
+            p.get("default_code") or None,
             float(p.get("list_price") or 0.0),
-            p.get("write_date"),
-        ))
-    db_execute_many("""
-        INSERT INTO productos_cache (id, name, default_code, list_price, write_date)
-        VALUES (%s,%s,%s,%s,%s)
-        ON CONFLICT (id) DO UPDATE
-        SET name = EXCLUDED.name,
-            default_code = EXCLUDED.default_code,
-            list_price = EXCLUDED.list_price,
-            write_date = EXCLUDED.write_date,
-            updated_at = NOW()
-    """, rows)
-
-def search_productos_db(search: Optional[str], limit: int, offset: int) -> Dict[str, Any]:
+            p.get("write_date") or None,
+        )
+        rows[int(pid)] = (int(pid),) + vals + (content_hash(vals),)
+    if not rows:
+        return 0
+
+    with dal.transaction() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TEMP TABLE productos_cache_stage
+                (LIKE productos_cache INCLUDING DEFAULTS) ON COMMIT DROP
+            """)
+            copy_rows(cur, "productos_cache_stage",
+                      ["id", "name", "default_code", "list_price", "write_date", "content_hash"],
+                      rows.values())
+            cur.execute("""
+                INSERT INTO productos_cache (id, name, default_code, list_price, write_date, content_hash)
+                SELECT id, name, default_code, list_price, write_date, content_hash
+                FROM productos_cache_stage
+                ON CONFLICT (id) DO UPDATE
+                SET name = EXCLUDED.name,
+                    default_code = EXCLUDED.default_code,
+                    list_price = EXCLUDED.list_price,
+                    write_date = EXCLUDED.write_date,
+                    content_hash = EXCLUDED.content_hash,
+                    deleted_at = NULL,
+                    updated_at = NOW()
+                WHERE productos_cache.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+                   OR productos_cache.deleted_at IS NOT NULL
+            """)
+            written = cur.rowcount
+    return written
+
+# ---------- Paginación por keyset (cursores de dal.encode_cursor) ----------
+
+PRODUCT_EXACT_COUNT_MAX = 5000   # por encima, en la primera página va el estimado del planner
+
+encode_cursor = dal.encode_cursor
+
+def decode_cursor(cursor: str) -> Tuple[Any, int]:
+    sort_value, row_id = dal.decode_cursor(cursor)
+    try:
+        return sort_value, int(row_id)
+    except (TypeError, ValueError):
+        raise ValueError("cursor inválido")
+
+def _keyset(col: str, id_col: str, cursor: Optional[str], desc: bool) -> Tuple[str, List[Any]]:
+    """
+    WHERE para seguir después del cursor con ORDER BY col {DESC|ASC} NULLS LAST, id_col.
+    Es una comparación de fila sola (sin OR) para que quede como Index Cond; no
+    alcanza a los NULL del final, que los agrega _keyset_rows.
+    """
+    if not cursor:
+        return "", []
+    value, row_id = decode_cursor(cursor)
+    op = "<" if desc else ">"
+    if value is None:
+        return f" AND {col} IS NULL AND {id_col} {op} %s", [row_id]
+    return f" AND ({col}, {id_col}) {op} (%s, %s)", [value, row_id]
+
+def _keyset_rows(fetch: Callable[[str, List[Any], int, int], List[Dict[str, Any]]], col: str, id_col: str,
+                 cursor: Optional[str], desc: bool, limit: int, offset: int = 0) -> List[Dict[str, Any]]:
+    """
+    Hasta `limit` filas después del cursor. `fetch(after_sql, after_params, limit, offset)`
+    corre la consulta con el WHERE extra. Si las no nulas se acaban antes de llenar
+    la página, sigue en una segunda consulta por los NULL (col IS NULL, también por índice).
+    """
+    after, after_params = _keyset(col, id_col, cursor, desc)
+    rows = fetch(after, after_params, limit, offset)
+    if cursor and len(rows) < limit and decode_cursor(cursor)[0] is not None:
+        rows += fetch(f" AND {col} IS NULL", [], limit - len(rows), 0)
+    return rows
+
+def estimate_rows(sql: str, params: Any = None) -> int:
+    """Filas que estima el planner para la consulta (EXPLAIN, no la ejecuta)."""
+    row = dal.query_one("EXPLAIN (FORMAT JSON) " + sql, params)
+    plan = next(iter(row.values()))
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+def _producto_item(r: Dict[str, Any]) -> Dict[str, Any]:
+    wd = r.get("write_date")
+    lp = r.get("list_price")
+    return {"id": r["id"], "name": r.get("name"), "default_code": r.get("default_code"),
+            "list_price": float(lp) if lp is not None else None,
+            "write_date": wd.isoformat() if isinstance(wd, datetime) else wd}
+
+def search_productos_db(search: Optional[str], limit: int, offset: int = 0,
+                        cursor: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Página de productos_cache ordenada por (write_date DESC NULLS LAST, id DESC).
+
+    Con `cursor` (el next_cursor de la página anterior) pagina por keyset; sin
+    cursor se acepta `offset` por compatibilidad. El total sólo se calcula en la
+    primera página: exacto si es chico, si no el estimado del planner
+    (total_estimated=True). En las siguientes va None.
+    """
     limit = max(1, min(200, int(limit or 20)))
-    offset = max(0, int(offset or 0))
+    offset = 0 if cursor else max(0, int(offset or 0))
 
+    where = "deleted_at IS NULL"
+    params: List[Any] = []
     if search:
-        query = """
-            WITH filtro AS (
-                SELECT *
-                FROM productos_cache
-                WHERE
-                    to_tsvector('spanish', coalesce(name,'')) @@ plainto_tsquery('spanish', %(q)s)
-                    OR lower(coalesce(default_code,'')) LIKE lower('%%' || %(q)s || '%%')
-            )
-            SELECT (SELECT count(*) FROM filtro) AS total,
-                   json_agg(row_to_json(t)) AS items
-            FROM (
-                SELECT id, name, default_code, list_price, write_date
-                FROM filtro
-                ORDER BY write_date DESC NULLS LAST, id DESC
-                LIMIT %(limit)s OFFSET %(offset)s
-            ) t
-        """
-        params = {"q": search, "limit": limit, "offset": offset}
+        where += """ AND (
+            to_tsvector('spanish', coalesce(name,'')) @@ plainto_tsquery('spanish', %s)
+            OR lower(coalesce(default_code,'')) LIKE lower('%%' || %s || '%%')
+        )"""
+        params += [search, search]
+    filter_params = list(params)
+
+    def fetch(after, after_params, n, skip):
+        return db_query(f"""
+            SELECT id, name, default_code, list_price, write_date
+            FROM productos_cache
+            WHERE {where}{after}
+            ORDER BY write_date DESC NULLS LAST, id DESC
+            LIMIT %s OFFSET %s
+        """, params + after_params + [n, skip])
+
+    rows = _keyset_rows(fetch, "write_date", "id", cursor, True, limit + 1, offset)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1]["write_date"], rows[-1]["id"]) if has_more else None
+
+    total, estimated = None, False
+    if not cursor and offset == 0:
+        if not has_more:
+            total = len(rows)
+        else:
+            count_sql = f"SELECT 1 FROM productos_cache WHERE {where}"
+            total = estimate_rows(count_sql, filter_params)
+            estimated = total > PRODUCT_EXACT_COUNT_MAX
+            if not estimated:
+                total = dal.scalar(f"SELECT count(*) FROM productos_cache WHERE {where}", filter_params, 0)
+
+    return {"total": total, "total_estimated": estimated,
+            "items": [_producto_item(r) for r in rows], "next_cursor": next_cursor}
+
+def get_productos_cache_ids_db() -> List[int]:
+    """Ids vivos de productos_cache, ordenados (para reconciliar contra Odoo)."""
+    return [r["id"] for r in dal.query("SELECT id FROM productos_cache WHERE deleted_at IS NULL ORDER BY id")]
+
+def mark_productos_cache_deleted_db(ids: List[int], hard: bool = False, chunk: int = 10000) -> int:
+    """Marca (o borra) en bloque los productos que ya no están vivos en Odoo."""
+    if hard:
+        sql = "DELETE FROM productos_cache WHERE id = ANY(%s)"
     else:
-        query = """
-            WITH filtro AS (SELECT * FROM productos_cache)
-            SELECT (SELECT count(*) FROM filtro) AS total,
-                   json_agg(row_to_json(t)) AS items
-            FROM (
-                SELECT id, name, default_code, list_price, write_date
-                FROM filtro
-                ORDER BY write_date DESC NULLS LAST, id DESC
-                LIMIT %(limit)s OFFSET %(offset)s
-            ) t
-        """
-        params = {"limit": limit, "offset": offset}
-
-    rows = db_query(query, params)
-    if not rows:
-        return {"total": 0, "items": []}
-    row = rows[0]
-    return {"total": int(row.get("total") or 0), "items": row.get("items") or []}
+        sql = "UPDATE productos_cache SET deleted_at = NOW() WHERE id = ANY(%s) AND deleted_at IS NULL"
+    done = 0
+    with dal.transaction():
+        for i in range(0, len(ids), chunk):
+            done += dal.execute(sql, (list(ids[i:i + chunk]),))
+    return done
 
 # =========================================================
 # Clientes por vendedor: cache simple
 # =========================================================
 
 def replace_clientes_vendedor_db(vendedor_cuit: str, clientes: List[Dict[str, Any]]):
-    db_execute("DELETE FROM clientes_vendedor_cache WHERE vendedor_cuit=%s", (vendedor_cuit,))
-    if not clientes:
-        return
-    data: List[Tuple] = []
-    for c in clientes:
-        cid = c.get("id")
-        if not cid:
-            continue
-        data.append((vendedor_cuit, int(cid), c.get("name"), c.get("vat")))
-    db_execute_many("""
-        INSERT INTO clientes_vendedor_cache (vendedor_cuit, cliente_id, name, vat)
-        VALUES (%s,%s,%s,%s)
-    """, data)
-
-def get_clientes_vendedor_db(vendedor_cuit: str, limit: int = 500, offset: int = 0) -> Dict[str, Any]:
+    with dal.transaction():
+        db_execute("DELETE FROM clientes_vendedor_cache WHERE vendedor_cuit=%s", (vendedor_cuit,))
+        if not clientes:
+            return
+        data: List[Tuple] = []
+        for c in clientes:
+            cid = c.get("id")
+            if not cid:
+                continue
+            data.append((vendedor_cuit, int(cid), c.get("name"), c.get("vat")))
+        db_execute_many("""
+            INSERT INTO clientes_vendedor_cache (vendedor_cuit, cliente_id, name, vat)
+            VALUES (%s,%s,%s,%s)
+        """, data)
+
+def get_clientes_vendedor_db(vendedor_cuit: str, limit: int = 500, offset: int = 0,
+                             cursor: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Clientes del vendedor ordenados por (name, id), paginados por keyset con
+    `cursor` (o `offset` sin cursor). El total (exacto: es un rango de la PK)
+    sólo va en la primera página.
+    """
     limit = max(1, min(1000, int(limit or 500)))
-    offset = max(0, int(offset or 0))
-    rows = db_query("""
-        WITH cte AS (
-            SELECT * FROM clientes_vendedor_cache WHERE vendedor_cuit=%s
-        )
-        SELECT
-            (SELECT count(*) FROM cte) AS total,
-            json_agg(row_to_json(t)) AS items
-        FROM (
+    offset = 0 if cursor else max(0, int(offset or 0))
+
+    def fetch(after, after_params, n, skip):
+        return db_query(f"""
             SELECT cliente_id AS id, name, vat
-            FROM cte
-            ORDER BY name ASC NULLS LAST
+            FROM clientes_vendedor_cache
+            WHERE vendedor_cuit=%s{after}
+            ORDER BY name ASC NULLS LAST, cliente_id ASC
             LIMIT %s OFFSET %s
-        ) t
-    """, (vendedor_cuit, limit, offset))
-    if not rows:
-        return {"total": 0, "items": []}
-    r = rows[0]
-    return {"total": int(r.get("total") or 0), "items": r.get("items") or []}
+        """, [vendedor_cuit] + after_params + [n, skip])
+
+    rows = _keyset_rows(fetch, "name", "cliente_id", cursor, False, limit + 1, offset)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    total = None
+    if not cursor and offset == 0:
+        total = len(rows) if not has_more else dal.scalar(
+            "SELECT count(*) FROM clientes_vendedor_cache WHERE vendedor_cuit=%s", (vendedor_cuit,), 0)
+    return {"total": total, "items": rows,
+            "next_cursor": encode_cursor(rows[-1]["name"], rows[-1]["id"]) if has_more else None}
 
 # =========================================================
 # Assets externos (imágenes / PDFs) por producto
@@ -444,26 +397,27 @@ def replace_product_assets_db(product_tmpl_id: int, assets: List[Dict[str, Any]]
       - key: clave en bucket
       - meta: dict (ej. tamaños, hash, etc.)
     """
-    db_execute("DELETE FROM product_asset WHERE product_tmpl_id=%s", (product_tmpl_id,))
-    if not assets:
-        return
-    rows: List[Tuple] = []
-    for a in assets:
-        rows.append((
-            product_tmpl_id,
-            a.get("kind"),
-            a.get("variant"),
-            a.get("title"),
-            int(a.get("sort_order") or 0),
-            a.get("url"),
-            a.get("key"),
-            json.dumps(a.get("meta") or {})
-        ))
-    db_execute_many("""
-        INSERT INTO product_asset
-        (product_tmpl_id, kind, variant, title, sort_order, url, key, meta)
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s::jsonb)
-    """, rows)
+    with dal.transaction():
+        db_execute("DELETE FROM product_asset WHERE product_tmpl_id=%s", (product_tmpl_id,))
+        if not assets:
+            return
+        rows: List[Tuple] = []
+        for a in assets:
+            rows.append((
+                product_tmpl_id,
+                a.get("kind"),
+                a.get("variant"),
+                a.get("title"),
+                int(a.get("sort_order") or 0),
+                a.get("url"),
+                a.get("key"),
+                json.dumps(a.get("meta") or {})
+            ))
+        db_execute_many("""
+            INSERT INTO product_asset
+            (product_tmpl_id, kind, variant, title, sort_order, url, key, meta)
+            VALUES (%s,%s,%s,%s,%s,%s,%s,%s::jsonb)
+        """, rows)
 
 def get_product_assets_db(product_tmpl_id: int) -> List[Dict[str, Any]]:
     return db_query("""
@@ -0,0 +1,220 @@
+# scheduler.py
+"""
+Scheduler de jobs en segundo plano (reemplaza al viejo periodic_sync_loop).
+
+- Cada job corre en su propio hilo con su intervalo y jitter: uno lento no
+  frena a los rápidos.
+- Antes de correr toma un lease en Redis (SET NX PX) que se renueva con
+  heartbeat mientras el job está vivo, así dos réplicas no se pisan aunque el
+  job dure más que el TTL. Si Redis está configurado pero falla, la corrida
+  se saltea (fail closed) y se cuenta en `lease_errors`; si el lease se pierde
+  a mitad de corrida, la corrida queda marcada (`lease_lost`) como error.
+- Cada corrida se informa a `on_run` (main.py la guarda en `sync_runs`).
+"""
+import time
+import uuid
+import random
+import logging
+import threading
+import traceback
+from datetime import datetime, timezone
+
+log = logging.getLogger("salbom.scheduler")
+
+# Renueva el TTL sólo si el lease sigue siendo nuestro
+_RENEW_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+class Lease:
+    """
+    Lease en Redis con heartbeat (heartbeat=False para locks cortos que no se
+    renuevan). Sin Redis siempre se obtiene (una sola réplica); con Redis
+    configurado pero caído NO se obtiene y queda `error=True`.
+    """
+
+    def __init__(self, redis_client, key, ttl_sec, heartbeat=True):
+        self.redis = redis_client
+        self.key = key
+        self.ttl_ms = int(ttl_sec * 1000)
+        self.token = uuid.uuid4().hex
+        self.heartbeat = heartbeat
+        self._stop = threading.Event()
+        self._thread = None
+        self.lost = False
+        self.error = False
+
+    def acquire(self):
+        if not self.redis:
+            return True
+        try:
+            ok = bool(self.redis.set(self.key, self.token, nx=True, px=self.ttl_ms))
+        except Exception as e:
+            log.warning(f"[LEASE] {self.key}: Redis no disponible ({e}); no se toma el lease.")
+            self.error = True
+            return False
+        if ok and self.heartbeat:
+            self._thread = threading.Thread(target=self._heartbeat, daemon=True,
+                                            name=f"lease:{self.key}")
+            self._thread.start()
+        return ok
+
+    def _heartbeat(self):
+        every = max(self.ttl_ms / 3000.0, 0.5)
+        renewed = time.monotonic()
+        while not self._stop.wait(every):
+            try:
+                if not self.redis.eval(_RENEW_LUA, 1, self.key, self.token, self.ttl_ms):
+                    self.lost = True
+                    log.warning(f"[LEASE] {self.key}: lease perdido durante la corrida.")
+                    return
+                renewed = time.monotonic()
+            except Exception as e:
+                log.warning(f"[LEASE] {self.key}: error renovando ({e}).")
+                # Sin renovar por más de un TTL, otra réplica ya pudo tomarlo
+                if (time.monotonic() - renewed) * 1000 >= self.ttl_ms:
+                    self.lost = True
+                    log.warning(f"[LEASE] {self.key}: lease vencido sin poder renovarlo.")
+                    return
+
+    def release(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+        if not self.redis:
+            return
+        try:
+            self.redis.eval(_RELEASE_LUA, 1, self.key, self.token)
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+class Job:
+    """
+    fn() devuelve la cantidad de filas procesadas (int) o un dict con detalle;
+    de un dict se toma 'rows' (o 'count') para el historial.
+    """
+
+    def __init__(self, name, fn, interval, jitter=0.1, lease_ttl=None, initial_delay=None):
+        self.name = name
+        self.fn = fn
+        self.interval = max(1, int(interval))
+        self.jitter = jitter
+        self.lease_ttl = lease_ttl or max(30, min(self.interval, 300))
+        self.initial_delay = initial_delay
+        self.state = {
+            "running": False, "runs": 0, "errors": 0, "skipped": 0,
+            "lease_errors": 0, "lease_lost": 0,
+            "last_started": None, "last_finished": None, "last_duration_ms": None,
+            "last_rows": None, "last_error": None, "next_run": None,
+        }
+
+    def next_delay(self):
+        spread = self.interval * self.jitter
+        return max(1.0, self.interval + random.uniform(-spread, spread))
+
+
+def _rows_of(result):
+    if isinstance(result, dict):
+        for k in ("rows", "count"):
+            if isinstance(result.get(k), int):
+                return result[k]
+        return None
+    return result if isinstance(result, int) else None
+
+
+class Scheduler:
+    def __init__(self, redis_client=None, on_run=None, lease_prefix="salbom:job:"):
+        self.redis = redis_client
+        self.on_run = on_run
+        self.lease_prefix = lease_prefix
+        self.jobs = {}
+        self._stop = threading.Event()
+        self._threads = []
+
+    def add(self, job):
+        self.jobs[job.name] = job
+        return job
+
+    def start(self):
+        for job in self.jobs.values():
+            t = threading.Thread(target=self._loop, args=(job,), daemon=True, name=f"job:{job.name}")
+            t.start()
+            self._threads.append(t)
+        log.info(f"[SCHED] iniciado con jobs: {', '.join(self.jobs)}")
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self, job):
+        # Jitter inicial para que las réplicas no arranquen todas juntas
+        delay = job.initial_delay if job.initial_delay is not None else random.uniform(3, 12)
+        while True:
+            job.state["next_run"] = _iso(time.time() + delay)
+            if self._stop.wait(delay):
+                return
+            self.run_once(job)
+            delay = job.next_delay()
+
+    def run_once(self, job):
+        """Corre el job si consigue el lease. False si otra réplica lo tiene o Redis falló."""
+        lease = Lease(self.redis, f"{self.lease_prefix}{job.name}", job.lease_ttl)
+        if not lease.acquire():
+            job.state["skipped"] += 1
+            if lease.error:
+                job.state["lease_errors"] += 1
+            return False
+        started = datetime.now(timezone.utc)
+        t0 = time.monotonic()
+        job.state.update(running=True, last_started=started.isoformat())
+        rows, error = None, None
+        try:
+            rows = _rows_of(job.fn())
+        except Exception as e:
+            error = f"{e}"
+            job.state["errors"] += 1
+            log.error(f"[SCHED] {job.name} falló: {e}\n{traceback.format_exc()}")
+        finally:
+            lease.release()
+        if lease.lost:
+            # El job no se puede cortar a mitad: la corrida queda marcada (puede haberse pisado con otra réplica)
+            job.state["lease_lost"] += 1
+            error = error or "lease perdido durante la corrida"
+            log.warning(f"[SCHED] {job.name}: lease perdido, la corrida pudo solaparse con otra réplica.")
+        duration_ms = int((time.monotonic() - t0) * 1000)
+        finished = datetime.now(timezone.utc)
+        job.state.update(
+            running=False, runs=job.state["runs"] + 1, last_finished=finished.isoformat(),
+            last_duration_ms=duration_ms, last_rows=rows, last_error=error,
+        )
+        if error is None:
+            log.info(f"[SCHED] {job.name} OK: filas={rows} en {duration_ms}ms")
+        if self.on_run:
+            try:
+                self.on_run(job.name, started, finished, duration_ms, rows, error)
+            except Exception as e:
+                log.warning(f"[SCHED] no se pudo registrar la corrida de {job.name}: {e}")
+        return True
+
+    def status(self):
+        return {name: {"interval": j.interval, **j.state} for name, j in self.jobs.items()}
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
@@ -1,74 +1,473 @@
 """
 Sincroniza incrementales desde Odoo a Postgres.
 Ejecutar como Worker/Cron en Render.
+
+Cada modelo guarda en `sync_state` un cursor (write_date, id) con el último
+registro aplicado; las corridas siguientes sólo piden lo posterior (dentro del
+segundo del cursor, por id: Odoo devuelve write_date truncado al segundo).
+Cada SYNC_FULL_INTERVAL segundos se hace una pasada completa de reconciliación,
+paginada por `id > last_id ORDER BY id` y con checkpoint para retomar si se corta.
+
+`run_partitioned_sync` hace la pasada completa en paralelo: parte cada modelo en
+rangos de id y los procesa con un pool acotado, un cliente Odoo por worker.
+
+`reconcile_tombstones` compara sólo ids (Odoo vs espejo) y marca como borrado
+lo que ya no está vivo en Odoo (archivado, sin tag APP o eliminado).
 """
-import os, time
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 from odooly import Client
-from db import upsert_products, upsert_partners
+from db import (
+    upsert_products, upsert_partners, bulk_upsert_products, bulk_upsert_partners,
+    get_sync_state, save_sync_state, save_full_checkpoint, finish_full_sync,
+    fetch_local_ids, mark_deleted, update_stock_qty,
+)
 
 SERVER = (os.getenv("ODOO_SERVER") or "").rstrip("/") + "/"
 DB     = os.getenv("ODOO_DB")
 USER   = os.getenv("ODOO_USER")
 PWD    = os.getenv("ODOO_PASSWORD")
 
+# Cada cuánto forzar una sincronización completa (default: 1 día)
+SYNC_FULL_INTERVAL = int(os.getenv("SYNC_FULL_INTERVAL", "86400"))
+# Registros por lote en cada search_read
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", "500"))
+# Sync paralelo: rangos de id por modelo y tope global de requests simultáneos a Odoo
+SYNC_PARTITIONS = int(os.getenv("SYNC_PARTITIONS", "4"))
+SYNC_MAX_CONCURRENCY = int(os.getenv("SYNC_MAX_CONCURRENCY", "4"))
+# Ids por request al traer el set vivo desde Odoo (sólo ids, sin campos)
+SYNC_ID_CHUNK = int(os.getenv("SYNC_ID_CHUNK", "50000"))
+# Registros por lote en el sync de stock (sólo id + qty_available)
+SYNC_STOCK_BATCH = int(os.getenv("SYNC_STOCK_BATCH", "2000"))
+
+log = logging.getLogger("salbom.sync")
+
+# Compartido por todos los workers (y corridas simultáneas) del proceso
+_odoo_slots = threading.BoundedSemaphore(SYNC_MAX_CONCURRENCY)
+_worker_local = threading.local()
+
 def _odoo_client():
     c = Client(SERVER)
     c.login(USER, PWD, DB)  # API key como password
     return c
 
-def sync_products(limit=500, sleep=0.1):
-    c = _odoo_client()
-    model = c.env["product.product"]
-    fields = ["id","default_code","name","x_brand","categ_id","lst_price","currency_id","qty_available"]
-    offset = 0
+def _m2o(value, idx):
+    """Extrae id (idx=0) o nombre (idx=1) de un many2one [id, "Nombre"]."""
+    if not value:
+        return False
+    return value[idx] if isinstance(value, (list, tuple)) else value
+
+def _map_product(r):
+    return {
+        "id": r["id"],
+        "default_code": r.get("default_code"),
+        "name": r.get("name"),
+        "brand": _m2o(r.get("x_brand"), 1),
+        "category": _m2o(r.get("categ_id"), 1),
+        "price_list": r.get("lst_price"),
+        "currency": _m2o(r.get("currency_id"), 1),
+        "stock_qty": r.get("qty_available"),
+    }
+
+def _map_partner(r):
+    return {
+        "id": r["id"],
+        "name": r.get("name"),
+        "vat": r.get("vat"),
+        "email": r.get("email"),
+        "phone": r.get("phone"),
+        "salesperson_id": _m2o(r.get("user_id"), 0),
+    }
+
+# Definición de cada modelo sincronizado: de dónde leer y cómo guardarlo
+SYNC_SPECS = {
+    "products": {
+        "model": "product.product",
+        "domain": [],
+        "fields": ["id","default_code","name","x_brand","categ_id","lst_price","currency_id","qty_available","write_date"],
+        "map": _map_product,
+        "upsert": upsert_products,
+        "bulk": bulk_upsert_products,   # COPY + merge, para pasadas completas
+    },
+    "partners": {
+        "model": "res.partner",
+        "domain": [("customer_rank", ">", 0)],
+        "fields": ["id","name","vat","email","phone","user_id","write_date"],
+        "map": _map_partner,
+        "upsert": upsert_partners,
+        "bulk": bulk_upsert_partners,
+    },
+}
+
+# Formato de write_date en search_read: truncado al segundo (Postgres lo guarda con µs)
+ODOO_DATETIME = "%Y-%m-%d %H:%M:%S"
+
+def _second(write_date):
+    """write_date de Odoo como texto truncado al segundo."""
+    return str(write_date)[:19]
+
+def _next_second(write_date):
+    return (datetime.strptime(_second(write_date), ODOO_DATETIME) + timedelta(seconds=1)).strftime(ODOO_DATETIME)
+
+def _cursor_domain(write_date, last_id):
+    """
+    Resto del segundo del cursor: write_date en [S, S+1s) con id > last_id.
+    `write_date = S` no sirve: el valor real tiene µs y nunca es igual al truncado.
+    """
+    return [("write_date", ">=", _second(write_date)),
+            ("write_date", "<", _next_second(write_date)),
+            ("id", ">", last_id)]
+
+def _after_domain(write_date):
+    """Todo lo posterior al segundo del cursor."""
+    return [("write_date", ">=", _next_second(write_date))]
+
+def _full_sync_due(state):
+    if not state or not state.get("cursor_write_date"):
+        return True
+    last_full = state.get("last_full_utc")
+    if not last_full:
+        return True
+    return datetime.now(timezone.utc) - last_full >= timedelta(seconds=SYNC_FULL_INTERVAL)
+
+def _high_water_mark(spec, model):
+    """
+    Segundo del write_date más alto al arrancar la pasada completa, con id 0:
+    el incremental vuelve a recorrer ese segundo entero, porque lo escrito
+    durante la pasada en el mismo segundo puede tener un id menor.
+    """
+    rows = model.search_read(spec["domain"], fields=["id", "write_date"],
+                             order="write_date desc, id desc", limit=1)
+    if not rows or not rows[0].get("write_date"):
+        return None, None
+    return _second(rows[0]["write_date"]), 0
+
+def _sync_full(name, spec, model, state, limit):
+    """
+    Pasada completa por keyset (id > last_id ORDER BY id).
+    Lo modificado durante la pasada queda por encima de la marca inicial y lo
+    levanta el próximo incremental. Si hay checkpoint, retoma desde ahí.
+    """
+    last_id = (state or {}).get("full_resume_id")
+    if last_id is None:
+        mark_wd, mark_id = _high_water_mark(spec, model)
+        last_id = 0
+        save_full_checkpoint(name, last_id, mark_wd, mark_id)
     total = 0
     while True:
-        rows = model.search_read([], fields=fields, limit=limit, offset=offset)
+        rows = model.search_read(
+            spec["domain"] + [("id", ">", last_id)],
+            fields=spec["fields"], order="id asc", limit=limit,
+        )
         if not rows:
             break
-        mapped = []
-        for r in rows:
-            mapped.append({
-                "id": r["id"],
-                "default_code": r.get("default_code"),
-                "name": r.get("name"),
-                "brand": (r.get("x_brand") or False) and (r["x_brand"][1] if isinstance(r["x_brand"], (list,tuple)) else r["x_brand"]),
-                "category": (r.get("categ_id") or False) and (r["categ_id"][1] if isinstance(r["categ_id"], (list,tuple)) else r["categ_id"]),
-                "price_list": r.get("lst_price"),
-                "currency": (r.get("currency_id") or False) and (r["currency_id"][1] if isinstance(r["currency_id"], (list,tuple)) else r["currency_id"]),
-                "stock_qty": r.get("qty_available"),
-            })
-        total += upsert_products(mapped)
-        offset += limit
-        time.sleep(sleep)
+        total += spec["bulk"]([spec["map"](r) for r in rows])
+        last_id = rows[-1]["id"]
+        save_full_checkpoint(name, last_id)
+        if len(rows) < limit:
+            break
+    finish_full_sync(name)
+    _reconcile_after_full(name)
     return total
 
-def sync_partners(limit=500, sleep=0.1):
-    c = _odoo_client()
-    model = c.env["res.partner"]
-    fields = ["id","name","vat","email","phone","user_id"]
-    offset = 0
+def _reconcile_after_full(name):
+    """Después de cada pasada completa, reconciliamos bajas (sin cortar el sync si falla)."""
+    try:
+        reconcile_tombstones(name)
+    except Exception as e:
+        log.error(f"TOMBSTONES {name} falló: {e}")
+
+def _advance(name, cursor, new_cursor):
+    """Guarda el cursor nuevo; si no avanzó, corta en vez de repetir el mismo lote para siempre."""
+    if new_cursor <= cursor:
+        raise RuntimeError(f"SYNC {name}: el cursor no avanzó ({cursor} -> {new_cursor})")
+    # Guardamos el cursor por lote: si se corta, retomamos desde acá
+    save_sync_state(name, new_cursor[0], new_cursor[1])
+    return new_cursor
+
+def _sync_incremental(name, spec, model, state, limit):
+    """
+    Trae sólo lo modificado desde el cursor (S, last_id): "todo lo anterior al
+    segundo S y, dentro de S, hasta last_id ya está aplicado".
+
+    Como write_date llega truncado al segundo y una escritura masiva en Odoo
+    deja miles de registros en el mismo, dentro de un segundo se pagina por id
+    (_cursor_domain). Lo posterior se pide por write_date: de cada lote se
+    aplican los segundos completos y el último se retoma por id.
+    """
+    cursor = (_second(state["cursor_write_date"]), int(state.get("cursor_id") or 0))
+    def apply(rows):
+        return spec["upsert"]([spec["map"](r) for r in rows])
+
     total = 0
     while True:
-        rows = model.search_read([("customer_rank", ">", 0)], fields=fields, limit=limit, offset=offset)
+        rows = model.search_read(
+            spec["domain"] + _cursor_domain(*cursor),
+            fields=spec["fields"], order="id asc", limit=limit,
+        )
+        if rows:
+            total += apply(rows)
+            cursor = _advance(name, cursor, (cursor[0], rows[-1]["id"]))
+            if len(rows) == limit:
+                continue
+        rows = model.search_read(
+            spec["domain"] + _after_domain(cursor[0]),
+            fields=spec["fields"], order="write_date asc, id asc", limit=limit,
+        )
         if not rows:
             break
-        mapped = []
-        for r in rows:
-            mapped.append({
-                "id": r["id"],
-                "name": r.get("name"),
-                "vat": r.get("vat"),
-                "email": r.get("email"),
-                "phone": r.get("phone"),
-                "salesperson_id": (r.get("user_id") or False) and (r["user_id"][0] if isinstance(r["user_id"], (list,tuple)) else r["user_id"]),
-            })
-        total += upsert_partners(mapped)
-        offset += limit
-        time.sleep(sleep)
+        last_second = _second(rows[-1]["write_date"])
+        if len(rows) < limit:
+            # Lote completo: también el último segundo está entero
+            total += apply(rows)
+            last_id = max(r["id"] for r in rows if _second(r["write_date"]) == last_second)
+            cursor = _advance(name, cursor, (last_second, last_id))
+            break
+        done = [r for r in rows if _second(r["write_date"]) < last_second]
+        total += apply(done)
+        cursor = _advance(name, cursor, (last_second, 0))
     return total
 
+def sync_model(name, limit=None, full=None):
+    """
+    Sincroniza un modelo de SYNC_SPECS.
+    full=None decide solo: retoma una pasada completa cortada, o hace una nueva
+    si no hay cursor o venció SYNC_FULL_INTERVAL; si no, incremental.
+    """
+    spec = SYNC_SPECS[name]
+    limit = limit or SYNC_BATCH_SIZE
+    state = get_sync_state(name)
+    resuming = bool(state and state.get("full_resume_id") is not None)
+    if full is None:
+        full = resuming or _full_sync_due(state)
+    elif full and not resuming:
+        state = None  # pasada completa forzada: arranca de cero
+    if not full and not (state and state.get("cursor_write_date")):
+        full = True   # sin cursor no hay incremental posible
+    model = _odoo_client().env[spec["model"]]
+    if full:
+        return _sync_full(name, spec, model, state, limit)
+    return _sync_incremental(name, spec, model, state, limit)
+
+# ───────── Sync completo particionado (paralelo) ─────────
+
+def _worker_client():
+    """Un cliente Odoo por hilo del pool (se reutiliza entre particiones)."""
+    c = getattr(_worker_local, "client", None)
+    if c is None:
+        c = _worker_local.client = _odoo_client()
+    return c
+
+def _id_bounds(spec, model):
+    lo = model.search_read(spec["domain"], fields=["id"], order="id asc", limit=1)
+    hi = model.search_read(spec["domain"], fields=["id"], order="id desc", limit=1)
+    if not lo or not hi:
+        return None, None
+    return lo[0]["id"], hi[0]["id"]
+
+def _partition_ranges(lo, hi, parts):
+    """Divide [lo, hi] en `parts` rangos (desde_exclusivo, hasta_inclusivo) contiguos."""
+    parts = max(1, min(parts, hi - lo + 1))
+    step = (hi - lo + 1) / parts
+    bounds = [lo - 1] + [lo - 1 + int(round(step * i)) for i in range(1, parts)] + [hi]
+    return [(bounds[i], bounds[i + 1]) for i in range(parts) if bounds[i + 1] > bounds[i]]
+
+def _sync_partition(name, after_id, until_id, limit):
+    spec = SYNC_SPECS[name]
+    model = _worker_client().env[spec["model"]]
+    started = time.monotonic()
+    last_id, rows_total = after_id, 0
+    while True:
+        with _odoo_slots:
+            rows = model.search_read(
+                spec["domain"] + [("id", ">", last_id), ("id", "<=", until_id)],
+                fields=spec["fields"], order="id asc", limit=limit,
+            )
+        if not rows:
+            break
+        rows_total += spec["bulk"]([spec["map"](r) for r in rows])
+        last_id = rows[-1]["id"]
+        if len(rows) < limit:
+            break
+    secs = time.monotonic() - started
+    return {
+        "model": name,
+        "range": [after_id + 1, until_id],
+        "rows": rows_total,
+        "seconds": round(secs, 3),
+        "rows_per_sec": round(rows_total / secs, 1) if secs > 0 else None,
+    }
+
+def run_partitioned_sync(models=("products", "partners"), partitions=None, max_workers=None, limit=None):
+    """
+    Pasada completa en paralelo. Cada modelo se parte en rangos de id que procesa
+    un pool acotado; _odoo_slots limita los search_read simultáneos a Odoo.
+    Devuelve totales por modelo y el throughput de cada partición.
+    """
+    partitions = partitions or SYNC_PARTITIONS
+    max_workers = max_workers or SYNC_MAX_CONCURRENCY
+    limit = limit or SYNC_BATCH_SIZE
+    client = _odoo_client()
+
+    tasks = []
+    for name in models:
+        spec = SYNC_SPECS[name]
+        model = client.env[spec["model"]]
+        mark_wd, mark_id = _high_water_mark(spec, model)
+        lo, hi = _id_bounds(spec, model)
+        # Si la corrida se corta, el próximo sync_model retoma en serie desde 0
+        save_full_checkpoint(name, 0, mark_wd, mark_id)
+        if lo is not None:
+            tasks += [(name, a, b) for a, b in _partition_ranges(lo, hi, partitions)]
+
+    report = {name: {"rows": 0, "partitions": []} for name in models}
+    errors = []
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sync") as pool:
+        futures = {pool.submit(_sync_partition, n, a, b, limit): (n, a, b) for n, a, b in tasks}
+        for fut in as_completed(futures):
+            name, a, b = futures[fut]
+            try:
+                part = fut.result()
+            except Exception as e:
+                log.error(f"SYNC {name} ({a + 1}..{b}) falló: {e}")
+                errors.append({"model": name, "range": [a + 1, b], "error": str(e)})
+                continue
+            log.info(f"SYNC {name} {part['range']}: {part['rows']} filas en {part['seconds']}s ({part['rows_per_sec']}/s)")
+            report[name]["rows"] += part["rows"]
+            report[name]["partitions"].append(part)
+
+    failed = {e["model"] for e in errors}
+    for name in models:
+        if name not in failed:
+            finish_full_sync(name)
+            _reconcile_after_full(name)
+        report[name]["partitions"].sort(key=lambda p: p["range"][0])
+    return {"models": report, "errors": errors, "seconds": round(time.monotonic() - started, 3)}
+
+# ───────── Tombstones ─────────
+
+def _productos_cache_ids():
+    from repos import get_productos_cache_ids_db  # repos exige DATABASE_URL al importar
+    return get_productos_cache_ids_db()
+
+def _mark_productos_cache(ids, hard=False):
+    from repos import mark_productos_cache_deleted_db
+    return mark_productos_cache_deleted_db(ids, hard=hard)
+
+# Espejos a reconciliar: modelo/dominio vivo en Odoo y cómo leer/marcar localmente
+TOMBSTONE_SPECS = {
+    "products": {
+        "model": SYNC_SPECS["products"]["model"],
+        "domain": SYNC_SPECS["products"]["domain"],
+        "local_ids": lambda: fetch_local_ids("products"),
+        "mark": lambda ids, hard=False: mark_deleted("products", ids, hard=hard),
+    },
+    "partners": {
+        "model": SYNC_SPECS["partners"]["model"],
+        "domain": SYNC_SPECS["partners"]["domain"],
+        "local_ids": lambda: fetch_local_ids("partners"),
+        "mark": lambda ids, hard=False: mark_deleted("partners", ids, hard=hard),
+    },
+    "productos_cache": {
+        "model": "product.template",
+        "domain": [("product_tag_ids", "ilike", "APP")],
+        "local_ids": _productos_cache_ids,
+        "mark": _mark_productos_cache,
+    },
+}
+
+def _live_ids(model, domain, chunk=None):
+    """Ids vivos en Odoo, ordenados, en tandas por keyset (sólo `search`, sin leer campos)."""
+    chunk = chunk or SYNC_ID_CHUNK
+    ids, last_id = [], 0
+    while True:
+        batch = model.search(domain + [("id", ">", last_id)], order="id asc", limit=chunk).ids
+        if not batch:
+            break
+        ids.extend(batch)
+        last_id = batch[-1]
+        if len(batch) < chunk:
+            break
+    return ids
+
+def _sorted_difference(local, live):
+    """Elementos de `local` que no están en `live` (ambos ordenados), en O(n + m)."""
+    missing = []
+    j, m = 0, len(live)
+    for x in local:
+        while j < m and live[j] < x:
+            j += 1
+        if j >= m or live[j] != x:
+            missing.append(x)
+    return missing
+
+def reconcile_tombstones(name, hard=False):
+    """
+    Marca (o borra con hard=True) las filas del espejo `name` que ya no están
+    vivas en Odoo. Sólo viajan ids, así que escala a cientos de miles de registros.
+    """
+    spec = TOMBSTONE_SPECS[name]
+    model = _odoo_client().env[spec["model"]]
+    live = _live_ids(model, spec["domain"])
+    local = spec["local_ids"]()
+    if not live and local:
+        # Odoo vacío casi seguro es un error de conexión/permisos: no vaciamos el espejo
+        log.warning(f"TOMBSTONES {name}: Odoo devolvió 0 ids con {len(local)} locales; se omite.")
+        return {"model": name, "local": len(local), "live": 0, "missing": 0, "skipped": True}
+    missing = _sorted_difference(local, live)
+    marked = spec["mark"](missing, hard=hard) if missing else 0
+    log.info(f"TOMBSTONES {name}: locales={len(local)} vivos={len(live)} faltantes={len(missing)}")
+    return {"model": name, "local": len(local), "live": len(live), "missing": len(missing), "marked": marked}
+
+# ───────── Stock ─────────
+
+def sync_stock(limit=None):
+    """
+    Los movimientos de stock no tocan write_date de product.product, así que el
+    incremental no los ve: este sync recorre sólo (id, qty_available) por keyset
+    y actualiza las filas cuyo stock cambió. Devuelve cuántas se actualizaron.
+    `limit` es el tamaño de lote (como en sync_model): siempre recorre hasta el final.
+    """
+    spec = SYNC_SPECS["products"]
+    model = _odoo_client().env[spec["model"]]
+    batch = limit or SYNC_STOCK_BATCH
+    last_id, seen, updated = 0, 0, 0
+    while True:
+        rows = model.search_read(spec["domain"] + [("id", ">", last_id)],
+                                 fields=["id", "qty_available"], order="id asc", limit=batch)
+        if not rows:
+            break
+        updated += update_stock_qty([{"id": r["id"], "stock_qty": r.get("qty_available")} for r in rows])
+        seen += len(rows)
+        last_id = rows[-1]["id"]
+        if len(rows) < batch:
+            break
+    log.info(f"STOCK: revisados={seen} actualizados={updated}")
+    return updated
+
+def sync_products(limit=None, full=None):
+    return sync_model("products", limit=limit, full=full)
+
+def sync_partners(limit=None, full=None):
+    return sync_model("partners", limit=limit, full=full)
+
 if __name__ == "__main__":
-    p = sync_products()
-    t = sync_partners()
+    import sys
+    force_full = "--full" in sys.argv
+    if "--tombstones" in sys.argv:
+        print([reconcile_tombstones(n) for n in TOMBSTONE_SPECS])
+        sys.exit(0)
+    if "--stock" in sys.argv:
+        print({"stock_updated": sync_stock()})
+        sys.exit(0)
+    if "--parallel" in sys.argv:
+        print(run_partitioned_sync())
+        sys.exit(0)
+    p = sync_products(full=True if force_full else None)
+    t = sync_partners(full=True if force_full else None)
     print({"synced_products": p, "synced_partners": t})
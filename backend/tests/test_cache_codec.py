@@ -0,0 +1,25 @@
+import importlib.util
+import json
+
+
+def load_codec():
+    spec = importlib.util.spec_from_file_location('backend.cache_codec', 'backend/cache_codec.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_small_values_stay_plain_json_and_old_entries_decode():
+    codec = load_codec()
+    assert codec.Codec('json', 'zlib', 4096).dumps({'v': 1}) == json.dumps({'v': 1})
+    assert codec.Codec.loads(b'{"v": 1}') == {'v': 1}
+    assert codec.Codec.loads('[1, 2]') == [1, 2]
+
+
+def test_large_values_are_framed_and_compressed():
+    codec = load_codec()
+    value = [{'id': i, 'name': f'Producto {i}'} for i in range(500)]
+    blob = codec.Codec('json', 'zlib', 1024).dumps(value)
+    assert blob[:2] == bytes((0x00, (codec.SER_JSON << 4) | codec.COMP_ZLIB))
+    assert len(blob) < len(json.dumps(value)) / 3
+    assert codec.Codec.loads(blob) == value
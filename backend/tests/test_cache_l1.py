@@ -0,0 +1,57 @@
+import importlib.util
+import json
+
+
+def load_cache_l1():
+    spec = importlib.util.spec_from_file_location('backend.cache_l1', 'backend/cache_l1.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_lru_bound_ttl_and_counters(monkeypatch):
+    l1 = load_cache_l1()
+    now = [100.0]
+    monkeypatch.setattr(l1.time, 'monotonic', lambda: now[0])
+    c = l1.LRUCache(maxsize=2, ttl=5)
+    c.set('a', 1)
+    c.set('b', 2)
+    assert c.get('a') == 1
+    c.set('c', 3)                      # desaloja 'b' (el menos usado)
+    assert c.get('b') is None
+    now[0] += 6
+    assert c.get('a') is None          # vencido
+    s = c.stats()
+    assert (s['hits'], s['misses'], s['evictions']) == (1, 2, 1)
+
+
+def test_invalidation_respects_versions():
+    l1 = load_cache_l1()
+    c = l1.LRUCache(maxsize=10, ttl=60)
+    inv = l1.Invalidator(None, c)
+    c.set('k', 'nuevo', version=200)
+    inv.handle(json.dumps({'k': 'k', 'v': 100, 'n': 'otro'}))
+    assert c.get('k') == 'nuevo'       # la invalidación es más vieja que la copia
+    inv.handle(json.dumps({'k': 'k', 'v': 300, 'n': 'otro'}))
+    assert c.get('k') is None
+
+
+def test_batch_invalidation_message():
+    l1 = load_cache_l1()
+    c = l1.LRUCache(maxsize=10, ttl=60)
+    inv = l1.Invalidator(None, c)
+    c.set('a', 1, version=100)
+    c.set('b', 2, version=100)
+    inv.handle(json.dumps({'ks': ['a', 'b'], 'v': 200, 'n': 'otro'}))
+    assert c.get('a') is None and c.get('b') is None
+
+
+def test_fill_from_redis_skipped_if_invalidated_meanwhile():
+    l1 = load_cache_l1()
+    c = l1.LRUCache(maxsize=10, ttl=60)
+    inv = l1.Invalidator(None, c)
+    snap = c.snapshot('k')                              # antes del GET a Redis
+    inv.handle(json.dumps({'k': 'k', 'v': 300, 'n': 'otro'}))   # llega sin copia local
+    assert c.set('k', 'viejo', snapshot=snap) is False
+    assert c.get('k') is None and c.stats()['stale_skips'] == 1
+    assert c.set('k', 'nuevo', snapshot=c.snapshot('k')) is True
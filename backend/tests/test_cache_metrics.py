@@ -0,0 +1,67 @@
+import importlib.util
+
+
+def load_cache_metrics():
+    spec = importlib.util.spec_from_file_location('backend.cache_metrics', 'backend/cache_metrics.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_counters_and_histograms_per_namespace():
+    cm = load_cache_metrics()
+    m = cm.CacheMetrics()
+    m.hit('prod_info_v14:10', 'l1')
+    m.hit('prod_info_v14:11')
+    m.miss('prod_info_v14:12')
+    m.fallback('prod_info_v14:12', 0.120)
+    m.size('facturas:7', 3000)
+    m.error('marcas_filtradas_app')
+    snap = m.snapshot()
+    assert snap['prod_info_v14']['hits'] == {'l1': 1, 'redis': 1}
+    assert snap['prod_info_v14']['hit_ratio'] == round(2 / 3, 4)
+    assert snap['prod_info_v14']['fallback_ms']['buckets']['100'] == 0
+    assert snap['prod_info_v14']['fallback_ms']['buckets']['250'] == 1
+    assert snap['facturas']['size_bytes']['buckets']['4096'] == 1
+    assert snap['marcas_filtradas_app']['errors'] == 1
+    text = m.prometheus()
+    assert 'salbom_cache_misses_total{namespace="prod_info_v14"' in text
+    assert 'salbom_cache_fallback_ms_bucket{namespace="prod_info_v14"' in text
+
+
+class FakeRedis:
+    def __init__(self, keys):
+        self.keys = keys     # key -> (ttl, bytes)
+
+    def scan(self, cursor=0, match='*', count=10):
+        names = sorted(self.keys)
+        batch = names[cursor:cursor + 2]
+        nxt = cursor + 2
+        return (0 if nxt >= len(names) else nxt), [k.encode() for k in batch]
+
+    def pipeline(self, transaction=False):
+        fake, ops = self, []
+
+        class Pipe:
+            def ttl(self, k):
+                ops.append(fake.keys[k.decode()][0])
+
+            def memory_usage(self, k, samples=0):
+                ops.append(fake.keys[k.decode()][1])
+
+            def execute(self):
+                return list(ops)
+        return Pipe()
+
+
+def test_scan_report_groups_by_namespace():
+    cm = load_cache_metrics()
+    r = FakeRedis({'facturas:1': (100, 500), 'facturas:2': (300, 700),
+                   'tag:offers': (-1, 80), 'prod_info_v14:9': (50, 2000), 'x': (10, 1)})
+    rep = cm.scan_report(r, count=2)
+    assert rep['scanned'] == 5 and not rep['truncated']
+    ns = rep['namespaces']
+    assert list(ns)[0] == 'prod_info_v14'          # ordenado por memoria
+    assert ns['facturas'] == {'keys': 2, 'memory_bytes': 1200, 'no_ttl': 0, 'avg_ttl': 200}
+    assert ns['tag']['no_ttl'] == 1 and ns['tag']['avg_ttl'] is None
+    assert cm.scan_report(r, count=2, max_keys=2)['truncated']
@@ -0,0 +1,106 @@
+import importlib.util
+import json
+import sys
+import threading
+
+
+def load_swr():
+    if 'backend' not in sys.path:
+        sys.path.insert(0, 'backend')  # cache_swr importa cache_codec
+    spec = importlib.util.spec_from_file_location('backend.cache_swr', 'backend/cache_swr.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {}
+    def get(self, key):
+        return self.store.get(key)
+    def setex(self, key, ttl, value):
+        self.store[key] = value
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.store:
+            return None
+        self.store[key] = value
+        return True
+    def delete(self, key):
+        self.store.pop(key, None)
+    def expire(self, key, ttl):
+        return True
+
+
+def wire(swr, store):
+    # Como main.py: lecturas/escrituras por cache_get/cache_setex, locks directo en Redis
+    fake = FakeRedis()
+    fake.store = store
+    swr.init_swr(fake, lambda k: json.loads(store[k]) if k in store else None,
+                 lambda k, ttl, v, tags: store.__setitem__(k, json.dumps(v)))
+    return fake
+
+
+def test_stale_hit_schedules_a_single_refresh():
+    swr = load_swr()
+    wire(swr, {'k': json.dumps({'ts': 0, 'data': 'viejo'})})
+    gate = threading.Event()
+    calls = []
+
+    @swr.swr_cache(lambda: 'k', ttl=10, bg_ttl=100)
+    def handler():
+        calls.append(1)
+        gate.wait(2)
+        return 'nuevo'
+
+    assert [handler() for _ in range(5)] == ['viejo'] * 5   # nadie espera a Odoo
+    gate.set()
+    swr._executor.shutdown(wait=True)
+    assert calls == [1]
+    assert json.loads(swr.r.store['k'])['data'] == 'nuevo'
+    assert 'swr:lock:k' not in swr.r.store
+
+
+def test_failed_refresh_backs_off_and_keeps_stale():
+    swr = load_swr()
+    wire(swr, {'k': json.dumps({'ts': 0, 'data': 'viejo'})})
+    calls = []
+
+    @swr.swr_cache(lambda: 'k', ttl=10, bg_ttl=100, error_backoff=60)
+    def handler():
+        calls.append(1)
+        raise RuntimeError('odoo caído')
+
+    assert handler() == 'viejo'
+    swr._executor.shutdown(wait=True)
+    assert handler() == 'viejo'
+    assert calls == [1]
+    assert swr.stats['refresh_errors'] == 1
+
+
+def test_stale_and_refresh_go_to_shared_cache_metrics():
+    swr = load_swr()
+    from cache_metrics import CacheMetrics
+    store = {'catalogo:1': json.dumps({'ts': 0, 'data': 'viejo'})}
+    wire(swr, store)
+    m = CacheMetrics()
+    swr.metrics = m
+    fail = []
+
+    @swr.swr_cache(lambda k: k, ttl=10, bg_ttl=100)
+    def handler(k):
+        if fail:
+            raise RuntimeError('odoo caído')
+        return 'nuevo'
+
+    assert handler('catalogo:1') == 'viejo'
+    swr._executor.shutdown(wait=True)
+    assert handler('catalogo:2') == 'nuevo'          # miss: se calcula en el request
+    fail.append(1)
+    store['catalogo:2'] = json.dumps({'ts': 0, 'data': 'nuevo'})
+    swr._executor = swr.ThreadPoolExecutor(max_workers=1)
+    handler('catalogo:2')
+    swr._executor.shutdown(wait=True)
+    snap = m.snapshot()['catalogo']
+    assert snap['stale'] == 2
+    assert snap['fallback_ms']['count'] == 2         # refresh ok + miss
+    assert snap['errors'] == 1                       # refresh fallido
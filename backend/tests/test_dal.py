@@ -0,0 +1,158 @@
+import importlib.util
+
+import pytest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+
+
+def load_dal():
+    spec = importlib.util.spec_from_file_location('backend.dal', 'backend/dal.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeConn:
+    def __init__(self):
+        self.closed = 0
+        self.autocommit = False
+        self.rollbacks = 0
+        self.info = type('Info', (), {'transaction_status': TRANSACTION_STATUS_IDLE})()
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.info.transaction_status = TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeThreadedPool:
+    def __init__(self, minconn, maxconn, dsn, **kw):
+        self.kw = kw
+        self._pool, self.created = [], []
+
+    def getconn(self):
+        if self._pool:
+            return self._pool.pop()
+        c = FakeConn()
+        self.created.append(c)
+        return c
+
+    def putconn(self, conn, close=False):
+        if close:
+            conn.close()
+        else:
+            self._pool.append(conn)
+
+
+@pytest.fixture
+def dal(monkeypatch):
+    module = load_dal()
+    monkeypatch.setattr(module.pg_pool, 'ThreadedConnectionPool', FakeThreadedPool)
+    return module
+
+
+def test_close_returns_to_pool_and_rolls_back(dal):
+    p = dal.Pool('postgres://x', maxconn=2, timeout=0.05, statement_timeout_ms=5000, idle_check=0)
+    assert p._pool.kw['options'] == '-c statement_timeout=5000'
+    conn = p.getconn()
+    raw = conn.raw
+    raw.info.transaction_status = TRANSACTION_STATUS_INTRANS
+    conn.autocommit = True                      # se delega a la conexión real
+    conn.close()
+    conn.close()                                # idempotente
+    assert raw.rollbacks == 1 and raw.autocommit is False
+    again = p.getconn()
+    assert again.raw is raw                     # reutilizada, no una nueva
+    other = p.getconn()
+    with pytest.raises(dal.PoolTimeout):        # máximo alcanzado: espera y falla
+        p.getconn()
+    other.close()
+    again.close()
+    assert p.stats()['timeouts'] == 1
+
+
+def test_max_lifetime_recycles(dal, monkeypatch):
+    p = dal.Pool('postgres://x', maxconn=1, max_lifetime=10, idle_check=0)
+    now = [1000.0]
+    monkeypatch.setattr(dal.time, 'monotonic', lambda: now[0])
+    first = p.getconn()
+    raw = first.raw
+    first.close()
+    now[0] += 11
+    second = p.getconn()
+    assert second.raw is not raw and raw.closed
+    assert p.stats()['recycled'] == 1
+    second.close()
+
+
+def test_transaction_shares_connection_and_retries_only_safe(dal, monkeypatch):
+    from contextlib import contextmanager
+
+    class Cur:
+        def __init__(self, conn):
+            self.conn = conn
+        def __enter__(self):
+            return self
+        def __exit__(self, *exc):
+            pass
+        def execute(self, sql, params=None):
+            if self.conn.broken:
+                raise dal.psycopg2.OperationalError('server closed the connection')
+            self.conn.sql.append(sql)
+            self.rowcount = 1
+        def fetchone(self):
+            return {'n': 1}
+
+    opened = []
+
+    @contextmanager
+    def connection():
+        conn = FakeConn()
+        conn.sql, conn.broken = [], not opened
+        conn.cursor = lambda **kw: Cur(conn)
+        opened.append(conn)
+        yield conn
+
+    monkeypatch.setattr(dal, 'connection', connection)
+    monkeypatch.setattr(dal.time, 'sleep', lambda s: None)
+    assert dal.scalar('SELECT 1') == 1           # lectura con la conexión rota: reintenta
+    assert len(opened) == 2
+    opened.clear()
+    with pytest.raises(dal.psycopg2.OperationalError):
+        dal.execute('INSERT a')                  # escritura ya mandada: no se reintenta
+    assert len(opened) == 1
+    with dal.transaction():
+        dal.execute('UPDATE b')
+        with dal.transaction():
+            dal.execute('UPDATE c')
+    assert len(opened) == 2 and opened[1].sql == ['UPDATE b', 'UPDATE c']
+
+
+def test_prepared_once_per_connection(dal, monkeypatch):
+    stmt = dal.prepared('role_by_cuit', "SELECT role FROM app_users WHERE cuit = %s AND name LIKE 'a%%' AND id > %s")
+    assert stmt.sql == "SELECT role FROM app_users WHERE cuit = $1 AND name LIKE 'a%' AND id > $2"
+    assert dal.prepared('role_by_cuit', "SELECT role FROM app_users WHERE cuit = %s AND name LIKE 'a%%' AND id > %s") is stmt
+    with pytest.raises(ValueError):
+        dal.prepared('role_by_cuit', 'SELECT 1')
+
+    class Cur:
+        def __init__(self, conn):
+            self.connection, self.sent = conn, conn.sent
+        def execute(self, sql, params=None):
+            self.sent.append((sql, params))
+
+    monkeypatch.setenv('DATABASE_URL', 'postgres://x')
+    p = dal.get_pool()
+    conn = p.getconn()
+    conn.raw.sent = []
+    for cuit in ('20-1', '20-2'):
+        dal.cursor_execute(Cur(conn.raw), stmt, (cuit, 5))
+    assert conn.raw.sent == [
+        ('PREPARE role_by_cuit AS ' + stmt.sql, None),
+        ('EXECUTE role_by_cuit (%s, %s)', ('20-1', 5)),
+        ('EXECUTE role_by_cuit (%s, %s)', ('20-2', 5)),
+    ]
+    with pytest.raises(TypeError):
+        dal.cursor_execute(Cur(conn.raw), stmt, ('20-1',))
+    conn.close()
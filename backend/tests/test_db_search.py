@@ -0,0 +1,67 @@
+import importlib.util
+import sys
+
+sys.path.insert(0, 'backend')
+
+
+def load_db():
+    spec = importlib.util.spec_from_file_location('backend.db', 'backend/db.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_search_ranks_by_similarity_and_pages_by_cursor(monkeypatch):
+    db = load_db()
+    sent = []
+
+    def fake_query(sql, params):
+        sent.append((sql, params))
+        rows = [{'id': i, 'name': f'Taladro {i}', 'score': 0.5} for i in range(1, 4)]
+        return rows[:params['limit']]
+
+    monkeypatch.setattr(db.dal, 'query', fake_query)
+    page = db.search_products('50%_off', limit=2)
+    sql, params = sent[-1]
+    assert params['like'] == '%50\\%\\_off%' and params['limit'] == 3
+    assert 'order by score desc, name asc, id asc' in sql
+    assert [r['id'] for r in page['rows']] == [1, 2] and 'score' not in page['rows'][0]
+    db.search_products('50%_off', limit=2, cursor=page['next_cursor'])
+    sql, params = sent[-1]
+    assert (params['c_score'], params['c_name'], params['c_id']) == (0.5, 'Taladro 2', 2)
+    assert params['offset'] == 0
+    plain = db.search_products(None, limit=5)
+    assert plain['next_cursor'] is None and 'similarity' not in sent[-1][0]
+
+
+def test_stock_is_outside_the_product_hash_but_still_compared(monkeypatch):
+    db = load_db()
+    row = {'id': 1, 'default_code': 'A', 'name': 'Taladro', 'price_list': 10, 'stock_qty': 5}
+    h5 = db._prepare([row], db.PRODUCT_COLS)[0]['content_hash']
+    h3 = db._prepare([{**row, 'stock_qty': 3}], db.PRODUCT_COLS)[0]['content_hash']
+    assert h5 == h3                    # update_stock_qty no deja un hash desactualizado
+    sent = []
+    monkeypatch.setattr(db.dal, 'execute_many', lambda sql, values: sent.append(sql))
+    db.upsert_products([row])
+    assert 'products.stock_qty is distinct from excluded.stock_qty' in sent[0]
+
+
+def test_mark_deleted_chunks_in_one_transaction(monkeypatch):
+    db = load_db()
+    sent, tx = [], []
+
+    class Tx:
+        def __enter__(self):
+            tx.append('begin')
+        def __exit__(self, *exc):
+            tx.append('end')
+
+    monkeypatch.setattr(db.dal, 'transaction', Tx)
+    monkeypatch.setattr(db.dal, 'execute', lambda sql, params: sent.append((sql, params['ids'])) or len(params['ids']))
+    assert db.mark_deleted('products', list(range(1, 8)), chunk=3) == 7
+    assert [ids for _, ids in sent] == [[1, 2, 3], [4, 5, 6], [7]]
+    assert tx == ['begin', 'end'] and sent[0][0].startswith('update products set deleted_utc')
+    sent.clear()
+    db.mark_deleted('partners', [9], hard=True)
+    assert sent == [('delete from partners where id = any(%(ids)s)', [9])]
+    assert db.mark_deleted('products', []) == 0
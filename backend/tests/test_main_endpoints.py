@@ -0,0 +1,137 @@
+import importlib.util
+import sys
+
+import pytest
+
+sys.path.insert(0, 'backend')
+
+
+@pytest.fixture
+def main_module(monkeypatch):
+    monkeypatch.delenv('REDIS_URL', raising=False)
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    monkeypatch.setenv('WARMUP_ENABLED', '0')
+    monkeypatch.setenv('ENABLE_BACKGROUND_SYNC', '0')
+    spec = importlib.util.spec_from_file_location('backend.main', 'backend/main.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_config_without_database_is_empty_defaults(main_module):
+    res = main_module.app.test_client().get('/config/home')
+    assert res.status_code == 200
+    assert res.get_json() == {}
+
+
+def test_config_db_outage_is_503_and_not_cached(main_module, monkeypatch):
+    m = main_module
+    monkeypatch.setattr(m, 'DATABASE_URL', 'postgres://caida')
+    stored = []
+    monkeypatch.setattr(m, 'cache_setex', lambda *a, **kw: stored.append(a[0]))
+
+    def down(*a, **kw):
+        raise RuntimeError('connection refused')
+    monkeypatch.setattr(m.dal, 'scalar', down)
+    monkeypatch.setattr(m, 'get_pg_connection', lambda: None)
+    client = m.app.test_client()
+    res = client.get('/config/home')
+    assert res.status_code == 503 and 'Retry-After' in res.headers
+    res = client.get('/admin/plazos-descuentos')
+    assert res.status_code == 503
+    assert stored == []
+
+
+def test_cached_failure_is_503_from_one_handler(main_module, monkeypatch):
+    m = main_module
+    monkeypatch.setattr(m, 'get_odoo_client', lambda: object())
+    monkeypatch.setattr(m, 'release_odoo_client', lambda *a, **kw: None)
+    monkeypatch.setattr(m, 'cache_get', lambda k, record=True: {'__neg__': 'failed', 'error': 'Fault'})
+    client = m.app.test_client()
+    for url in ('/producto/7/imagen', '/factura_pdf?facturaId=FA-A%200001', '/mis_ventas?cuit=20123'):
+        res = client.get(url)
+        assert res.status_code == 503, url
+        assert res.headers['Retry-After'] == str(m.FAILURE_CACHE_TTL)
+
+
+def test_catalog_search_is_plain_cache_with_normalized_key(main_module, monkeypatch):
+    m = main_module
+    fetched, keys = [], []
+    monkeypatch.setattr(m, '_fetch_catalogo', lambda *a: fetched.append(a) or {'productos': []})
+    monkeypatch.setattr(m, '_browse_catalogo', lambda *a: 'swr')
+
+    def fake_cache(key, ttl=300, fallback_fn=None, tags=()):
+        keys.append((key, ttl))
+        return fallback_fn()
+    monkeypatch.setattr(m, 'get_cache_or_execute', fake_cache)
+    assert m.query_catalogo('  ', False, '3', None) == 'swr'
+    m.query_catalogo('  Taladro   BOSCH ', True, '3', '')
+    m.query_catalogo('x' * 500, False, None, None)
+    assert keys[0] == ('catalogo:v1:1:3::taladro bosch', m.CATALOG_SEARCH_TTL)
+    assert fetched[0] == ('taladro bosch', True, 3, None)
+    assert len(fetched[1][0]) == m.CATALOG_SEARCH_MAX_LEN
+
+
+def test_cart_pricing_rejects_bad_items_with_400(main_module, monkeypatch):
+    m = main_module
+    monkeypatch.setattr(m, 'resolve_offer_prices', lambda lines, pg_conn=None: [None] * len(lines))
+    monkeypatch.setattr(m, 'get_pg_connection', lambda: None)
+    client = m.app.test_client()
+    for body in ({'items': 'x'}, {'items': ['sku']}, {'items': [{'sku': 'A', 'quantity': 'dos'}]},
+                 {'items': [{'sku': 'A', 'quantity': -1}]}, {'items': [{'sku': 'A', 'list_price': 'n/a'}]}):
+        res = client.post('/cart/pricing', json=body)
+        assert res.status_code == 400, body
+        assert 'error' in res.get_json()
+    res = client.post('/cart/pricing', json={'items': [{'sku': 'A', 'quantity': '3'}]})
+    assert res.get_json() == {'items': [{'sku': 'A', 'quantity': 3.0, 'price_offer': None}]}
+
+
+def test_offer_index_job_runs_in_every_worker_without_lease(main_module):
+    m = main_module
+    assert 'offer_index' not in m.scheduler.jobs
+    job = m.worker_scheduler.jobs['offer_index']
+    assert m.worker_scheduler.redis is None                          # sin lease: corre en cada proceso
+    assert job.interval * (1 + job.jitter) < m.OFFER_INDEX_MAX_AGE
+
+
+def test_boot_applies_pending_migrations_by_default(main_module, monkeypatch):
+    m = main_module
+    ran = []
+    monkeypatch.setattr(m, 'DATABASE_URL', 'postgres://x')
+    monkeypatch.setattr(m.migrations, 'migrate', lambda: ran.append('migrate'))
+    monkeypatch.setattr(m.migrations, 'pending', lambda: [])
+    m.check_schema()
+    assert ran == []                                                  # nada pendiente: sin lock
+    monkeypatch.setattr(m.migrations, 'pending', lambda: [5])
+    m.check_schema()
+    assert m.MIGRATE_ON_BOOT and ran == ['migrate']
+
+
+def test_schedulers_start_on_import_when_background_sync_is_on(monkeypatch):
+    monkeypatch.delenv('REDIS_URL', raising=False)
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    monkeypatch.setenv('WARMUP_ENABLED', '0')
+    monkeypatch.setenv('ENABLE_BACKGROUND_SYNC', '1')
+    import scheduler
+    started = []
+    monkeypatch.setattr(scheduler.Scheduler, 'start', lambda self: started.append(sorted(self.jobs)))
+    spec = importlib.util.spec_from_file_location('backend.main', 'backend/main.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    assert ['offer_index'] in started
+    assert any('kpis' in jobs and 'offers' in jobs for jobs in started)
+
+
+def test_warmup_run_id_is_per_process_without_deploy_commit(monkeypatch):
+    monkeypatch.delenv('RENDER_GIT_COMMIT', raising=False)
+    monkeypatch.delenv('REDIS_URL', raising=False)
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    monkeypatch.setenv('WARMUP_ENABLED', '0')
+    monkeypatch.setenv('ENABLE_BACKGROUND_SYNC', '0')
+    ids = []
+    for _ in range(2):
+        spec = importlib.util.spec_from_file_location('backend.main', 'backend/main.py')
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        ids.append(module.warmup.run_id)
+    assert ids[0] != ids[1] and all(i.startswith('boot-') for i in ids)
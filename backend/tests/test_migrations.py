@@ -0,0 +1,113 @@
+import importlib.util
+import sys
+
+import pytest
+
+sys.path.insert(0, 'backend')
+
+
+def load_migrations():
+    spec = importlib.util.spec_from_file_location('backend.migrations', 'backend/migrations.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, sql, params=None):
+        db = self.db
+        db.log.append(sql)
+        if 'FAIL' in sql:
+            raise RuntimeError('syntax error')
+        if sql == 'BEGIN':
+            db.in_tx = True
+        elif sql in ('COMMIT', 'ROLLBACK'):
+            if sql == 'COMMIT':
+                db.table.update(db.staged)
+            db.staged, db.in_tx = {}, False
+        elif sql.startswith('INSERT INTO schema_migrations'):
+            (db.staged if db.in_tx else db.table)[params[0]] = params[2]
+        elif sql.startswith('SELECT version, checksum'):
+            self._rows = list(db.table.items())
+        elif 'indisvalid' in sql:
+            self._rows = [(params[0] in db.invalid,)]
+        elif sql.startswith('DROP INDEX'):
+            db.invalid.discard(sql.split()[-1])
+        elif 'to_regclass' in sql:
+            self._rows = [('schema_migrations' if db.table else None,)]
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0]
+
+
+class FakeConn:
+    def __init__(self):
+        self.table, self.staged, self.in_tx, self.log = {}, {}, False, []
+        self.invalid = set()
+        self.autocommit = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_applies_pending_in_order_under_lock_once():
+    mg = load_migrations()
+    M = mg.Migration
+    plan = [M(1, 'a', 'CREATE TABLE a ()'), M(2, 'b', ['CREATE INDEX CONCURRENTLY x ON a ()'], False)]
+    conn = FakeConn()
+    assert mg.pending(plan, conn=conn) == [1, 2]
+    assert mg.migrate(plan, conn=conn) == [1, 2]
+    lock = conn.log.index('SELECT pg_advisory_lock(%s)')
+    assert conn.log[-1] == 'SELECT pg_advisory_unlock(%s)'
+    assert conn.log.index('CREATE TABLE a ()') > lock
+    assert conn.log.count('BEGIN') == 1                               # la 2 va sin transacción
+    assert set(conn.table) == {1, 2}
+    assert mg.migrate(plan, conn=conn) == []                          # segunda corrida: nada
+    assert mg.pending(plan + [M(3, 'c', 'SELECT 1')], conn=conn) == [3]
+
+
+def test_failed_migration_is_not_recorded_and_stops():
+    mg = load_migrations()
+    M = mg.Migration
+    conn = FakeConn()
+    plan = [M(1, 'ok', 'CREATE TABLE a ()'), M(2, 'bad', 'FAIL'), M(3, 'later', 'CREATE TABLE c ()')]
+    with pytest.raises(RuntimeError):
+        mg.migrate(plan, conn=conn)
+    assert set(conn.table) == {1}
+    assert conn.log[-1] == 'SELECT pg_advisory_unlock(%s)'            # el lock se libera igual
+    with pytest.raises(ValueError):
+        mg.migrate([M(2, 'x', ''), M(1, 'y', '')], conn=conn)
+    assert [m.version for m in mg.MIGRATIONS] == sorted({m.version for m in mg.MIGRATIONS})
+
+
+def test_invalid_concurrent_index_is_dropped_before_rebuild():
+    mg = load_migrations()
+    M = mg.Migration
+    plan = [M(1, 'idx', ['CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_a ON a (x)',
+                         'CREATE UNIQUE INDEX CONCURRENTLY idx_b ON a (y)'], False)]
+    conn = FakeConn()
+    conn.invalid = {'idx_a'}                                          # build anterior cortado
+    assert mg.migrate(plan, conn=conn) == [1]
+    drop = conn.log.index('DROP INDEX CONCURRENTLY IF EXISTS idx_a')
+    assert drop < conn.log.index(plan[0].sql[0])
+    assert not conn.invalid
+    assert not any(s.endswith('idx_b') for s in conn.log if s.startswith('DROP'))
@@ -0,0 +1,64 @@
+import importlib.util
+
+
+def load_offer_engine():
+    spec = importlib.util.spec_from_file_location('backend.offer_engine', 'backend/offer_engine.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_index(engine):
+    items = [
+        {'id': 1, 'applied_on': '2_product_category', 'categ_id': [5, 'Todo'], 'fixed_price': 90,
+         'min_quantity': 0, 'date_start': False, 'date_end': False},
+        {'id': 2, 'applied_on': '1_product', 'product_tmpl_id': [10, 'Taladro'], 'fixed_price': 80,
+         'min_quantity': 0, 'date_start': '2026-01-01 00:00:00', 'date_end': '2026-01-31 12:00:00'},
+        {'id': 3, 'applied_on': '1_product', 'product_tmpl_id': [10, 'Taladro'], 'fixed_price': 70,
+         'min_quantity': 10, 'date_start': False, 'date_end': False},
+        {'id': 4, 'applied_on': '0_product_variant', 'product_id': [100, 'Taladro'], 'fixed_price': 60,
+         'min_quantity': 0, 'date_start': '2026-02-01', 'date_end': '2026-02-01'},
+    ]
+    variants = [{'id': 100, 'default_code': 'TAL-1', 'product_tmpl_id': [10, 'Taladro']}]
+    templates = [{'id': 10, 'default_code': 'TAL-1', 'categ_id': [12, 'Herramientas']},
+                 {'id': 11, 'default_code': 'AMO-1', 'categ_id': [12, 'Herramientas']}]
+    categories = [{'id': 12, 'parent_path': '1/5/12/'}]
+    return engine.OfferIndex(items, variants, templates, categories)
+
+
+def test_precedence_min_quantity_and_windows():
+    engine = load_offer_engine()
+    idx = build_index(engine)
+    jan = '2026-01-15 10:00:00'
+    assert idx.price('TAL-1', qty=1, at=jan) == 80          # plantilla dentro de la ventana
+    assert idx.price('TAL-1', qty=10, at=jan) == 70         # mayor min_quantity primero
+    assert idx.price('TAL-1', qty=1, at='2026-01-31 12:00:01') == 90  # venció: cae a la categoría padre
+    assert idx.price('TAL-1', qty=1, at='2026-02-01 23:59:00') == 60  # variante, día completo
+    assert idx.price('AMO-1', at=jan) == 90
+    assert idx.price('NO-EXISTE', at=jan) is None
+    assert idx.price('NO-EXISTE', at=jan, categ_id=12) == 90
+
+
+def test_batch_keeps_order():
+    engine = load_offer_engine()
+    idx = build_index(engine)
+    lines = [{'sku': 'AMO-1'}, {'sku': 'TAL-1', 'qty': 12}, {'sku': 'X'}]
+    assert idx.prices(lines, at='2026-03-01 00:00:00') == [90, 70, None]
+
+
+def test_overlapping_category_rules_follow_odoo_order():
+    engine = load_offer_engine()
+    # Odoo: min_quantity desc, categ_id desc, id desc — el id de la categoría, no su profundidad
+    items = [
+        {'id': 1, 'applied_on': '2_product_category', 'categ_id': [12, 'Taladros'], 'fixed_price': 85,
+         'min_quantity': 0, 'date_start': False, 'date_end': False},
+        {'id': 2, 'applied_on': '2_product_category', 'categ_id': [30, 'Herramientas'], 'fixed_price': 95,
+         'min_quantity': 0, 'date_start': False, 'date_end': False},
+        {'id': 3, 'applied_on': '2_product_category', 'categ_id': [30, 'Herramientas'], 'fixed_price': 75,
+         'min_quantity': 5, 'date_start': False, 'date_end': False},
+    ]
+    templates = [{'id': 10, 'default_code': 'TAL-1', 'categ_id': [12, 'Taladros']}]
+    categories = [{'id': 12, 'parent_path': '1/30/12/'}]
+    idx = engine.OfferIndex(items, (), templates, categories)
+    assert idx.price('TAL-1', qty=1) == 95       # categ 30 > 12 aunque sea la padre
+    assert idx.price('TAL-1', qty=5) == 75       # mayor min_quantity gana sobre la categoría
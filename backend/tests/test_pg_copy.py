@@ -0,0 +1,43 @@
+import importlib.util
+import io
+from datetime import datetime
+
+
+def load_pg_copy():
+    spec = importlib.util.spec_from_file_location('backend.pg_copy', 'backend/pg_copy.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeCursor:
+    def __init__(self):
+        self.sql = None
+        self.data = None
+    def copy_expert(self, sql, buf):
+        self.sql = sql
+        self.data = buf.read()
+
+
+def test_copy_rows_escapes_text_format():
+    pg_copy = load_pg_copy()
+    cur = FakeCursor()
+    rows = [
+        (1, 'a\tb', None, 2.5),
+        (2, 'line\nbreak\\', True, datetime(2024, 1, 2, 3, 4, 5)),
+    ]
+    pg_copy.copy_rows(cur, 'stage', ['id', 'name', 'flag', 'v'], rows)
+    assert cur.sql == 'COPY stage (id, name, flag, v) FROM STDIN'
+    assert cur.data == (
+        '1\ta\\tb\t\\N\t2.5\n'
+        '2\tline\\nbreak\\\\\tt\t2024-01-02T03:04:05\n'
+    )
+
+
+def test_content_hash_is_stable_and_content_sensitive():
+    pg_copy = load_pg_copy()
+    a = pg_copy.content_hash(['X', 10.0, None])
+    assert a == pg_copy.content_hash(('X', 10.0, None))
+    assert a != pg_copy.content_hash(['X', 10.5, None])
+    assert pg_copy.odoo_value(False) is None
+    assert pg_copy.odoo_value(0) == 0
@@ -0,0 +1,104 @@
+import asyncio
+import importlib.util
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+def load_redis_cache():
+    spec = importlib.util.spec_from_file_location('redis_cache', 'src/utils/redis_cache.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeUpstash(BaseHTTPRequestHandler):
+    """Imita la API REST: POST / (un comando), /pipeline y /multi-exec."""
+    store = {}
+    requests = []
+    fail_next = 0
+
+    def log_message(self, *a):
+        pass
+
+    def _run(self, cmd):
+        op, args = cmd[0].upper(), cmd[1:]
+        if op == 'SET':
+            self.store[args[0]] = args[1]
+            return {'result': 'OK'}
+        if op == 'GET':
+            return {'result': self.store.get(args[0])}
+        if op == 'MGET':
+            return {'result': [self.store.get(k) for k in args]}
+        return {'error': f'ERR unknown command {op}'}
+
+    def do_POST(self):
+        cls = type(self)
+        cls.requests.append(self.path)
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if cls.fail_next:
+            cls.fail_next -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+        if self.headers.get('Authorization') != 'Bearer t0k':
+            out, status = {'error': 'Unauthorized'}, 401
+        elif self.path in ('/pipeline', '/multi-exec'):
+            out, status = [self._run(c) for c in body], 200
+        else:
+            out, status = self._run(body), 200
+        data = json.dumps(out).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve():
+    FakeUpstash.store, FakeUpstash.requests, FakeUpstash.fail_next = {}, [], 0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeUpstash)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def test_pipeline_one_round_trip_and_retry_on_503():
+    rc = load_redis_cache()
+    server, url = serve()
+    try:
+        client = rc.RedisRest(url, 't0k', retries=2)
+        FakeUpstash.fail_next = 1
+        assert client.set('a', {'x': 1}, ex_seconds=60) == 'OK'   # reintenta el 503
+        with client.pipeline() as p:
+            p.set('b', [1, 2]).get('a')
+        assert FakeUpstash.requests == ['/', '/', '/pipeline']
+        assert client.mget(['a', 'b', 'zz']) == [{'x': 1}, [1, 2], None]
+        with pytest.raises(rc.RedisRestError):
+            client.pipeline(transaction=True).command('GET', 'b').command('NOPE').execute()
+        assert FakeUpstash.requests[-1] == '/multi-exec'
+        FakeUpstash.fail_next, n = 1, len(FakeUpstash.requests)
+        with pytest.raises(rc.requests.HTTPError):
+            client.execute('INCR', 'visitas')                    # no idempotente: un 503 no se reintenta
+        assert len(FakeUpstash.requests) == n + 1
+    finally:
+        server.shutdown()
+
+
+def test_async_client():
+    rc = load_redis_cache()
+    server, url = serve()
+    try:
+        async def run():
+            client = rc.AsyncRedisRest(url, 't0k', retries=0)
+            await client.set('k', {'v': 1})
+            got = await asyncio.gather(client.get('k'), client.get('missing'))
+            results = await client.execute_many([['GET', 'k'], ['SET', 'j', '2']])
+            await client.aclose()
+            return got, results
+        got, results = asyncio.run(run())
+        assert got == [{'v': 1}, None]
+        assert results == [json.dumps({'v': 1}), 'OK']
+    finally:
+        server.shutdown()
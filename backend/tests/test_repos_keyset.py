@@ -0,0 +1,100 @@
+import importlib.util
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, 'backend')
+
+
+def load_repos(monkeypatch):
+    monkeypatch.setenv('DATABASE_URL', 'postgres://x')
+    spec = importlib.util.spec_from_file_location('backend.repos', 'backend/repos.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_cursor_roundtrip_and_nulls_last(monkeypatch):
+    repos = load_repos(monkeypatch)
+    cur = repos.encode_cursor(datetime(2026, 5, 1, 10, 30), 42)
+    assert repos.decode_cursor(cur) == ('2026-05-01T10:30:00', 42)
+    sql, params = repos._keyset('write_date', 'id', cur, desc=True)
+    assert sql == ' AND (write_date, id) < (%s, %s)'          # sin OR: Index Cond, no Filter
+    assert params == ['2026-05-01T10:30:00', 42]
+    sql, params = repos._keyset('name', 'cliente_id', repos.encode_cursor(None, 7), desc=False)
+    assert sql == ' AND name IS NULL AND cliente_id > %s' and params == [7]
+    with pytest.raises(ValueError):
+        repos.decode_cursor('nope')
+
+
+def test_search_pages_with_cursor_and_counts_first_page_only(monkeypatch):
+    repos = load_repos(monkeypatch)
+    table = [{'id': i, 'name': f'p{i}', 'default_code': None, 'list_price': 1,
+              'write_date': datetime(2026, 1, 1 + i % 3)} for i in range(1, 8)]
+    table.sort(key=lambda r: (r['write_date'], r['id']), reverse=True)
+    calls = []
+
+    def fake_query(sql, params):
+        calls.append(sql)
+        limit, offset = params[-2], params[-1]
+        rows = table
+        if 'write_date, id) <' in sql:
+            wd, rid = datetime.fromisoformat(params[0]), params[1]
+            rows = [r for r in table if (r['write_date'], r['id']) < (wd, rid)]
+        elif 'write_date IS NULL' in sql:
+            rows = [r for r in table if r['write_date'] is None]
+        return rows[offset:offset + limit]
+
+    monkeypatch.setattr(repos, 'db_query', fake_query)
+    monkeypatch.setattr(repos, 'estimate_rows', lambda sql, params=None: 7)
+    monkeypatch.setattr(repos.dal, 'scalar', lambda sql, params=None, default=None: 7)
+    seen, cursor, first = [], None, None
+    for _ in range(10):
+        page = repos.search_productos_db(None, 3, cursor=cursor)
+        first = first or page
+        seen += [i['id'] for i in page['items']]
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+    else:
+        pytest.fail('la paginación no terminó')
+    assert seen == [r['id'] for r in table]
+    assert first['total'] == 7 and first['total_estimated'] is False and page['total'] is None
+    assert not any('json_agg' in c or 'count(*)' in c for c in calls)
+    assert sum('write_date IS NULL' in c for c in calls) == 1   # paso a la cola de NULL
+
+
+def test_null_tail_is_reached_after_non_null_rows(monkeypatch):
+    repos = load_repos(monkeypatch)
+    table = [{'id': i, 'name': n, 'vat': None} for i, n in
+             [(1, 'b'), (2, 'a'), (3, None), (4, 'c'), (5, None), (6, None)]]
+    table.sort(key=lambda r: (r['name'] is None, r['name'] or '', r['id']))
+    calls = []
+
+    def fake_query(sql, params):
+        calls.append(sql)
+        assert ' OR ' not in sql
+        n, skip = params[-2], params[-1]
+        rows = table
+        if '(name, cliente_id) >' in sql:
+            rows = [r for r in rows if r['name'] is not None and (r['name'], r['id']) > (params[1], params[2])]
+        elif 'name IS NULL AND cliente_id >' in sql:
+            rows = [r for r in rows if r['name'] is None and r['id'] > params[1]]
+        elif 'name IS NULL' in sql:
+            rows = [r for r in rows if r['name'] is None]
+        return rows[skip:skip + n]
+
+    monkeypatch.setattr(repos, 'db_query', fake_query)
+    monkeypatch.setattr(repos.dal, 'scalar', lambda sql, params=None, default=None: len(table))
+    seen, cursor = [], None
+    for _ in range(10):
+        page = repos.get_clientes_vendedor_db('20111', limit=2, cursor=cursor)
+        seen += [r['id'] for r in page['items']]
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+    else:
+        pytest.fail('la paginación no terminó')
+    assert seen == [2, 1, 4, 3, 5, 6]
+    assert sum('name IS NULL' in c and 'cliente_id >' not in c for c in calls) == 1   # paso a la cola de NULL
@@ -0,0 +1,45 @@
+import importlib.util
+import sys
+from contextlib import contextmanager
+
+import pytest
+
+sys.path.insert(0, 'backend')
+
+
+def load_repos(monkeypatch):
+    monkeypatch.setenv('DATABASE_URL', 'postgres://x')
+    spec = importlib.util.spec_from_file_location('backend.repos', 'backend/repos.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_insert_pedido_cache_not_retried_after_send(monkeypatch):
+    repos = load_repos(monkeypatch)
+    dal = repos.dal
+    sent = []
+
+    class Cur:
+        connection = type('C', (), {'encoding': 'UTF8'})()
+        def __enter__(self):
+            return self
+        def __exit__(self, *exc):
+            pass
+        def mogrify(self, template, args):
+            return template.encode()
+        def execute(self, sql, params=None):
+            sent.append(sql)
+            raise dal.psycopg2.OperationalError('server closed the connection unexpectedly')
+
+    @contextmanager
+    def connection():
+        yield type('Conn', (), {'cursor': lambda self, **kw: Cur()})()
+
+    monkeypatch.setattr(dal, 'connection', connection)
+    monkeypatch.setattr(dal.time, 'sleep', lambda s: None)
+    monkeypatch.setattr(dal, 'PG_RETRIES', 3)
+    with pytest.raises(dal.psycopg2.OperationalError):
+        repos.insert_pedido_cache_db(1, 'ARS', 1.0, 100, 21, 121, {'a': 1}, {'ok': True})
+    assert len(sent) == 1                        # el INSERT pudo haberse aplicado: no se repite
+    assert b'RETURNING id' in sent[0]
@@ -0,0 +1,78 @@
+import importlib.util
+import time
+
+
+def load_scheduler():
+    spec = importlib.util.spec_from_file_location('backend.scheduler', 'backend/scheduler.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {}
+    def set(self, k, v, nx=False, px=None):
+        if nx and k in self.store:
+            return None
+        self.store[k] = v
+        return True
+    def eval(self, script, numkeys, key, token, *args):
+        if self.store.get(key) != token:
+            return 0
+        if 'del' in script:
+            del self.store[key]
+        return 1
+
+
+def test_run_once_records_and_releases_lease():
+    sched = load_scheduler()
+    runs = []
+    fake = FakeRedis()
+    s = sched.Scheduler(fake, on_run=lambda *a: runs.append(a))
+    job = s.add(sched.Job('products', lambda: 7, 60))
+    assert s.run_once(job) is True
+    assert runs[0][0] == 'products' and runs[0][4] == 7 and runs[0][5] is None
+    assert fake.store == {}
+
+
+def test_run_once_skips_when_lease_taken_and_records_errors():
+    sched = load_scheduler()
+    fake = FakeRedis()
+    fake.store['salbom:job:stock'] = 'other'
+    s = sched.Scheduler(fake)
+    job = s.add(sched.Job('stock', lambda: 1, 60))
+    assert s.run_once(job) is False
+    assert job.state['skipped'] == 1
+
+    def boom():
+        raise RuntimeError('odoo caído')
+    bad = s.add(sched.Job('offers', boom, 60))
+    assert s.run_once(bad) is True
+    assert bad.state['errors'] == 1 and 'odoo caído' in bad.state['last_error']
+
+
+def test_redis_error_fails_closed_and_lost_lease_flags_run():
+    sched = load_scheduler()
+
+    class DownRedis:
+        def set(self, *a, **kw):
+            raise ConnectionError('redis caído')
+    s = sched.Scheduler(DownRedis())
+    ran = []
+    job = s.add(sched.Job('stock', lambda: ran.append(1), 60))
+    assert s.run_once(job) is False
+    assert ran == [] and job.state['skipped'] == 1 and job.state['lease_errors'] == 1
+
+    fake = FakeRedis()
+    runs = []
+    s = sched.Scheduler(fake, on_run=lambda *a: runs.append(a))
+
+    def slow():
+        fake.store['salbom:job:kpis'] = 'otra-replica'   # el lease venció y lo tomó otra réplica
+        time.sleep(0.7)                                  # el heartbeat (cada 0.5s) lo nota
+        return 3
+    job = s.add(sched.Job('kpis', slow, 60, lease_ttl=0.6))
+    assert s.run_once(job) is True
+    assert job.state['lease_lost'] == 1
+    assert 'lease perdido' in runs[0][5]
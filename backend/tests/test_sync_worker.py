@@ -0,0 +1,250 @@
+import importlib.util
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, 'backend')
+
+
+def load_sync_worker():
+    spec = importlib.util.spec_from_file_location('backend.sync_worker', 'backend/sync_worker.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeModel:
+    """search_read de Odoo sobre dicts: write_date con µs, devuelto truncado al segundo."""
+
+    OPS = {'>': lambda a, b: a > b, '>=': lambda a, b: a >= b, '<': lambda a, b: a < b,
+           '<=': lambda a, b: a <= b, '=': lambda a, b: a == b}
+
+    def __init__(self, records):
+        self.records = records
+        self.calls = []
+
+    def _match(self, r, domain):
+        for field, op, value in domain:
+            got = r[field]
+            if field == 'write_date':
+                value = datetime.fromisoformat(value)
+            if not self.OPS[op](got, value):
+                return False
+        return True
+
+    def search_read(self, domain, fields=None, order='id asc', limit=None):
+        self.calls.append((domain, order))
+        rows = [r for r in self.records if self._match(r, domain)]
+        if order.startswith('write_date'):
+            rows.sort(key=lambda r: (r['write_date'], r['id']), reverse='desc' in order)
+        else:
+            rows.sort(key=lambda r: r['id'], reverse='desc' in order)
+        rows = rows[:limit] if limit else rows
+        return [{**r, 'write_date': r['write_date'].strftime('%Y-%m-%d %H:%M:%S')} for r in rows]
+
+
+def stub_spec(applied):
+    return {'domain': [], 'fields': ['id', 'write_date'], 'map': lambda r: r,
+            'upsert': lambda rows: applied.extend(r['id'] for r in rows) or len(rows),
+            'bulk': lambda rows: applied.extend(r['id'] for r in rows) or len(rows)}
+
+
+def test_cursor_domain_pages_within_the_truncated_second():
+    sw = load_sync_worker()
+    assert sw._cursor_domain('2026-03-01 10:00:59', 7) == [
+        ('write_date', '>=', '2026-03-01 10:00:59'),
+        ('write_date', '<', '2026-03-01 10:01:00'),
+        ('id', '>', 7),
+    ]
+    assert sw._after_domain('2026-03-01 23:59:59') == [('write_date', '>=', '2026-03-02 00:00:00')]
+
+
+def test_incremental_pages_a_bulk_write_larger_than_the_batch(monkeypatch):
+    sw = load_sync_worker()
+    saved = []
+    monkeypatch.setattr(sw, 'save_sync_state', lambda name, wd, last_id, full=False: saved.append((wd, last_id)))
+    base = datetime(2026, 3, 1, 10, 0, 0)
+    # 25 registros en el mismo segundo con µs en orden inverso al id, más otros después
+    records = [{'id': i, 'write_date': base + timedelta(microseconds=1000 - i)} for i in range(1, 26)]
+    records += [{'id': 100 + i, 'write_date': base + timedelta(seconds=1 + i // 3, microseconds=i)}
+                for i in range(12)]
+    records.append({'id': 999, 'write_date': base - timedelta(seconds=5)})     # ya aplicado
+    applied = []
+    state = {'cursor_write_date': '2026-03-01 09:59:58', 'cursor_id': 0}
+    sw._sync_incremental('products', stub_spec(applied), FakeModel(records), state, limit=10)
+    assert sorted(set(applied)) == sorted(r['id'] for r in records if r['id'] != 999)
+    assert saved == sorted(saved)
+    assert saved[-1] == ('2026-03-01 10:00:04', 111)
+
+    # Segunda corrida desde el cursor guardado: no hay nada nuevo
+    again = []
+    sw._sync_incremental('products', stub_spec(again), FakeModel(records),
+                         {'cursor_write_date': saved[-1][0], 'cursor_id': saved[-1][1]}, limit=10)
+    assert again == []
+
+
+def test_incremental_fails_fast_when_the_cursor_does_not_move(monkeypatch):
+    sw = load_sync_worker()
+    monkeypatch.setattr(sw, 'save_sync_state', lambda *a, **kw: None)
+
+    class StuckModel:
+        def search_read(self, domain, fields=None, order=None, limit=None):
+            return [{'id': i, 'write_date': '2026-03-01 10:00:00'} for i in range(1, limit + 1)]
+
+    with pytest.raises(RuntimeError, match='no avanzó'):
+        sw._sync_incremental('products', stub_spec([]), StuckModel(),
+                             {'cursor_write_date': '2026-03-01 10:00:00', 'cursor_id': 0}, limit=5)
+
+
+def test_stock_sync_limit_is_batch_size_not_a_cap(monkeypatch):
+    sw = load_sync_worker()
+    model = FakeModel([{'id': i, 'write_date': datetime(2026, 1, 1), 'qty_available': i} for i in range(1, 8)])
+    monkeypatch.setattr(sw, '_odoo_client', lambda: type('C', (), {'env': {'product.product': model}})())
+    updated = []
+    monkeypatch.setattr(sw, 'update_stock_qty', lambda rows: updated.extend(r['id'] for r in rows) or len(rows))
+    assert sw.sync_stock(limit=3) == 7
+    assert updated == list(range(1, 8)) and len(model.calls) == 3
+
+
+@pytest.mark.parametrize('lo,hi,parts', [(1, 10, 4), (1, 3, 8), (5, 5, 3), (1, 100, 3), (10, 11, 2), (7, 1000, 7)])
+def test_partition_ranges_are_contiguous_without_gaps_or_overlaps(lo, hi, parts):
+    sw = load_sync_worker()
+    ranges = sw._partition_ranges(lo, hi, parts)
+    assert len(ranges) == min(parts, hi - lo + 1)
+    assert ranges[0][0] == lo - 1 and ranges[-1][1] == hi      # (desde exclusivo, hasta inclusivo]
+    assert all(a < b for a, b in ranges)
+    assert all(ranges[i][1] == ranges[i + 1][0] for i in range(len(ranges) - 1))
+    covered = [i for a, b in ranges for i in range(a + 1, b + 1)]
+    assert covered == list(range(lo, hi + 1))
+
+
+def stub_odoo(monkeypatch, sw, models):
+    client = type('C', (), {'env': models})()
+    monkeypatch.setattr(sw, '_odoo_client', lambda: client)
+    monkeypatch.setattr(sw, '_worker_client', lambda: client)
+
+
+def test_partitioned_sync_does_not_finish_a_model_with_a_failed_partition(monkeypatch):
+    sw = load_sync_worker()
+    wd = datetime(2026, 1, 1)
+
+    class FailingModel(FakeModel):
+        def search_read(self, domain, **kw):
+            if ('id', '>', 50) in domain:
+                raise RuntimeError('odoo timeout')
+            return super().search_read(domain, **kw)
+
+    products = FakeModel([{'id': i, 'write_date': wd} for i in range(1, 101)])
+    partners = FailingModel([{'id': i, 'write_date': wd} for i in range(1, 101)])
+    stub_odoo(monkeypatch, sw, {'product.product': products, 'res.partner': partners})
+    applied = {'products': [], 'partners': []}
+    for name in applied:
+        monkeypatch.setitem(sw.SYNC_SPECS, name, {**sw.SYNC_SPECS[name], **stub_spec(applied[name])})
+    events = []
+    monkeypatch.setattr(sw, 'save_full_checkpoint', lambda name, rid, *mark: events.append(('checkpoint', name, rid, *mark)))
+    monkeypatch.setattr(sw, 'finish_full_sync', lambda name: events.append(('finish', name)))
+    monkeypatch.setattr(sw, '_reconcile_after_full', lambda name: events.append(('reconcile', name)))
+
+    report = sw.run_partitioned_sync(partitions=2, max_workers=2, limit=20)
+    assert sorted(applied['products']) == list(range(1, 101))
+    assert report['models']['products']['rows'] == 100
+    assert [p['range'] for p in report['models']['products']['partitions']] == [[1, 50], [51, 100]]
+    assert report['errors'] == [{'model': 'partners', 'range': [51, 100], 'error': 'odoo timeout'}]
+    assert ('finish', 'products') in events and ('reconcile', 'products') in events
+    assert ('finish', 'partners') not in events and ('reconcile', 'partners') not in events
+    # El checkpoint queda en 0: el próximo sync_model de partners retoma la pasada en serie
+    assert ('checkpoint', 'partners', 0, '2026-01-01 00:00:00', 0) in events
+
+
+def test_sorted_difference_merge():
+    sw = load_sync_worker()
+    assert sw._sorted_difference([], []) == []
+    assert sw._sorted_difference([], [1, 2]) == []
+    assert sw._sorted_difference([1, 2, 3], []) == [1, 2, 3]
+    assert sw._sorted_difference([1, 2, 3], [4, 5]) == [1, 2, 3]
+    assert sw._sorted_difference([2, 4, 6, 8], [1, 2, 3, 6, 9]) == [4, 8]
+    assert sw._sorted_difference([1, 2, 2, 5], [2, 2, 3]) == [1, 5]
+
+
+def tombstone_stub(monkeypatch, sw, live, local):
+    model = type('M', (), {'search': lambda self, domain, order=None, limit=None: type('R', (), {
+        'ids': [i for i in live if i > domain[-1][2]][:limit]})()})()
+    stub_odoo(monkeypatch, sw, {'product.product': model})
+    marked = []
+    monkeypatch.setitem(sw.TOMBSTONE_SPECS, 'products', {
+        **sw.TOMBSTONE_SPECS['products'], 'local_ids': lambda: local,
+        'mark': lambda ids, hard=False: marked.append((list(ids), hard)) or len(ids)})
+    return marked
+
+
+def test_reconcile_marks_missing_ids_and_skips_when_odoo_returns_none(monkeypatch):
+    sw = load_sync_worker()
+    monkeypatch.setattr(sw, 'SYNC_ID_CHUNK', 2)                      # _live_ids pagina de a 2
+    marked = tombstone_stub(monkeypatch, sw, live=[1, 3, 4, 7], local=[1, 2, 3, 5, 7])
+    res = sw.reconcile_tombstones('products', hard=True)
+    assert marked == [([2, 5], True)]
+    assert res == {'model': 'products', 'local': 5, 'live': 4, 'missing': 2, 'marked': 2}
+
+    marked = tombstone_stub(monkeypatch, sw, live=[], local=[1, 2])
+    res = sw.reconcile_tombstones('products')
+    assert marked == [] and res['skipped'] is True
+
+    marked = tombstone_stub(monkeypatch, sw, live=[1, 2], local=[1, 2])
+    assert sw.reconcile_tombstones('products')['missing'] == 0 and marked == []
+
+
+class FakeSyncState:
+    """sync_state en memoria, con la semántica de db.save_full_checkpoint / finish_full_sync."""
+
+    def __init__(self, sw, monkeypatch):
+        self.rows = {}
+        monkeypatch.setattr(sw, 'get_sync_state', lambda name: dict(self.rows[name]) if name in self.rows else None)
+        monkeypatch.setattr(sw, 'save_full_checkpoint', self.checkpoint)
+        monkeypatch.setattr(sw, 'finish_full_sync', self.finish)
+        monkeypatch.setattr(sw, '_reconcile_after_full', lambda name: None)
+
+    def checkpoint(self, name, resume_id, mark_wd=None, mark_id=None):
+        row = self.rows.setdefault(name, {'cursor_write_date': None, 'cursor_id': 0, 'last_full_utc': None,
+                                          'full_mark_write_date': None, 'full_mark_id': None})
+        row['full_resume_id'] = resume_id
+        row['full_mark_write_date'] = mark_wd if mark_wd is not None else row['full_mark_write_date']
+        row['full_mark_id'] = mark_id if mark_id is not None else row['full_mark_id']
+
+    def finish(self, name):
+        row = self.rows[name]
+        row['cursor_write_date'] = row['full_mark_write_date'] or row['cursor_write_date']
+        row['cursor_id'] = row['full_mark_id'] if row['full_mark_id'] is not None else row['cursor_id']
+        row.update(last_full_utc=datetime.now(), full_resume_id=None, full_mark_write_date=None, full_mark_id=None)
+
+
+def test_full_pass_resumes_from_checkpoint_and_ends_at_the_high_water_mark(monkeypatch):
+    sw = load_sync_worker()
+    state = FakeSyncState(sw, monkeypatch)
+    base = datetime(2026, 3, 1, 10, 0, 0)
+    model = FakeModel([{'id': i, 'write_date': base + timedelta(seconds=i % 5)} for i in range(1, 24)])
+    stub_odoo(monkeypatch, sw, {'product.product': model})
+    applied, batches = [], []
+
+    def bulk(rows):
+        batches.append(len(batches))
+        if len(batches) == 3:
+            raise ConnectionError('se cortó')
+        applied.extend(r['id'] for r in rows)
+        return len(rows)
+
+    monkeypatch.setitem(sw.SYNC_SPECS, 'products', {**sw.SYNC_SPECS['products'], **stub_spec([]), 'bulk': bulk})
+    with pytest.raises(ConnectionError):
+        sw.sync_model('products', limit=5)
+    assert applied == list(range(1, 11))
+    assert state.rows['products']['full_resume_id'] == 10
+    assert state.rows['products']['full_mark_write_date'] == '2026-03-01 10:00:04'
+
+    # La corrida siguiente retoma desde id > 10 (no vuelve a empezar) y cierra la pasada
+    model.calls.clear()
+    sw.sync_model('products', limit=5)
+    assert applied == list(range(1, 24))
+    assert ('id', '>', 10) in model.calls[0][0]
+    row = state.rows['products']
+    assert (row['cursor_write_date'], row['cursor_id']) == ('2026-03-01 10:00:04', 0)
+    assert row['full_resume_id'] is None and row['last_full_utc'] is not None
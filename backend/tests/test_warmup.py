@@ -0,0 +1,61 @@
+import importlib.util
+import sys
+import time
+
+sys.path.insert(0, 'backend')
+
+
+def load_warmup():
+    spec = importlib.util.spec_from_file_location('backend.warmup', 'backend/warmup.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {}
+
+    def set(self, k, v, nx=False, px=None, ex=None):
+        if nx and k in self.store:
+            return False
+        self.store[k] = v
+        return True
+
+    def get(self, k):
+        return self.store.get(k)
+
+    def eval(self, script, n, key, token, *args):
+        if self.store.get(key) == token:
+            if 'del' in script:
+                del self.store[key]
+            return 1
+        return 0
+
+
+def test_owner_runs_plan_and_followers_see_progress():
+    wu = load_warmup()
+    r = FakeRedis()
+    ran = []
+    plan = lambda: [('a', lambda: ran.append('a')), ('b', lambda: 1 / 0), ('c', lambda: ran.append('c'))]
+    follower = wu.Warmup(r, plan, run_id='abc')
+    assert follower.status()['state'] == 'warming'      # nadie arrancó todavía
+    owner = wu.Warmup(r, plan, concurrency=2, run_id='abc')
+    state = owner.run()
+    assert state['state'] == 'ready' and sorted(ran) == ['a', 'c']
+    assert (state['done'], state['failed'], state['total']) == (2, 1, 3)
+    assert 'b' in state['errors']
+    assert follower.status()['state'] == 'ready' and follower.status()['done'] == 2
+    # Otro worker del mismo deploy no vuelve a correr el plan
+    again = wu.Warmup(r, plan, run_id='abc')
+    again.run()
+    assert sorted(ran) == ['a', 'c'] and again.is_ready()
+
+
+def test_timeout_declares_ready():
+    wu = load_warmup()
+    r = FakeRedis()
+    owner = wu.Warmup(r, lambda: [('lento', lambda: time.sleep(0.5))], timeout=0.05, run_id='x')
+    state = owner.run()
+    assert state['state'] == 'ready' and state['timed_out']
+    assert wu.Warmup(None, lambda: []).is_ready()      # sin Redis no hay nada que calentar
@@ -0,0 +1,51 @@
+import importlib.util
+import sys
+import threading
+import time
+
+sys.path.insert(0, 'backend')
+
+
+def load_write_behind():
+    spec = importlib.util.spec_from_file_location('backend.write_behind', 'backend/write_behind.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_batches_by_size_and_time():
+    wb = load_write_behind()
+    batches, done = [], threading.Event()
+
+    def writer(rows):
+        batches.append(list(rows))
+        if sum(map(len, batches)) == 5:
+            done.set()
+
+    w = wb.WriteBehind('t', 'INSERT INTO t VALUES %s', batch_size=3, flush_ms=50, writer=writer)
+    for i in range(5):
+        assert w.put((i,))
+    assert done.wait(2)
+    assert batches == [[(0,), (1,), (2,)], [(3,), (4,)]]    # 3 por tamaño, 2 por tiempo
+    assert w.stats()['written'] == 5 and w.stats()['batches'] == 2
+    w.close()
+
+
+def test_bounded_queue_drops_and_close_flushes():
+    wb = load_write_behind()
+    gate, written = threading.Event(), []
+
+    def writer(rows):
+        gate.wait(2)
+        written.extend(rows)
+
+    w = wb.WriteBehind('t', 'INSERT INTO t VALUES %s', max_rows=2, batch_size=1, flush_ms=10, writer=writer)
+    w.put(('a',))
+    time.sleep(0.1)                       # el hilo toma 'a' y queda trabado en el writer
+    assert w.put(('b',)) and w.put(('c',))
+    assert w.put(('d',)) is False         # cola llena: se descarta, el request no espera
+    gate.set()
+    w.close()
+    assert written == [('a',), ('b',), ('c',)]
+    assert w.stats()['dropped'] == 1 and w.stats()['pending'] == 0
+    assert 't' in wb.stats()
@@ -0,0 +1,120 @@
+# backend/tools/bench_cache_codec.py
+"""
+Micro-benchmark de codecs de cache (cache_codec.py) sobre payloads reales.
+
+Uso (desde backend/):
+    python tools/bench_cache_codec.py                      # payloads sintéticos con forma real
+    python tools/bench_cache_codec.py dump1.json dump2.json  # respuestas guardadas de la API
+    python tools/bench_cache_codec.py --from-redis 'catalogo:*' 'clientes_del_comercial:*'
+
+Para cada payload y codec reporta: tiempo de encode/decode (µs, mediana),
+bytes en la red (largo del valor) y, si hay REDIS_URL, MEMORY USAGE de la key.
+"""
+import os, sys, json, time, random, statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cache_codec  # noqa: E402
+from cache_codec import Codec  # noqa: E402
+
+CODECS = [
+    Codec("json", "none"),
+    Codec("orjson", "none"),
+    Codec("msgpack", "none"),
+    Codec("json", "zlib", 1024),
+    Codec("orjson", "zlib", 1024),
+    Codec("orjson", "zstd", 1024),
+    Codec("msgpack", "zstd", 1024),
+]
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "200"))
+
+
+def _synthetic():
+    """Misma forma que /productos (página de 20 y la lista de 1000 templates) y /clientes_del_comercial."""
+    rnd = random.Random(42)
+    def producto(i):
+        sku = f"SB-{rnd.randint(10000, 99999)}"
+        return {
+            "id": i, "name": f"Taladro percutor {rnd.choice(['Gamma', 'Bosch', 'Dowen'])} {rnd.randint(500, 1200)}W",
+            "list_price": round(rnd.uniform(1000, 250000), 2), "price_offer": None, "default_code": sku,
+            "write_date": "2026-09-30 12:34:56", "categ_id": [rnd.randint(1, 300), "Herramientas / Eléctricas"],
+            "brand": "Gamma", "stock_state": "green", "stock_qty": rnd.randint(0, 500),
+            "image_thumb_url": f"https://firebasestorage.googleapis.com/v0/b/bucket/o/products%2F{sku}%2F{sku}.webp?alt=media",
+            "image_md_url": f"https://firebasestorage.googleapis.com/v0/b/bucket/o/products%2F{sku}%2F{sku}.webp?alt=media",
+        }
+    clientes = [{"id": i, "name": f"Ferretería {rnd.randint(1, 9999)} SRL", "vat": str(rnd.randint(20000000000, 30999999999))}
+                for i in range(800)]
+    return {
+        "productos_page": {"total": 1000, "items": [producto(i) for i in range(20)], "limit": 20, "offset": 0},
+        "catalogo_1000": {"campo_marca": "product_brand_id", "productos": [producto(i) for i in range(1000)]},
+        "clientes_800": clientes,
+        "plazos": [{"id": i, "nombre": f"{i * 15} días"} for i in range(11)],
+    }
+
+
+def _from_files(paths):
+    out = {}
+    for p in paths:
+        with open(p, "rb") as f:
+            out[os.path.basename(p)] = json.load(f)
+    return out
+
+
+def _from_redis(r, patterns, per_pattern=5):
+    out = {}
+    for pat in patterns:
+        for i, key in enumerate(r.scan_iter(match=pat, count=500)):
+            if i >= per_pattern:
+                break
+            raw = r.get(key)
+            if raw:
+                out[key.decode() if isinstance(key, bytes) else key] = cache_codec.loads(raw)
+    return out
+
+
+def _median_us(fn, arg):
+    samples = []
+    for _ in range(ROUNDS):
+        t0 = time.perf_counter()
+        fn(arg)
+        samples.append((time.perf_counter() - t0) * 1e6)
+    return statistics.median(samples)
+
+
+def main(argv):
+    redis_client = None
+    if os.getenv("REDIS_URL"):
+        import redis
+        redis_client = redis.Redis.from_url(os.getenv("REDIS_URL"))
+
+    if argv[:1] == ["--from-redis"]:
+        payloads = _from_redis(redis_client, argv[1:])
+    elif argv:
+        payloads = _from_files(argv)
+    else:
+        payloads = _synthetic()
+
+    print(f"orjson={'sí' if cache_codec.orjson else 'no'} msgpack={'sí' if cache_codec.msgpack else 'no'} "
+          f"zstd={'sí' if cache_codec.zstandard else 'no'} rondas={ROUNDS}")
+    print(f"{'payload':<28}{'codec':<22}{'bytes':>10}{'redis_mem':>11}{'enc µs':>10}{'dec µs':>10}")
+    for name, value in payloads.items():
+        seen = set()
+        for codec in CODECS:
+            if codec.name in seen:  # el codec cayó a otro por falta de la librería
+                continue
+            seen.add(codec.name)
+            blob = codec.dumps(value)
+            assert cache_codec.loads(blob) == json.loads(json.dumps(value))
+            mem = "-"
+            if redis_client:
+                k = f"bench:codec:{codec.name}"
+                redis_client.set(k, blob, ex=60)
+                mem = redis_client.memory_usage(k) or "-"
+                redis_client.delete(k)
+            size = len(blob.encode("utf-8") if isinstance(blob, str) else blob)
+            enc = _median_us(codec.dumps, value)
+            dec = _median_us(cache_codec.loads, blob)
+            print(f"{name[:27]:<28}{codec.name:<22}{size:>10}{mem:>11}{enc:>10.1f}{dec:>10.1f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
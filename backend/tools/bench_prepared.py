@@ -0,0 +1,79 @@
+# backend/tools/bench_prepared.py
+"""
+Micro-benchmark: consultas calientes con SQL plano vs statement preparado (dal.prepared).
+
+Uso (desde backend/, con DATABASE_URL apuntando a una base con datos):
+    python tools/bench_prepared.py              # cuit/user_id tomados de la base
+    python tools/bench_prepared.py 20123456789  # cuit a usar
+
+Corre cada consulta BENCH_ROUNDS veces sobre una misma conexión del pool, con
+el mismo parámetro, y reporta la mediana y el p95 (µs) de cada variante.
+La diferencia es lo que se ahorra de parseo/planificación por llamada; en
+consultas cortas por PK/índice suele ser la mayor parte del tiempo del servidor.
+"""
+import os, sys, time, statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import dal  # noqa: E402
+
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "2000"))
+
+# Mismas formas que las SQL_* de main.py
+CASES = [
+    ("app_user_role", "SELECT role FROM app_users WHERE cuit = %s", "cuit"),
+    ("app_user_login", "SELECT id, password_hash, role, name, is_active FROM app_users WHERE cuit = %s", "cuit"),
+    ("favorites_by_user", "SELECT product_id FROM app_user_favorites WHERE user_id = %s ORDER BY created_at DESC", "user_id"),
+    ("discount_rule", "SELECT discount, min_amount FROM app_payment_discounts WHERE payment_term_id = %s", "term"),
+    ("offers_active", "SELECT sku, price_offer FROM app_product_offers WHERE is_active = TRUE", None),
+]
+
+
+def _sample(cur, cuit):
+    cur.execute("SELECT cuit FROM app_users ORDER BY id LIMIT 1")
+    row = cur.fetchone()
+    cur.execute("SELECT user_id FROM app_user_favorites GROUP BY user_id ORDER BY count(*) DESC LIMIT 1")
+    fav = cur.fetchone()
+    cur.execute("SELECT payment_term_id FROM app_payment_discounts LIMIT 1")
+    term = cur.fetchone()
+    return {"cuit": cuit or (row[0] if row else "0"), "user_id": fav[0] if fav else 0, "term": term[0] if term else 0}
+
+
+def _timeit(fn):
+    samples = []
+    for _ in range(ROUNDS):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1e6)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main(argv):
+    if not dal.dsn():
+        sys.exit("Falta DATABASE_URL")
+    with dal.connection() as conn:
+        cur = conn.cursor()
+        args = _sample(cur, argv[0] if argv else None)
+        print(f"{'consulta':<20} {'plano p50':>10} {'p95':>8} {'prep p50':>10} {'p95':>8} {'ahorro':>7}")
+        for name, sql, arg in CASES:
+            params = (args[arg],) if arg else None
+            stmt = dal.prepared(f"bench_{name}", sql)
+
+            def plain():
+                cur.execute(sql, params)
+                cur.fetchall()
+
+            def prep():
+                dal.cursor_execute(cur, stmt, params)
+                cur.fetchall()
+
+            plain(); prep()                       # calentar (y PREPARE)
+            p50a, p95a = _timeit(plain)
+            p50b, p95b = _timeit(prep)
+            print(f"{name:<20} {p50a:>10.0f} {p95a:>8.0f} {p50b:>10.0f} {p95b:>8.0f} {1 - p50b / p50a:>7.0%}")
+            cur.execute(f"DEALLOCATE bench_{name}")
+            dal.get_pool().prepared_on(cur.connection).discard(f"bench_{name}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,109 @@
+# backend/tools/bench_trgm.py
+"""
+Benchmark de db.search_products (/productos_rapido) sobre una tabla sintética.
+
+Uso (desde backend/, con DATABASE_URL; crea todo en tablas TEMP, no toca `products`):
+    python tools/bench_trgm.py              # 200.000 filas
+    python tools/bench_trgm.py 500000
+
+Compara, sobre la misma tabla:
+  - antes:   ILIKE '%q%' + ORDER BY name + OFFSET, sin índices de trigramas
+  - después: misma búsqueda con GIN gin_trgm_ops en name/default_code y
+             orden por similitud (db.products_search_query)
+y, para el listado sin q, una página profunda con OFFSET vs con cursor keyset.
+Reporta la mediana (ms) de BENCH_ROUNDS corridas de cada consulta.
+"""
+import os, sys, time, statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import dal  # noqa: E402
+from db import products_search_query  # noqa: E402
+
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "15"))
+QUERIES = ["taladro", "gam", "SB-1234", "amoladora angular", "zzzz"]
+TABLE = "bench_products"
+
+OLD_SQL = f"""
+    select id, default_code, name, brand, category, price_list, currency, stock_qty
+    from {TABLE}
+    where deleted_utc is null and (name ilike %(q)s or default_code ilike %(q)s)
+    order by name asc
+    limit %(limit)s offset %(offset)s
+"""
+
+
+def _create(cur, n):
+    cur.execute(f"""
+        CREATE TEMP TABLE {TABLE} (
+            id BIGINT PRIMARY KEY, default_code TEXT, name TEXT NOT NULL, brand TEXT, category TEXT,
+            price_list NUMERIC(14,2), currency TEXT, stock_qty NUMERIC(14,2), deleted_utc TIMESTAMPTZ
+        )
+    """)
+    # Nombres con la forma del catálogo: tipo + marca + modelo + medida
+    cur.execute(f"""
+        INSERT INTO {TABLE} (id, default_code, name, brand, category, price_list, currency, stock_qty)
+        SELECT i,
+               'SB-' || lpad((i * 7919 % 100000)::text, 5, '0'),
+               (ARRAY['Taladro percutor','Amoladora angular','Llave combinada','Destornillador',
+                      'Sierra circular','Martillo','Pinza universal','Cinta métrica'])[1 + i % 8]
+                 || ' ' || (ARRAY['Gamma','Bosch','Dowen','Stanley','Black+Decker','Lusqtoff'])[1 + i % 6]
+                 || ' ' || (100 + i % 900)::text || ' ' || (ARRAY['mm','W','pulg','m'])[1 + i % 4],
+               (ARRAY['Gamma','Bosch','Dowen','Stanley','Black+Decker','Lusqtoff'])[1 + i % 6],
+               'Herramientas', (random() * 100000)::numeric(14,2), 'ARS', (random() * 500)::int
+        FROM generate_series(1, %s) AS i
+    """, (n,))
+    cur.execute(f"CREATE INDEX ON {TABLE} (name, id)")
+    cur.execute(f"ANALYZE {TABLE}")
+
+
+def _timeit(cur, sql, params):
+    samples = []
+    for _ in range(ROUNDS):
+        t0 = time.perf_counter()
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples), rows
+
+
+def main(argv):
+    if not dal.dsn():
+        sys.exit("Falta DATABASE_URL")
+    n = int(argv[0]) if argv else 200_000
+    with dal.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SET statement_timeout = 0")
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        t0 = time.perf_counter()
+        _create(cur, n)
+        print(f"{n} filas en {time.perf_counter() - t0:.1f}s")
+
+        before = {q: _timeit(cur, OLD_SQL, {"q": f"%{q}%", "limit": 50, "offset": 0})[0] for q in QUERIES}
+
+        t0 = time.perf_counter()
+        cur.execute(f"CREATE INDEX ON {TABLE} USING GIN (name gin_trgm_ops)")
+        cur.execute(f"CREATE INDEX ON {TABLE} USING GIN (default_code gin_trgm_ops)")
+        cur.execute(f"ANALYZE {TABLE}")
+        print(f"índices trgm en {time.perf_counter() - t0:.1f}s\n")
+
+        print(f"{'q':<20} {'antes ms':>9} {'después ms':>11} {'filas':>6}")
+        for q in QUERIES:
+            sql, params = products_search_query(q, 50, table=TABLE)
+            after, rows = _timeit(cur, sql, params)
+            print(f"{q:<20} {before[q]:>9.1f} {after:>11.1f} {len(rows):>6}")
+
+        # Página profunda del listado sin q: OFFSET vs keyset
+        deep = n // 2
+        sql, params = products_search_query(None, 50, offset=deep, table=TABLE)
+        by_offset, rows = _timeit(cur, sql, params)
+        cur.execute(f"SELECT name, id FROM {TABLE} ORDER BY name, id OFFSET %s LIMIT 1", (deep - 1,))
+        name, rid = cur.fetchone()
+        sql, params = products_search_query(None, 50, cursor=dal.encode_cursor(name, rid), table=TABLE)
+        by_cursor, rows2 = _timeit(cur, sql, params)
+        assert [r[0] for r in rows] == [r[0] for r in rows2]
+        print(f"\nlistado, fila {deep}: OFFSET {by_offset:.1f} ms  vs  cursor {by_cursor:.1f} ms")
+        conn.rollback()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
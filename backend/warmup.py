@@ -0,0 +1,144 @@
+# warmup.py
+"""
+Calentamiento de cache después de un deploy/reinicio.
+
+- Un solo worker (el que toma el lease en Redis) corre las tareas, con
+  concurrencia acotada; el resto sólo lee el progreso.
+- El progreso se publica en Redis (`status_key`) para que cualquier worker
+  pueda responder /health y /_diag/warmup.
+- Una corrida por `run_id` (el commit del deploy, o un id por proceso si no
+  hay commit): si ya quedó "ready" no se repite en los workers que arrancan
+  después.
+- Pasado `timeout` se declara listo aunque falten tareas (siguen en segundo
+  plano): el warm-up nunca deja la app fuera de servicio.
+"""
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from scheduler import Lease
+
+log = logging.getLogger("salbom.warmup")
+
+WARMING, READY = "warming", "ready"
+
+
+class Warmup:
+    def __init__(self, redis_client, plan, concurrency=4, timeout=120, run_id="boot",
+                 lease_key="salbom:warmup:lease", status_key="salbom:warmup:status", status_ttl=1800):
+        """`plan()` devuelve la lista de (nombre, fn) a correr; se evalúa al arrancar."""
+        self.redis = redis_client
+        self.plan = plan
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.run_id = run_id
+        self.lease_key = lease_key
+        self.status_key = status_key
+        self.status_ttl = status_ttl
+        self.owner = False
+        self._lock = threading.Lock()
+        self._thread = None
+        self.state = {
+            "state": WARMING if redis_client else READY, "run_id": run_id,
+            "total": 0, "done": 0, "failed": 0, "timed_out": False,
+            "started_at": None, "finished_at": None, "tasks": {}, "errors": {},
+        }
+
+    # ── estado compartido ──
+    def _publish(self):
+        if not self.redis:
+            return
+        try:
+            with self._lock:
+                payload = json.dumps(self.state)
+            self.redis.set(self.status_key, payload, ex=self.status_ttl)
+        except Exception as e:
+            log.warning(f"[WARMUP] no se pudo publicar el progreso: {e}")
+
+    def _remote(self):
+        try:
+            raw = self.redis.get(self.status_key)
+            return json.loads(raw) if raw else None
+        except Exception:
+            return None
+
+    def status(self):
+        if self.owner or not self.redis or self.state["state"] == READY:
+            with self._lock:
+                return dict(self.state, owner=self.owner)
+        remote = self._remote()
+        if not remote or remote.get("run_id") != self.run_id:
+            # Todavía nadie tomó el lease (o no hay warm-up en curso)
+            started = self.state.get("started_at")
+            if started and time.time() - started > self.timeout:
+                return dict(self.state, state=READY, owner=False)
+            return dict(self.state, owner=False)
+        if remote.get("state") == WARMING and time.time() - (remote.get("started_at") or 0) > self.timeout:
+            remote = dict(remote, state=READY, timed_out=True)
+        return dict(remote, owner=False)
+
+    def is_ready(self):
+        return self.status()["state"] == READY
+
+    # ── ejecución ──
+    def start(self):
+        if self._thread or self.state["state"] == READY:
+            return
+        self._thread = threading.Thread(target=self.run, daemon=True, name="cache-warmup")
+        self._thread.start()
+
+    def _run_task(self, name, fn):
+        t0 = time.monotonic()
+        try:
+            fn()
+            with self._lock:
+                self.state["done"] += 1
+                self.state["tasks"][name] = round((time.monotonic() - t0) * 1000, 1)
+        except Exception as e:
+            log.warning(f"[WARMUP] {name} falló: {e}")
+            with self._lock:
+                self.state["failed"] += 1
+                self.state["errors"][name] = str(e)[:300]
+        self._publish()
+
+    def run(self):
+        self.state["started_at"] = time.time()
+        remote = self._remote() if self.redis else None
+        if remote and remote.get("run_id") == self.run_id and remote.get("state") == READY:
+            self.state.update(remote)
+            log.info(f"[WARMUP] {self.run_id} ya calentado por otro worker.")
+            return self.state
+        lease = Lease(self.redis, self.lease_key, max(60, self.timeout))
+        if not lease.acquire():
+            log.info("[WARMUP] otro worker está calentando; sólo seguimos el progreso.")
+            return self.state
+        self.owner = True
+        pool = None
+        try:
+            try:
+                tasks = list(self.plan())
+            except Exception as e:
+                log.warning(f"[WARMUP] no se pudo armar el plan: {e}")
+                tasks = []
+            with self._lock:
+                self.state.update(state=WARMING, total=len(tasks), done=0, failed=0,
+                                  started_at=time.time(), tasks={}, errors={})
+            self._publish()
+            log.info(f"[WARMUP] {len(tasks)} tareas, concurrencia {self.concurrency}")
+            pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="warmup")
+            futures = [pool.submit(self._run_task, name, fn) for name, fn in tasks]
+            _, pending = wait(futures, timeout=self.timeout)
+            with self._lock:
+                self.state["timed_out"] = bool(pending)
+                self.state["state"] = READY
+                self.state["finished_at"] = time.time()
+            self._publish()
+            log.info(f"[WARMUP] listo: {self.state['done']}/{self.state['total']} "
+                     f"({self.state['failed']} con error, timeout={bool(pending)})")
+        finally:
+            if pool:
+                pool.shutdown(wait=False)
+            lease.release()
+        return self.state
@@ -0,0 +1,149 @@
+# write_behind.py
+"""
+Escritura diferida (write-behind) de filas de auditoría a Postgres.
+
+El request sólo encola la fila (put_nowait, sin I/O). Un hilo por cola junta
+hasta `batch_size` filas o espera `flush_ms` desde la primera, y las inserta en
+un solo INSERT ... VALUES multi-fila (dal.execute_values).
+
+- Memoria acotada: la cola tiene tope `max_rows`. Si se llena (Postgres caído
+  o lento) la fila se descarta y se cuenta en `dropped`; el request nunca espera.
+- Un lote que falla se loguea y sus filas van a `failed` (es auditoría: se
+  prefiere perder filas a frenar la app o acumular sin límite).
+- Al terminar el proceso (atexit, ej. apagado ordenado del worker de gunicorn)
+  se vacía lo pendiente, con un tope de `shutdown_timeout` seg.
+- Las columnas con DEFAULT NOW() toman la hora del flush, no la del encolado
+  (a lo sumo flush_ms de diferencia).
+"""
+import os
+import time
+import atexit
+import logging
+import threading
+from queue import Queue, Empty, Full
+
+import dal
+
+log = logging.getLogger("salbom.write_behind")
+
+WRITE_BEHIND_MAX_ROWS = int(os.getenv("WRITE_BEHIND_MAX_ROWS", "10000"))
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "500"))
+WRITE_BEHIND_FLUSH_MS = int(os.getenv("WRITE_BEHIND_FLUSH_MS", "1000"))
+WRITE_BEHIND_SHUTDOWN_TIMEOUT = float(os.getenv("WRITE_BEHIND_SHUTDOWN_TIMEOUT", "5"))
+
+_writers = {}
+
+
+class WriteBehind:
+    def __init__(self, name, sql, template=None, max_rows=WRITE_BEHIND_MAX_ROWS,
+                 batch_size=WRITE_BEHIND_BATCH, flush_ms=WRITE_BEHIND_FLUSH_MS,
+                 shutdown_timeout=WRITE_BEHIND_SHUTDOWN_TIMEOUT, writer=None):
+        """`sql` es un INSERT ... VALUES %s; `writer(rows)` reemplaza a dal.execute_values (tests)."""
+        self.name = name
+        self.sql = sql
+        self.template = template
+        self.batch_size = max(1, batch_size)
+        self.flush_s = max(1, flush_ms) / 1000.0
+        self.shutdown_timeout = shutdown_timeout
+        self.writer = writer or (lambda rows: dal.execute_values(self.sql, rows, self.template,
+                                                                  page_size=self.batch_size))
+        self._q = Queue(maxsize=max(1, max_rows))
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._last_drop_log = 0.0
+        self.counters = {"queued": 0, "written": 0, "dropped": 0, "failed": 0, "batches": 0}
+        _writers[name] = self
+
+    def _ensure_thread(self):
+        # Se arranca en el primer put (y de nuevo si el proceso se forkeó: el hilo no pasa al hijo)
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._loop, daemon=True,
+                                                name=f"write-behind-{self.name}")
+                self._thread.start()
+
+    def put(self, row):
+        """Encola una fila (tupla en el orden del template). False si se descartó por cola llena."""
+        self._ensure_thread()
+        try:
+            self._q.put_nowait(row)
+        except Full:
+            self.counters["dropped"] += 1
+            now = time.monotonic()
+            if now - self._last_drop_log > 10:
+                self._last_drop_log = now
+                log.warning(f"[WRITE-BEHIND] {self.name}: cola llena, {self.counters['dropped']} filas descartadas")
+            return False
+        self.counters["queued"] += 1
+        return True
+
+    def _write(self, batch):
+        try:
+            self.writer(batch)
+            self.counters["written"] += len(batch)
+            self.counters["batches"] += 1
+        except Exception as e:
+            self.counters["failed"] += len(batch)
+            log.error(f"[WRITE-BEHIND] {self.name}: lote de {len(batch)} filas perdido: {e}")
+
+    def _loop(self):
+        while True:
+            try:
+                batch = [self._q.get(timeout=self.flush_s)]
+            except Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            deadline = time.monotonic() + self.flush_s
+            while len(batch) < self.batch_size:
+                remaining = 0 if self._stop.is_set() else deadline - time.monotonic()
+                try:
+                    batch.append(self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait())
+                except Empty:
+                    break
+            self._write(batch)
+
+    def flush(self):
+        """Escribe ya, en este hilo, todo lo encolado. Devuelve filas escritas."""
+        written = 0
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._q.get_nowait())
+                except Empty:
+                    break
+            if not batch:
+                return written
+            self._write(batch)
+            written += len(batch)
+
+    def close(self, timeout=None):
+        """Detiene el hilo (terminando el lote en curso) y vacía la cola."""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(self.shutdown_timeout if timeout is None else timeout)
+        self.flush()
+
+    def stats(self):
+        return dict(self.counters, pending=self._q.qsize(), max_rows=self._q.maxsize)
+
+
+def stats():
+    return {name: w.stats() for name, w in _writers.items()}
+
+
+@atexit.register
+def _flush_all():
+    for w in list(_writers.values()):
+        try:
+            w.close()
+        except Exception as e:
+            log.error(f"[WRITE-BEHIND] {w.name}: no se pudo vaciar al salir: {e}")
@@ -1,3 +1,4 @@
+-- Lo aplica backend/migrations.py (versión 3); los cambios nuevos van como migración nueva ahí.
 -- Esquema mínimo (ajusta columnas según tus pantallas)
 create table if not exists products (
   id              bigint primary key,
@@ -22,3 +23,21 @@ create table if not exists partners (
 create index if not exists idx_products_name on products using gin (to_tsvector('simple', name));
 create index if not exists idx_products_default_code on products (default_code);
 create index if not exists idx_partners_vat on partners (vat);
+-- Cursor (write_date, id) por modelo para la sincronización incremental
+create table if not exists sync_state (
+  model             text primary key,
+  cursor_write_date text,            -- write_date de Odoo tal cual ('YYYY-MM-DD HH:MM:SS', UTC)
+  cursor_id         bigint not null default 0,
+  last_full_utc     timestamptz,
+  updated_utc       timestamptz not null default now()
+);
+-- Checkpoint de la pasada completa en curso (null = no hay ninguna)
+alter table sync_state add column if not exists full_resume_id       bigint;
+alter table sync_state add column if not exists full_mark_write_date text;
+alter table sync_state add column if not exists full_mark_id         bigint;
+-- Hash del contenido sincronizado: el upsert no reescribe filas sin cambios
+alter table products add column if not exists content_hash text;
+alter table partners add column if not exists content_hash text;
+-- Tombstone: fila que ya no está viva en Odoo (archivada, sin tag o borrada)
+alter table products add column if not exists deleted_utc timestamptz;
+alter table partners add column if not exists deleted_utc timestamptz;
@@ -1,25 +1,255 @@
-import requests
+"""
+Cliente Redis por REST (Upstash y compatibles).
+
+- Una `requests.Session` por cliente: keep-alive y pool de conexiones en vez de
+  abrir un socket por comando.
+- Timeouts (connect, read) en todas las llamadas y reintentos con backoff para
+  errores de conexión y 429. Un 5xx sólo se reintenta si todos los comandos
+  del POST son idempotentes (`_IDEMPOTENT`): con un INCR no se sabe si se aplicó.
+- `pipeline()` manda varios comandos en un solo POST a /pipeline;
+  `pipeline(transaction=True)` usa /multi-exec (atómico).
+- `AsyncRedisRest`: misma API con asyncio (httpx si está instalado; si no,
+  el cliente sync en un hilo).
+
+`redis_set` / `redis_get` se mantienen con la misma firma y formato (valor JSON).
+"""
 import os
 import json
+import time
+import asyncio
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except Exception:
+    httpx = None
 
 REDIS_URL = os.getenv("REDIS_REST_URL")
 REDIS_TOKEN = os.getenv("REDIS_REST_TOKEN")
+REDIS_REST_TIMEOUT = float(os.getenv("REDIS_REST_TIMEOUT", "3"))
+REDIS_REST_CONNECT_TIMEOUT = float(os.getenv("REDIS_REST_CONNECT_TIMEOUT", "2"))
+REDIS_REST_RETRIES = int(os.getenv("REDIS_REST_RETRIES", "3"))
+REDIS_REST_POOL = int(os.getenv("REDIS_REST_POOL", "10"))
+
+# 429: Upstash rechazó el request sin ejecutarlo, se reintenta siempre
+_RETRY_ALWAYS = (429,)
+_RETRY_IDEMPOTENT = (500, 502, 503, 504)
+# Repetirlos deja el mismo estado (SET sólo sin NX/XX/GET/KEEPTTL)
+_IDEMPOTENT = frozenset({"GET", "MGET", "SET", "DEL", "EXISTS", "TTL", "PTTL", "EXPIRE", "PING",
+                         "STRLEN", "TYPE", "HGET", "HGETALL", "SMEMBERS", "SISMEMBER", "SCARD", "SCAN"})
+
+
+class RedisRestError(Exception):
+    """Error devuelto por Redis (campo "error" de la respuesta)."""
+
+
+def _result(body):
+    if isinstance(body, dict) and body.get("error"):
+        raise RedisRestError(body["error"])
+    return body.get("result") if isinstance(body, dict) else body
+
+
+def _set_cmd(key, value, ex_seconds):
+    cmd = ["SET", key, json.dumps(value)]
+    if ex_seconds:
+        cmd += ["EX", int(ex_seconds)]
+    return cmd
+
+
+def _idempotent(commands):
+    for cmd in commands:
+        op = str(cmd[0]).upper()
+        if op not in _IDEMPOTENT:
+            return False
+        if op == "SET" and any(str(a).upper() in ("NX", "XX", "GET", "KEEPTTL") for a in cmd[3:]):
+            return False
+    return True
+
+
+def _decode(raw):
+    return json.loads(raw) if raw else None
+
+
+class RedisRest:
+    def __init__(self, url=None, token=None, timeout=None, connect_timeout=None,
+                 retries=None, pool_size=None):
+        self.url = (url or REDIS_URL or "").rstrip("/")
+        self.timeout = (connect_timeout or REDIS_REST_CONNECT_TIMEOUT, timeout or REDIS_REST_TIMEOUT)
+        retries = REDIS_REST_RETRIES if retries is None else retries
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {token or REDIS_TOKEN}"
+        # Todo va por POST y no todo es idempotente (INCR): urllib3 reintenta sólo lo
+        # que seguro no llegó a ejecutarse (conexión y 429); un timeout de lectura no
+        # (read=0), y los 5xx los reintenta _post sólo para comandos idempotentes.
+        self.retries = retries
+        retry = Retry(total=retries, connect=retries, read=0, status=retries,
+                      backoff_factor=0.2, status_forcelist=_RETRY_ALWAYS,
+                      allowed_methods=frozenset({"POST"}), raise_on_status=False)
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size or REDIS_REST_POOL,
+                              pool_maxsize=pool_size or REDIS_REST_POOL)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _post(self, path, payload):
+        retries = self.retries if _idempotent(payload if path else [payload]) else 0
+        for attempt in range(retries + 1):
+            resp = self.session.post(f"{self.url}{path}", json=payload, timeout=self.timeout)
+            if resp.status_code not in _RETRY_IDEMPOTENT or attempt == retries:
+                break
+            time.sleep(0.2 * (2 ** attempt))
+        if resp.status_code >= 400 and "application/json" not in resp.headers.get("Content-Type", ""):
+            resp.raise_for_status()
+        return resp.json()
+
+    def execute(self, *cmd):
+        """Un comando: execute("GET", "k") -> result."""
+        return _result(self._post("", list(cmd)))
+
+    def execute_many(self, commands, transaction=False):
+        """Varios comandos en un POST; devuelve los results en orden (excepción si alguno falló)."""
+        if not commands:
+            return []
+        body = self._post("/multi-exec" if transaction else "/pipeline", [list(c) for c in commands])
+        if isinstance(body, dict):  # multi-exec abortado entero
+            _result(body)
+        return [_result(b) for b in body]
+
+    def pipeline(self, transaction=False):
+        return Pipeline(self, transaction)
+
+    # ── helpers con valores JSON ──
+    def set(self, key, value, ex_seconds=300):
+        return self.execute(*_set_cmd(key, value, ex_seconds))
+
+    def get(self, key):
+        return _decode(self.execute("GET", key))
+
+    def mget(self, keys):
+        if not keys:
+            return []
+        return [_decode(v) for v in self.execute("MGET", *keys)]
+
+    def delete(self, *keys):
+        return self.execute("DEL", *keys) if keys else 0
+
+    def close(self):
+        self.session.close()
+
+
+class Pipeline:
+    """Acumula comandos y los manda juntos en execute(). Usable como context manager."""
+
+    def __init__(self, client, transaction=False):
+        self.client = client
+        self.transaction = transaction
+        self.commands = []
+
+    def command(self, *cmd):
+        self.commands.append(list(cmd))
+        return self
+
+    def set(self, key, value, ex_seconds=300):
+        return self.command(*_set_cmd(key, value, ex_seconds))
+
+    def get(self, key):
+        return self.command("GET", key)
+
+    def delete(self, *keys):
+        return self.command("DEL", *keys)
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return self.client.execute_many(commands, transaction=self.transaction)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and self.commands:
+            self.execute()
+
+
+class AsyncRedisRest:
+    """Versión asyncio. Con httpx usa un AsyncClient compartido; sin httpx delega al cliente sync en un hilo."""
+
+    def __init__(self, url=None, token=None, timeout=None, connect_timeout=None, retries=None, pool_size=None):
+        self._sync = RedisRest(url, token, timeout, connect_timeout, retries, pool_size)
+        self.retries = REDIS_REST_RETRIES if retries is None else retries
+        self._client = None
+        if httpx is not None:
+            limits = httpx.Limits(max_connections=pool_size or REDIS_REST_POOL,
+                                  max_keepalive_connections=pool_size or REDIS_REST_POOL)
+            self._client = httpx.AsyncClient(
+                headers=dict(self._sync.session.headers),
+                timeout=httpx.Timeout(self._sync.timeout[1], connect=self._sync.timeout[0]),
+                # sólo reintenta errores de conexión; 429/5xx se manejan en _post
+                transport=httpx.AsyncHTTPTransport(retries=self.retries, limits=limits),
+            )
+
+    async def _post(self, path, payload):
+        if self._client is None:
+            return await asyncio.to_thread(self._sync._post, path, payload)
+        retry_5xx = _idempotent(payload if path else [payload])
+        for attempt in range(self.retries + 1):
+            resp = await self._client.post(f"{self._sync.url}{path}", json=payload)
+            retryable = resp.status_code in _RETRY_ALWAYS or (retry_5xx and resp.status_code in _RETRY_IDEMPOTENT)
+            if not retryable or attempt == self.retries:
+                break
+            await asyncio.sleep(0.2 * (2 ** attempt))
+        if resp.status_code >= 400 and "application/json" not in resp.headers.get("Content-Type", ""):
+            resp.raise_for_status()
+        return resp.json()
+
+    async def execute(self, *cmd):
+        return _result(await self._post("", list(cmd)))
+
+    async def execute_many(self, commands, transaction=False):
+        if not commands:
+            return []
+        body = await self._post("/multi-exec" if transaction else "/pipeline", [list(c) for c in commands])
+        if isinstance(body, dict):
+            _result(body)
+        return [_result(b) for b in body]
+
+    async def set(self, key, value, ex_seconds=300):
+        return await self.execute(*_set_cmd(key, value, ex_seconds))
+
+    async def get(self, key):
+        return _decode(await self.execute("GET", key))
+
+    async def mget(self, keys):
+        if not keys:
+            return []
+        return [_decode(v) for v in await self.execute("MGET", *keys)]
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+        self._sync.close()
+
+
+_default = None
+
+
+def get_client():
+    """Cliente compartido del proceso (una sola Session)."""
+    global _default
+    if _default is None:
+        _default = RedisRest()
+    return _default
+
 
 def redis_set(key: str, value, ex_seconds=300):
     """Guarda un valor en Redis con tiempo de expiración."""
-    url = f"{REDIS_URL}/set/{key}"
-    headers = {"Authorization": f"Bearer {REDIS_TOKEN}"}
-    data = json.dumps(value)
-    response = requests.post(url, headers=headers, json={"value": data, "ex": ex_seconds})
-    return response.json()
+    return {"result": get_client().set(key, value, ex_seconds)}
+
 
 def redis_get(key: str):
     """Recupera un valor desde Redis (si existe)."""
-    url = f"{REDIS_URL}/get/{key}"
-    headers = {"Authorization": f"Bearer {REDIS_TOKEN}"}
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        body = response.json()
-        if body.get("result"):
-            return json.loads(body["result"])
-    return None
+    try:
+        return get_client().get(key)
+    except (requests.RequestException, RedisRestError, ValueError):
+        return None